@@ -0,0 +1,153 @@
+import time
+import asyncio
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, List, Optional, Tuple
+import metrics
+from config import (
+    REQUEST_BUDGET_S,
+    ADMISSION_MAX_INGESTIONS,
+    ADMISSION_MAX_GENERATIONS,
+    ADMISSION_QUEUE_SIZE,
+    ADMISSION_MAX_WAIT_S,
+)
+
+class OverloadedError(RuntimeError):
+    """Raised when a stage's waiting queue is full; the request is rejected without waiting."""
+    retry_after_s = 1
+
+class AdmissionTimeoutError(OverloadedError):
+    """Raised when no slot frees up within the request's remaining budget."""
+    retry_after_s = 5
+
+class RequestBudget:
+    """
+    Latency budget of one request, and the degradations applied to stay within it.
+
+    Stages ask for the remaining time and record each shortcut they take, so the response can
+    say which answers were produced with less work than usual. Without a budget the remaining
+    time is infinite and nothing is degraded.
+    """
+
+    def __init__(self, budget_s: Optional[float] = REQUEST_BUDGET_S):
+        self.budget_s = budget_s if budget_s and budget_s > 0 else None
+        self.expires_at = time.monotonic() + self.budget_s if self.budget_s else None
+        self.degradations: List[str] = []
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic() if self.expires_at is not None else float("inf")
+
+    def below(self, seconds: float) -> bool:
+        return self.remaining() < seconds
+
+    def time_until(self, seconds: float) -> Optional[float]:
+        """Time left before the remaining budget drops below `seconds`; None without a budget."""
+        return max(0.0, self.remaining() - seconds) if self.expires_at is not None else None
+
+    def degrade(self, name: str):
+        if name not in self.degradations:
+            print(f"Degrading request ({self.remaining():.2f}s left): {name}")
+            self.degradations.append(name)
+            metrics.record_degradation(name)
+
+class AdmissionController:
+    """
+    Bounds how many requests run a heavy stage at once.
+
+    Up to `max_concurrent` callers run; up to `max_queue` more wait for a slot, for at most their
+    remaining budget (or `max_wait_s`), and anyone beyond that is rejected straight away. Callers
+    without a budget, like background ingestion jobs, wait for a slot with no queue limit.
+    Waiters are served first come, first served: a released slot is handed straight to the
+    oldest waiter. State is guarded by a thread lock so every event loop in the process shares
+    the limits.
+    """
+
+    def __init__(self, name: str, max_concurrent: int, max_queue: int = ADMISSION_QUEUE_SIZE, max_wait_s: float = ADMISSION_MAX_WAIT_S):
+        self.name = name
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue = max_queue
+        self.max_wait_s = max_wait_s
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = deque()
+
+    def _try_acquire(self) -> bool:
+        with self._lock:
+            # Newcomers never overtake a queue that is already waiting
+            if self._in_flight < self.max_concurrent and not self._waiters:
+                self._in_flight += 1
+                return True
+            return False
+
+    def _release(self):
+        with self._lock:
+            while self._waiters:
+                loop, future = self._waiters.popleft()
+                try:
+                    # The slot passes to the waiter as is, so the in-flight count stays the same
+                    loop.call_soon_threadsafe(self._grant, future)
+                    return
+                except RuntimeError:
+                    # The waiter's event loop has closed; offer the slot to the next one
+                    continue
+            self._in_flight -= 1
+
+    def _grant(self, future: asyncio.Future):
+        """Runs on the waiter's loop; a waiter that gave up in the meantime passes the slot on."""
+        if future.done():
+            self._release()
+        else:
+            future.set_result(None)
+
+    async def _wait(self, budget: Optional[RequestBudget]):
+        bounded = budget is not None
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        with self._lock:
+            if self._in_flight < self.max_concurrent and not self._waiters:
+                # A slot freed up since the fast path looked
+                self._in_flight += 1
+                return
+            if bounded and len(self._waiters) >= self.max_queue:
+                metrics.record_admission(self.name, "rejected")
+                raise OverloadedError(f"Too many requests waiting for {self.name}; try again shortly")
+            waiter = (loop, future)
+            self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(future, min(budget.remaining(), self.max_wait_s) if bounded else None)
+        except BaseException as e:
+            with self._lock:
+                try:
+                    self._waiters.remove(waiter)
+                    granted = False
+                except ValueError:
+                    # Already handed a slot; `_grant` releases it unless it had been set before we gave up
+                    granted = future.done() and not future.cancelled()
+            if granted:
+                self._release()
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.record_admission(self.name, "timed_out")
+                raise AdmissionTimeoutError(f"No {self.name} capacity became available within the request's budget") from None
+            raise
+
+    @asynccontextmanager
+    async def admit(self, budget: Optional[RequestBudget] = None) -> AsyncIterator[None]:
+        if not self._try_acquire():
+            await self._wait(budget)
+        metrics.record_admission(self.name, "admitted")
+        try:
+            yield
+        finally:
+            self._release()
+
+_controllers_lock = threading.Lock()
+_controllers: Dict[str, AdmissionController] = {}
+_LIMITS = {"ingestion": ADMISSION_MAX_INGESTIONS, "generation": ADMISSION_MAX_GENERATIONS}
+
+def get_admission(stage: str) -> AdmissionController:
+    """The process-wide controller for "ingestion" or "generation"."""
+    with _controllers_lock:
+        if stage not in _controllers:
+            _controllers[stage] = AdmissionController(stage, _LIMITS[stage])
+        return _controllers[stage]
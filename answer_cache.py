@@ -0,0 +1,166 @@
+import os
+import re
+import time
+import json
+import hashlib
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
+from config import ANSWER_CACHE_PATH, ANSWER_CACHE_TTL_S, ANSWER_CACHE_MAX_ENTRIES
+
+def normalize_question(question: str) -> str:
+    return re.sub(r"\s+", " ", question).strip().lower()
+
+def scope_key(content_hashes: Sequence[str]) -> str:
+    """Cache scope of a set of documents: the content hash itself for one, a joined sorted list for several."""
+    return "+".join(sorted(set(content_hashes)))
+
+def _load_sources(raw: Optional[str]) -> List[str]:
+    return json.loads(raw) if raw else []
+
+class AnswerCache:
+    """
+    Persistent cache of generated answers.
+
+    Exact entries are keyed by (document content hash, normalized question, answer model,
+    prompt version), so a new document version, model or prompt never reuses stale answers.
+    Entries may also carry the question's embedding; the semantic tier then reuses the
+    closest cached answer for the same document/model/prompt when its cosine similarity
+    reaches a threshold. Entries expire `ttl_s` seconds after they were generated and the
+    least recently used ones are dropped beyond `max_entries`.
+
+    For a request over several documents the content hash is the scope of the whole set (see
+    `scope_key`). Each answer keeps the content hashes of the documents it cites.
+    """
+
+    def __init__(self, path: str = ANSWER_CACHE_PATH, ttl_s: float = ANSWER_CACHE_TTL_S, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl_s = ttl_s
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with self._connect() as conn:
+            # WAL lets serving workers read while another process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS answers (
+                    key TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    model TEXT NOT NULL,
+                    prompt_version TEXT NOT NULL,
+                    question TEXT NOT NULL,
+                    answer TEXT NOT NULL,
+                    embedding BLOB,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            if "sources" not in [row[1] for row in conn.execute("PRAGMA table_info(answers)")]:
+                conn.execute("ALTER TABLE answers ADD COLUMN sources TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_scope ON answers (content_hash, model, prompt_version)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_answers_last_access ON answers (last_access)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _key(self, content_hash: str, question: str, model: str, prompt_version: str) -> str:
+        raw = "\0".join((content_hash, normalize_question(question), model, prompt_version))
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _fresh_after(self) -> float:
+        return time.time() - self.ttl_s if self.ttl_s else 0.0
+
+    def get_many(self, content_hash: str, questions: Sequence[str], model: str, prompt_version: str) -> Dict[int, Tuple[str, List[str]]]:
+        """Exact lookups; returns {question index: (answer, cited content hashes)} for the hits."""
+        keys = [self._key(content_hash, q, model, prompt_version) for q in questions]
+        with self._connect() as conn:
+            placeholders = ",".join("?" * len(keys))
+            rows = {key: (answer, _load_sources(sources)) for key, answer, sources in conn.execute(
+                f"SELECT key, answer, sources FROM answers WHERE key IN ({placeholders}) AND created_at >= ?",
+                (*keys, self._fresh_after()),
+            ).fetchall()} if keys else {}
+            if rows:
+                conn.executemany("UPDATE answers SET last_access = ? WHERE key = ?", [(time.time(), key) for key in rows])
+        return {i: rows[key] for i, key in enumerate(keys) if key in rows}
+
+    def get_similar(
+        self,
+        content_hash: str,
+        vectors: Dict[int, List[float]],
+        model: str,
+        prompt_version: str,
+        threshold: float,
+    ) -> Dict[int, Tuple[str, List[str]]]:
+        """Semantic lookups; returns {question index: (answer, cited content hashes)} where a cached question is close enough."""
+        if not vectors:
+            return {}
+        with self._connect() as conn:
+            rows = conn.execute(
+                """SELECT key, answer, embedding, sources FROM answers WHERE content_hash = ? AND model = ?
+                   AND prompt_version = ? AND embedding IS NOT NULL AND created_at >= ?""",
+                (content_hash, model, prompt_version, self._fresh_after()),
+            ).fetchall()
+            if not rows:
+                return {}
+            cached = np.vstack([np.frombuffer(row[2], dtype=np.float32) for row in rows])
+            cached /= np.maximum(np.linalg.norm(cached, axis=1, keepdims=True), 1e-12)
+            indices = list(vectors)
+            queries = np.asarray([vectors[i] for i in indices], dtype=np.float32)
+            queries /= np.maximum(np.linalg.norm(queries, axis=1, keepdims=True), 1e-12)
+            similarity = queries @ cached.T
+            best = similarity.argmax(axis=1)
+            hits = {}
+            for row_index, question_index in enumerate(indices):
+                if similarity[row_index, best[row_index]] >= threshold:
+                    row = rows[best[row_index]]
+                    hits[question_index] = (row[1], _load_sources(row[3]))
+            if hits:
+                used = {rows[best[row_index]][0] for row_index, i in enumerate(indices) if i in hits}
+                conn.executemany("UPDATE answers SET last_access = ? WHERE key = ?", [(time.time(), key) for key in used])
+        return hits
+
+    def put_many(
+        self,
+        content_hash: str,
+        questions: Sequence[str],
+        answers: Sequence[str],
+        model: str,
+        prompt_version: str,
+        vectors: Optional[Sequence[Optional[List[float]]]] = None,
+        sources: Optional[Sequence[List[str]]] = None,
+    ):
+        now = time.time()
+        vectors = vectors or [None] * len(questions)
+        sources = sources or [[]] * len(questions)
+        rows = [
+            (
+                self._key(content_hash, question, model, prompt_version),
+                content_hash, model, prompt_version, normalize_question(question), answer,
+                np.asarray(vector, dtype=np.float32).tobytes() if vector is not None else None,
+                now, now, json.dumps(list(cited)),
+            )
+            for question, answer, vector, cited in zip(questions, answers, vectors, sources)
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                """INSERT OR REPLACE INTO answers (key, content_hash, model, prompt_version, question, answer,
+                   embedding, created_at, last_access, sources) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                rows,
+            )
+            self._evict(conn)
+
+    def _evict(self, conn: sqlite3.Connection):
+        if self.ttl_s:
+            conn.execute("DELETE FROM answers WHERE created_at < ?", (self._fresh_after(),))
+        excess = conn.execute("SELECT COUNT(*) FROM answers").fetchone()[0] - self.max_entries
+        if excess > 0:
+            conn.execute(
+                "DELETE FROM answers WHERE key IN (SELECT key FROM answers ORDER BY last_access LIMIT ?)",
+                (excess,),
+            )
@@ -0,0 +1,359 @@
+"""
+Offline benchmark for the RAG service.
+
+Generates synthetic PDF, DOCX and email documents, serves them from a local HTTP server
+and a directory-backed blob container, and runs the service against the fake chat and
+embedding models (MODEL_PROVIDER=fake), so results are repeatable and need no API keys.
+
+Measures per-stage cold/warm latency of QueryService.process_queries, parse throughput
+per format, throughput and latency of the FastAPI endpoint under concurrency, and peak
+RSS. Results are written as JSON so runs can be diffed between versions:
+
+    python benchmark.py --pages 100 --questions 10 --requests 40 --concurrency 8 --output before.json
+
+Startup is measured in fresh interpreters: the time to `import main` and the time for the
+warmup to make the service ready. `--startup` measures only that and exits non-zero when the
+median import time exceeds IMPORT_TIME_BUDGET_S, so it can gate CI:
+
+    python benchmark.py --startup
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import asyncio
+import argparse
+import platform
+import resource
+import tempfile
+import functools
+import threading
+import subprocess
+import statistics
+import http.server
+import zipfile
+from contextlib import contextmanager
+from typing import Dict, List
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, default=50, help="pages per synthetic PDF")
+    parser.add_argument("--docx-paragraphs", type=int, default=500, help="paragraphs per synthetic DOCX")
+    parser.add_argument("--email-kb", type=int, default=64, help="body size of the synthetic email in KiB")
+    parser.add_argument("--questions", type=int, default=8, help="questions per request")
+    parser.add_argument("--requests", type=int, default=32, help="requests in the concurrency run")
+    parser.add_argument("--concurrency", type=int, default=8, help="requests in flight during the concurrency run")
+    parser.add_argument("--latency-ms", type=float, default=50, help="simulated latency of each fake model call")
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default=None, help="vector backend (default: VECTOR_BACKEND)")
+    parser.add_argument("--output", default="-", help="JSON results file, '-' for stdout")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory")
+    parser.add_argument("--startup", action="store_true", help="only measure startup and enforce the import-time budget")
+    parser.add_argument("--startup-runs", type=int, default=5, help="fresh interpreters used to measure startup")
+    return parser.parse_args()
+
+def configure_environment(args: argparse.Namespace, workdir: str):
+    """Point every setting at the fakes and the scratch directory before the service modules load config."""
+    os.environ.update({
+        "MODEL_PROVIDER": "fake",
+        "FAKE_MODEL_LATENCY_MS": str(args.latency_ms),
+        "VECTOR_DB_DIR": os.path.join(workdir, "vector_db"),
+        "DOC_CACHE_DIR": os.path.join(workdir, "doc_cache"),
+        "EMBEDDING_CACHE_DIR": os.path.join(workdir, "embedding_cache"),
+        "ANSWER_CACHE_PATH": os.path.join(workdir, "answer_cache", "answers.sqlite3"),
+        "METRICS_ENABLED": "true",
+    })
+    os.environ.setdefault("GOOGLE_API_KEY", "benchmark")
+    os.environ.setdefault("API_AUTH_TOKEN", "benchmark")
+    os.environ.setdefault("AZURE_STORAGE_ACCOUNT_URL", "https://benchmark.invalid")
+    os.environ.setdefault("AZURE_STORAGE_CONTAINER", "benchmark")
+    os.environ.setdefault("AZURE_STORAGE_KEY", "YmVuY2htYXJr")
+    if args.backend:
+        os.environ["VECTOR_BACKEND"] = args.backend
+
+# --- Synthetic documents ---
+WORDS = ("policy coverage premium claim insured hospital treatment waiting period grace exclusion "
+         "benefit limit deductible renewal maternity surgery room rent ambulance donor cataract").split()
+
+def _sentence(i: int, n: int = 14) -> str:
+    return " ".join(WORDS[(i * 7 + j * 3) % len(WORDS)] for j in range(n)).capitalize() + f" (clause {i})."
+
+def make_pdf(path: str, pages: int, seed: int = 0):
+    """Distinct seeds give distinct content, so the files are not deduplicated by content hash."""
+    import pymupdf
+    doc = pymupdf.open()
+    for page_number in range(pages):
+        page = doc.new_page()
+        text = "\n".join(_sentence(seed * 100003 + page_number * 40 + line) for line in range(40))
+        page.insert_textbox(pymupdf.Rect(50, 50, 560, 800), text, fontsize=8)
+    doc.save(path)
+    doc.close()
+
+def make_docx(path: str, paragraphs: int):
+    body = "".join(f"<w:p><w:r><w:t>{_sentence(i)}</w:t></w:r></w:p>" for i in range(paragraphs))
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as docx:
+        docx.writestr("[Content_Types].xml", (
+            '<?xml version="1.0" encoding="UTF-8"?><Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/word/document.xml" ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+            '</Types>'
+        ))
+        docx.writestr("_rels/.rels", (
+            '<?xml version="1.0" encoding="UTF-8"?><Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="word/document.xml"/>'
+            '</Relationships>'
+        ))
+        docx.writestr("word/document.xml", (
+            '<?xml version="1.0" encoding="UTF-8"?><w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+            f'<w:body>{body}</w:body></w:document>'
+        ))
+
+def make_email(path: str, body_kb: int):
+    from email.message import EmailMessage
+    message = EmailMessage()
+    message["Subject"] = "Policy clarification"
+    message["From"] = "claims@example.com"
+    message["To"] = "member@example.com"
+    lines, size, i = [], 0, 0
+    while size < body_kb * 1024:
+        lines.append(_sentence(i))
+        size += len(lines[-1]) + 1
+        i += 1
+    message.set_content("\n".join(lines))
+    with open(path, "wb") as f:
+        f.write(bytes(message))
+
+def serve_directory(directory: str) -> http.server.ThreadingHTTPServer:
+    class QuietHandler(http.server.SimpleHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), functools.partial(QuietHandler, directory=directory))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+@contextmanager
+def stdout_to_stderr():
+    """The service (and its parse workers) log with print; keep stdout clean for the JSON report."""
+    sys.stdout.flush()
+    saved = os.dup(1)
+    os.dup2(2, 1)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        os.dup2(saved, 1)
+        os.close(saved)
+
+# --- Measurements ---
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+
+def summarize(latencies: List[float]) -> Dict[str, float]:
+    ordered = sorted(latencies)
+    def percentile(p: float) -> float:
+        return ordered[min(len(ordered) - 1, int(round(p * (len(ordered) - 1))))]
+    return {
+        "count": len(ordered),
+        "mean_s": statistics.fmean(ordered),
+        "p50_s": percentile(0.50),
+        "p95_s": percentile(0.95),
+        "max_s": ordered[-1],
+    }
+
+def questions_for(tag: str, count: int):
+    from models import Question
+    return [Question(question=f"{tag}: what does the policy say about {WORDS[i % len(WORDS)]} ({i})?") for i in range(count)]
+
+def timed_service_call(query_service, url: str, questions) -> Dict[str, object]:
+    import metrics
+    timings = metrics.start_request_timings()
+    start = time.perf_counter()
+    query_service.process_queries(url, questions)
+    return {"total_s": time.perf_counter() - start, "stages_s": dict(timings or {})}
+
+def bench_parsing(paths: Dict[str, str]) -> Dict[str, Dict[str, float]]:
+    from pdf_loader import ParallelPDFLoader
+    from docx_loader import DocxLoader
+    from email_loader import EmailLoader
+    loaders = {"pdf": ParallelPDFLoader, "docx": DocxLoader, "email": EmailLoader}
+    results = {}
+    for kind, path in paths.items():
+        start = time.perf_counter()
+        docs = list(loaders[kind](path).lazy_load())
+        elapsed = time.perf_counter() - start
+        chars = sum(len(doc.page_content) for doc in docs)
+        results[kind] = {"bytes": os.path.getsize(path), "documents": len(docs), "chars": chars, "seconds": elapsed, "chars_per_s": chars / elapsed if elapsed else 0.0}
+    return results
+
+def bench_service(base_url: str, args: argparse.Namespace) -> Dict[str, object]:
+    from query_service import QueryService
+    query_service = QueryService()
+    url = f"{base_url}/service.pdf"
+    return {
+        # New document: download, parse, embed, index, then answer
+        "cold": timed_service_call(query_service, url, questions_for("cold", args.questions)),
+        # Indexed document, new questions: retrieval and generation only
+        "warm": timed_service_call(query_service, url, questions_for("warm", args.questions)),
+        # Same questions again: served from the answer cache
+        "repeat": timed_service_call(query_service, url, questions_for("warm", args.questions)),
+    }
+
+async def bench_blob(args: argparse.Namespace, blob_dir: str) -> Dict[str, object]:
+    import document_fetcher
+    from fakes import FakeContainerClient
+    from query_service import QueryService
+    document_fetcher._fetcher = document_fetcher.DocumentFetcher(container_client=FakeContainerClient(blob_dir))
+    query_service = QueryService()
+    start = time.perf_counter()
+    await query_service.aprocess_queries("blob://blob.pdf", questions_for("blob", args.questions))
+    return {"cold_total_s": time.perf_counter() - start}
+
+async def bench_endpoint(base_url: str, args: argparse.Namespace) -> Dict[str, object]:
+    import httpx
+    import main
+    headers = {"Authorization": f"Bearer {os.environ['API_AUTH_TOKEN']}"}
+    transport = httpx.ASGITransport(app=main.app)
+    latencies: List[float] = []
+    failures = 0
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        async def one(i: int):
+            nonlocal failures
+            # A few documents shared across requests: a mix of cold ingestion and warm reuse
+            body = {
+                "documents": f"{base_url}/endpoint-{i % 4}.pdf",
+                "questions": [q.question for q in questions_for(f"r{i}", args.questions)],
+            }
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post("/api/v1/hackrx/run", json=body, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                failures += response.status_code != 200
+
+        start = time.perf_counter()
+        await asyncio.gather(*[one(i) for i in range(args.requests)])
+        elapsed = time.perf_counter() - start
+
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "failures": failures,
+        "seconds": elapsed,
+        "requests_per_s": args.requests / elapsed,
+        "latency": summarize(latencies),
+    }
+
+STARTUP_PROBE = """
+import json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter() - start
+main.warm_up()
+print(json.dumps({"import_s": imported, "ready_s": time.perf_counter() - start, "status": main.readiness["status"]}))
+"""
+
+def bench_startup(args: argparse.Namespace) -> Dict[str, object]:
+    """Import and warm up `main` in fresh interpreters, as a server process would on start."""
+    from config import IMPORT_TIME_BUDGET_S
+    runs = []
+    for _ in range(max(1, args.startup_runs)):
+        completed = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+        # The probe's JSON is the last line; warmup logging comes before it
+        runs.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+    import_s = summarize([run["import_s"] for run in runs])
+    return {
+        "runs": len(runs),
+        "import_s": import_s,
+        "ready_s": summarize([run["ready_s"] for run in runs]),
+        "warmup_failures": sum(run["status"] != "ready" for run in runs),
+        "import_budget_s": IMPORT_TIME_BUDGET_S,
+        "within_import_budget": import_s["p50_s"] <= IMPORT_TIME_BUDGET_S,
+    }
+
+def run_benchmarks(results: Dict[str, object], args: argparse.Namespace, docs_dir: str, blob_dir: str, base_url: str):
+    results["startup"] = bench_startup(args)
+    if args.startup:
+        return
+    results["parse"] = bench_parsing({
+        "pdf": os.path.join(docs_dir, "service.pdf"),
+        "docx": os.path.join(docs_dir, "parse.docx"),
+        "email": os.path.join(docs_dir, "parse.eml"),
+    })
+    results["service"] = bench_service(base_url, args)
+    results["peak_rss_mb_after_service"] = peak_rss_mb()
+    results["blob"] = asyncio.run(bench_blob(args, blob_dir))
+    results["endpoint"] = asyncio.run(bench_endpoint(base_url, args))
+    results["peak_rss_mb"] = peak_rss_mb()
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return "unknown"
+
+def main():
+    args = parse_args()
+    workdir = tempfile.mkdtemp(prefix="rag-benchmark-")
+    configure_environment(args, workdir)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    docs_dir = os.path.join(workdir, "documents")
+    blob_dir = os.path.join(workdir, "blobs")
+    os.makedirs(docs_dir)
+    os.makedirs(blob_dir)
+    start = time.perf_counter()
+    if not args.startup:
+        make_pdf(os.path.join(docs_dir, "service.pdf"), args.pages, seed=0)
+        make_pdf(os.path.join(blob_dir, "blob.pdf"), args.pages, seed=1)
+        for i in range(4):
+            make_pdf(os.path.join(docs_dir, f"endpoint-{i}.pdf"), args.pages, seed=2 + i)
+        make_docx(os.path.join(docs_dir, "parse.docx"), args.docx_paragraphs)
+        make_email(os.path.join(docs_dir, "parse.eml"), args.email_kb)
+    generation_s = time.perf_counter() - start
+
+    server = serve_directory(docs_dir)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    results: Dict[str, object] = {"generation_s": generation_s}
+    try:
+        with stdout_to_stderr():
+            run_benchmarks(results, args, docs_dir, blob_dir, base_url)
+    finally:
+        server.shutdown()
+        from worker_pool import shutdown_process_pool
+        shutdown_process_pool()
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        "run_id": uuid.uuid4().hex,
+        "revision": git_revision(),
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "vector_backend": os.environ.get("VECTOR_BACKEND", "chroma"),
+        "parameters": vars(args),
+        "results": results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output == "-":
+        print(output)
+    else:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Benchmark results written to {args.output}")
+    startup = results["startup"]
+    if args.startup and not startup["within_import_budget"]:
+        print(f"Import time {startup['import_s']['p50_s']:.3f}s exceeds the budget of {startup['import_budget_s']:.3f}s", file=sys.stderr)
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
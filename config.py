@@ -9,5 +9,165 @@ API_AUTH_TOKEN = os.getenv("API_AUTH_TOKEN")
 EMBEDDING_MODEL = "models/embedding-001"
 ANSWER_LLM_MODEL = "gemini-2.0-flash"
 QUERY_LLM_MODEL = "gemini-2.0-flash-lite"
-if not GOOGLE_API_KEY:
-    raise ValueError("GOOGLE_API_KEY must be set in the .env file.")
\ No newline at end of file
+
+# Chunking parameters; part of the ingestion manifest key, so changing them triggers a re-ingest
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1000))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 150))
+
+VECTOR_DB_DIR = os.getenv("VECTOR_DB_DIR", "./vector_db")
+
+# Serving processes; uvicorn reads WEB_CONCURRENCY itself. With more than one worker, indexes use the
+# numpy backend, whose finished files every worker memory-maps read-only, and each document is ingested
+# by one process at a time under a file lock; Chroma's store cannot be shared between processes
+WORKERS = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+
+# "chroma" keeps a Chroma collection per document; "numpy" keeps a brute-force
+# index per document (memory-mapped unless NUMPY_INDEX_MMAP=false)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "numpy" if WORKERS > 1 else "chroma").lower()
+NUMPY_INDEX_MMAP = os.getenv("NUMPY_INDEX_MMAP", "true").lower() == "true"
+NUMPY_INDEX_CACHE_SIZE = int(os.getenv("NUMPY_INDEX_CACHE_SIZE", 64))
+
+# Vector store housekeeping: each document gets its own index; indexes idle for longer than the TTL
+# are dropped, then the least recently used ones until the store fits its byte and chunk quotas
+# (0 disables a limit). A background pass also removes leftovers and reclaims space every interval.
+VECTOR_STORE_MAX_BYTES = int(os.getenv("VECTOR_STORE_MAX_BYTES", 10 * 1024 ** 3))
+VECTOR_STORE_MAX_CHUNKS = int(os.getenv("VECTOR_STORE_MAX_CHUNKS", 0))
+VECTOR_STORE_TTL_S = float(os.getenv("VECTOR_STORE_TTL_S", 30 * 24 * 3600))
+VECTOR_STORE_COMPACTION_INTERVAL_S = float(os.getenv("VECTOR_STORE_COMPACTION_INTERVAL_S", 3600))
+
+# Chunks returned per retrieval query
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", 3))
+# Query embeddings kept in memory across requests
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 10000))
+
+# Downloaded document cache: disk budget in bytes and idle expiry in seconds (0 disables expiry)
+DOC_CACHE_DIR = os.getenv("DOC_CACHE_DIR", "doc_cache")
+DOC_CACHE_MAX_BYTES = int(os.getenv("DOC_CACHE_MAX_BYTES", 2 * 1024 ** 3))
+DOC_CACHE_TTL_S = float(os.getenv("DOC_CACHE_TTL_S", 7 * 24 * 3600))
+# Cached URLs are revalidated with a conditional request (ETag / Last-Modified, blob properties for
+# blob://) once their last check is this old; 0 checks on every request, a negative value never does
+DOC_REVALIDATE_AFTER_S = float(os.getenv("DOC_REVALIDATE_AFTER_S", 300))
+
+# Persistent cache of chunk embeddings, shared across documents
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true"
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "embedding_cache")
+
+# Background pre-ingestion jobs (POST /api/v1/documents)
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", 2))
+INGEST_JOB_QUEUE_SIZE = int(os.getenv("INGEST_JOB_QUEUE_SIZE", 100))
+INGEST_JOB_HISTORY = int(os.getenv("INGEST_JOB_HISTORY", 1000))
+
+# Process-wide model call scheduling: per-model concurrency and tokens-per-minute (0 = unlimited),
+# rate-limit retries with adaptive backoff, and the window for coalescing concurrent embedding calls
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 16))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 0))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 8))
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", 0))
+RATE_LIMIT_RETRIES = int(os.getenv("RATE_LIMIT_RETRIES", 5))
+RATE_LIMIT_BACKOFF_BASE_S = float(os.getenv("RATE_LIMIT_BACKOFF_BASE_S", 1.0))
+RATE_LIMIT_BACKOFF_MAX_S = float(os.getenv("RATE_LIMIT_BACKOFF_MAX_S", 60.0))
+EMBED_COALESCE_WINDOW_MS = float(os.getenv("EMBED_COALESCE_WINDOW_MS", 10))
+EMBED_COALESCE_MAX_TEXTS = int(os.getenv("EMBED_COALESCE_MAX_TEXTS", 100))
+
+# "google" for the real Gemini clients, "fake" for the offline fakes (optionally with a simulated quota)
+MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "google")
+FAKE_MODEL_LATENCY_MS = float(os.getenv("FAKE_MODEL_LATENCY_MS", 50))
+FAKE_MODEL_MAX_CONCURRENCY = int(os.getenv("FAKE_MODEL_MAX_CONCURRENCY", 0))
+FAKE_MODEL_RPM = int(os.getenv("FAKE_MODEL_RPM", 0))
+
+# Prometheus metrics on /metrics; TIMING_HEADER_ENABLED adds a per-request Server-Timing breakdown
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+TIMING_HEADER_ENABLED = os.getenv("TIMING_HEADER_ENABLED", "false").lower() == "true"
+
+# Query decomposition: questions per concurrent LLM call, cached decompositions, queries per question
+DECOMPOSITION_SHARD_SIZE = int(os.getenv("DECOMPOSITION_SHARD_SIZE", 8))
+DECOMPOSITION_CACHE_SIZE = int(os.getenv("DECOMPOSITION_CACHE_SIZE", 10000))
+DECOMPOSITION_QUERIES_PER_QUESTION = int(os.getenv("DECOMPOSITION_QUERIES_PER_QUESTION", 3))
+
+# Speculative retrieval searches the original questions while decomposition runs, then searches only the
+# generated queries and merges. Early generation also starts answering from the original questions' chunks,
+# keeping an answer only if the final context turns out identical; otherwise it costs an extra LLM call
+SPECULATIVE_RETRIEVAL_ENABLED = os.getenv("SPECULATIVE_RETRIEVAL_ENABLED", "true").lower() == "true"
+EARLY_GENERATION_ENABLED = os.getenv("EARLY_GENERATION_ENABLED", "false").lower() == "true"
+
+# Retrieved context sent with each question, counted with tiktoken
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 2000))
+CONTEXT_TOKEN_ENCODING = os.getenv("CONTEXT_TOKEN_ENCODING", "cl100k_base")
+
+# Optionally answer questions that retrieved mostly the same chunks in one call over their shared context
+GROUPED_GENERATION_ENABLED = os.getenv("GROUPED_GENERATION_ENABLED", "false").lower() == "true"
+GROUPED_GENERATION_MIN_OVERLAP = float(os.getenv("GROUPED_GENERATION_MIN_OVERLAP", 0.6))
+GROUPED_GENERATION_MAX_GROUP_SIZE = int(os.getenv("GROUPED_GENERATION_MAX_GROUP_SIZE", 4))
+
+# Generated answers keyed by document content, question, model and prompt version.
+# A semantic threshold above 0 (e.g. 0.95) also reuses answers to near-duplicate questions.
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "true").lower() == "true"
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH", "answer_cache/answers.sqlite3")
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", 7 * 24 * 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", 100000))
+ANSWER_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("ANSWER_CACHE_SEMANTIC_THRESHOLD", 0))
+
+# Document fetching: hard size limit, streaming chunk size and connection pool size
+DOCUMENT_MAX_BYTES = int(os.getenv("DOCUMENT_MAX_BYTES", 512 * 1024 ** 2))
+DOWNLOAD_CHUNK_BYTES = int(os.getenv("DOWNLOAD_CHUNK_BYTES", 1024 ** 2))
+DOWNLOAD_TIMEOUT_S = float(os.getenv("DOWNLOAD_TIMEOUT_S", 60))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", 20))
+
+# Blobs at least this large are downloaded as concurrent ranged reads
+RANGED_DOWNLOAD_THRESHOLD = int(os.getenv("RANGED_DOWNLOAD_THRESHOLD", 32 * 1024 ** 2))
+RANGED_DOWNLOAD_PART_BYTES = int(os.getenv("RANGED_DOWNLOAD_PART_BYTES", 8 * 1024 ** 2))
+RANGED_DOWNLOAD_CONCURRENCY = int(os.getenv("RANGED_DOWNLOAD_CONCURRENCY", 4))
+
+AZURE_STORAGE_ACCOUNT_URL = os.getenv("AZURE_STORAGE_ACCOUNT_URL")
+AZURE_STORAGE_CONTAINER = os.getenv("AZURE_STORAGE_CONTAINER")
+AZURE_STORAGE_KEY = os.getenv("AZURE_STORAGE_KEY")
+
+# Number of processes used for CPU-bound document parsing, per serving worker
+PARSE_WORKERS = int(os.getenv("PARSE_WORKERS", max(1, (os.cpu_count() or 1) // WORKERS)))
+# Pages handed to a parsing worker per task
+PARSE_PAGES_PER_TASK = int(os.getenv("PARSE_PAGES_PER_TASK", 25))
+# Parsing tasks submitted ahead of the ingestion pipeline; bounds memory when embedding lags
+PARSE_MAX_INFLIGHT_TASKS = int(os.getenv("PARSE_MAX_INFLIGHT_TASKS", 2 * PARSE_WORKERS))
+
+# Streaming ingestion: chunks per embedding batch, batches buffered between the split and
+# embed stages, and concurrent embedding batches
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", 64))
+INGEST_QUEUE_BATCHES = int(os.getenv("INGEST_QUEUE_BATCHES", 4))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", 2))
+
+# Per-request latency budget in seconds (0 = none); clients can set their own with X-Request-Budget-Ms.
+# As the remaining budget shrinks the workflow degrades step by step: below the first threshold it skips
+# query decomposition, below the second it retrieves fewer chunks, below the third it sends a shorter context
+REQUEST_BUDGET_S = float(os.getenv("REQUEST_BUDGET_S", 0))
+DEGRADE_SKIP_DECOMPOSITION_BELOW_S = float(os.getenv("DEGRADE_SKIP_DECOMPOSITION_BELOW_S", 8))
+DEGRADE_REDUCE_K_BELOW_S = float(os.getenv("DEGRADE_REDUCE_K_BELOW_S", 5))
+DEGRADE_SHORTEN_CONTEXT_BELOW_S = float(os.getenv("DEGRADE_SHORTEN_CONTEXT_BELOW_S", 4))
+DEGRADED_RETRIEVAL_K = int(os.getenv("DEGRADED_RETRIEVAL_K", 1))
+DEGRADED_CONTEXT_TOKEN_BUDGET = int(os.getenv("DEGRADED_CONTEXT_TOKEN_BUDGET", 600))
+
+# Admission control: requests ingesting a document / generating answers at once, how many more may
+# queue for a slot (beyond that they get 429) and the longest a request without a budget waits (then 503)
+ADMISSION_MAX_INGESTIONS = int(os.getenv("ADMISSION_MAX_INGESTIONS", 4))
+ADMISSION_MAX_GENERATIONS = int(os.getenv("ADMISSION_MAX_GENERATIONS", 32))
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", 64))
+ADMISSION_MAX_WAIT_S = float(os.getenv("ADMISSION_MAX_WAIT_S", 30))
+
+# Documents one query request may span; they are fetched and indexed concurrently and searched together
+MAX_DOCUMENTS_PER_REQUEST = int(os.getenv("MAX_DOCUMENTS_PER_REQUEST", 10))
+
+# Startup: build the model clients, stores and worker pool in the background once the server is
+# listening (GET /ready reports when they are done), and the budget for `import main` checked by
+# `python benchmark.py --startup`
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "true").lower() == "true"
+IMPORT_TIME_BUDGET_S = float(os.getenv("IMPORT_TIME_BUDGET_S", 1.0))
+
+def missing_settings() -> list:
+    """Required settings that are unset. Reported by GET /ready instead of failing at import."""
+    required = {
+        "AZURE_STORAGE_ACCOUNT_URL": AZURE_STORAGE_ACCOUNT_URL,
+        "AZURE_STORAGE_CONTAINER": AZURE_STORAGE_CONTAINER,
+        "AZURE_STORAGE_KEY": AZURE_STORAGE_KEY,
+    }
+    if MODEL_PROVIDER != "fake":
+        required["GOOGLE_API_KEY"] = GOOGLE_API_KEY
+    return [name for name, value in required.items() if not value]
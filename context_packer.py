@@ -0,0 +1,122 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from langchain_core.documents import Document
+import metrics
+from config import CONTEXT_TOKEN_BUDGET, CONTEXT_TOKEN_ENCODING, CHUNK_OVERLAP
+
+CONTEXT_SEPARATOR = "\n\n---\n\n"
+
+def chunk_position(doc: Document) -> Optional[Tuple[str, int]]:
+    """(content hash, chunk index) from the `{hash}:{i}` ids assigned at ingestion."""
+    if not doc.id or ":" not in doc.id:
+        return None
+    content_hash, _, index = doc.id.rpartition(":")
+    return (content_hash, int(index)) if index.isdigit() else None
+
+def join_overlapping(left: str, right: str, max_overlap: int = 2 * CHUNK_OVERLAP) -> str:
+    """Concatenate two neighbouring chunks, dropping the text the splitter repeated between them."""
+    for size in range(min(len(left), len(right), max_overlap), 0, -1):
+        if left.endswith(right[:size]):
+            return left + right[size:]
+    return left + "\n" + right
+
+@dataclass
+class Span:
+    text: str
+    score: float
+    docs: List[Document] = field(default_factory=list)
+
+class ContextPacker:
+    """
+    Builds a question's context from its scored chunks within a token budget.
+
+    Chunks that were neighbours in the same page are merged back into one contiguous
+    span (the splitter overlap appears once), spans are ranked by their best retrieval
+    score and added while they fit in `token_budget` tokens. Only the best span is ever
+    truncated, when it alone exceeds the budget.
+    """
+
+    def __init__(self, token_budget: int = CONTEXT_TOKEN_BUDGET, encoding_name: str = CONTEXT_TOKEN_ENCODING):
+        self.token_budget = token_budget
+        self.encoding_name = encoding_name
+        self._encoding = None
+        self._encoding_failed = False
+
+    def _get_encoding(self):
+        if self._encoding is None and not self._encoding_failed:
+            try:
+                import tiktoken
+                self._encoding = tiktoken.get_encoding(self.encoding_name)
+            except Exception as e:
+                # The BPE file is downloaded on first use; without it, estimate ~4 chars per token
+                print(f"tiktoken encoding '{self.encoding_name}' unavailable, estimating token counts: {e}")
+                self._encoding_failed = True
+        return self._encoding
+
+    def count_tokens(self, text: str) -> int:
+        encoding = self._get_encoding()
+        return len(encoding.encode(text)) if encoding else (len(text) + 3) // 4
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        encoding = self._get_encoding()
+        if encoding:
+            return encoding.decode(encoding.encode(text)[:max_tokens])
+        return text[:max_tokens * 4]
+
+    def merge_spans(self, scored_docs: List[Tuple[Document, float]]) -> List[Span]:
+        best: Dict[object, Tuple[Document, float]] = {}
+        for doc, score in scored_docs:
+            key = chunk_position(doc) or doc.page_content
+            if key not in best or score > best[key][1]:
+                best[key] = (doc, score)
+
+        positioned = sorted(
+            ((chunk_position(doc), doc, score) for doc, score in best.values() if chunk_position(doc)),
+            key=lambda item: item[0],
+        )
+        spans = [Span(doc.page_content, score, [doc]) for doc, score in best.values() if not chunk_position(doc)]
+        previous = None
+        for position, doc, score in positioned:
+            last = spans[-1] if previous else None
+            if (
+                last is not None
+                and position[0] == previous[0]
+                and position[1] == previous[1] + 1
+                and doc.metadata.get("page") == last.docs[-1].metadata.get("page")
+            ):
+                last.text = join_overlapping(last.text, doc.page_content)
+                last.score = max(last.score, score)
+                last.docs.append(doc)
+            else:
+                spans.append(Span(doc.page_content, score, [doc]))
+            previous = position
+        return spans
+
+    def pack(self, scored_docs: List[Tuple[Document, float]], token_budget: Optional[int] = None) -> str:
+        return self.pack_with_sources(scored_docs, token_budget)[0]
+
+    def pack_with_sources(self, scored_docs: List[Tuple[Document, float]], token_budget: Optional[int] = None) -> Tuple[str, List[str]]:
+        """The packed context, and the content hashes of the documents it draws from, best span first."""
+        separator_tokens = self.count_tokens(CONTEXT_SEPARATOR)
+        remaining = token_budget or self.token_budget
+        budget = remaining
+        packed: List[str] = []
+        sources: List[str] = []
+        chunks = 0
+        for span in sorted(self.merge_spans(scored_docs), key=lambda s: s.score, reverse=True):
+            cost = self.count_tokens(span.text) + (separator_tokens if packed else 0)
+            if cost <= remaining:
+                packed.append(span.text)
+                remaining -= cost
+            elif not packed:
+                packed.append(self.truncate(span.text, remaining))
+                remaining = 0
+            else:
+                continue
+            chunks += len(span.docs)
+            source = span.docs[0].metadata.get("content_hash") or (chunk_position(span.docs[0]) or (None,))[0]
+            if source and source not in sources:
+                sources.append(source)
+        metrics.record_chunks("context", chunks)
+        metrics.record_tokens("context", budget - remaining)
+        return CONTEXT_SEPARATOR.join(packed), sources
@@ -0,0 +1,214 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator, Optional
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+from config import DOC_CACHE_DIR, DOC_CACHE_MAX_BYTES, DOC_CACHE_TTL_S
+
+# Recently used objects are never evicted, so a file that is still being parsed is not pulled away
+EVICTION_GRACE_S = 300
+
+# Signed-URL schemes: (parameters that must all be present for a URL to be signed this way,
+# parameter names stripped from it, name prefixes stripped from it). Parameters such as `policy`
+# or `expires` identify the document on other URLs, so nothing is stripped from unsigned URLs.
+_SIGNING_SCHEMES = (
+    # Azure SAS tokens
+    (
+        {"sig"},
+        {"sig", "se", "st", "sp", "sv", "sr", "spr", "srt", "ss", "si", "sdd",
+         "skoid", "sktid", "skt", "ske", "sks", "skv"},
+        (),
+    ),
+    # S3 and GCS presigned URLs
+    ({"x-amz-signature"}, set(), ("x-amz-",)),
+    ({"x-goog-signature"}, set(), ("x-goog-",)),
+    # CloudFront signed URLs
+    ({"key-pair-id", "signature"}, {"expires", "signature", "policy", "key-pair-id"}, ()),
+)
+
+def cache_key(url: str) -> str:
+    """The URL without its signature and expiry parameters, so re-signed URLs for one object share a key."""
+    parts = urlsplit(url)
+    query = parse_qsl(parts.query, keep_blank_values=True)
+    present = {name.lower() for name, _ in query}
+    names, prefixes = set(), ()
+    for required, scheme_names, scheme_prefixes in _SIGNING_SCHEMES:
+        if required <= present:
+            names |= scheme_names
+            prefixes += scheme_prefixes
+    query = [
+        (name, value) for name, value in query
+        if name.lower() not in names and not (prefixes and name.lower().startswith(prefixes))
+    ]
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+@dataclass
+class CachedDocument:
+    content_hash: str
+    path: str
+    size: int
+    # Validators from the origin and when the URL was last confirmed to still serve these bytes
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    validated_at: float = 0.0
+
+class DocumentCache:
+    """
+    Content-addressed store for downloaded documents.
+
+    Files are stored once per SHA-256 of their bytes under `objects/`, and an alias table maps
+    each URL to the hash it last resolved to, so rotating signed URLs for the same bytes share
+    one copy; aliases are keyed by `cache_key`, so re-signed URLs for the same object share one
+    entry as well. Total size is bounded by `max_bytes` (least recently used objects are evicted
+    first) and objects unused for `ttl_s` seconds expire. Aliases keep the origin's ETag and
+    Last-Modified so a URL can be revalidated with a conditional request.
+    """
+
+    def __init__(self, root: str = DOC_CACHE_DIR, max_bytes: int = DOC_CACHE_MAX_BYTES, ttl_s: float = DOC_CACHE_TTL_S):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.ttl_s = ttl_s
+        self.objects_dir = os.path.join(self.root, "objects")
+        self.tmp_dir = os.path.join(self.root, "tmp")
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self.db_path = os.path.join(self.root, "index.sqlite3")
+        self._evict_lock = threading.Lock()
+        with self._connect() as conn:
+            # WAL lets serving workers read while another process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS objects (
+                    content_hash TEXT PRIMARY KEY,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS aliases (
+                    url TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    updated_at REAL NOT NULL
+                )"""
+            )
+            alias_columns = [row[1] for row in conn.execute("PRAGMA table_info(aliases)")]
+            for column in ("etag TEXT", "last_modified TEXT", "validated_at REAL NOT NULL DEFAULT 0"):
+                if column.split()[0] not in alias_columns:
+                    conn.execute(f"ALTER TABLE aliases ADD COLUMN {column}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_objects_last_access ON objects (last_access)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def object_path(self, content_hash: str, suffix: str = ".pdf") -> str:
+        return os.path.join(self.objects_dir, f"{content_hash}{suffix}")
+
+    def new_temp_path(self, suffix: str = ".part") -> str:
+        """Path for an in-progress download; lives on the same filesystem so `put` can rename it."""
+        return os.path.join(self.tmp_dir, f"{os.getpid()}-{threading.get_ident()}-{time.time_ns()}{suffix}")
+
+    def lookup(self, url: str) -> Optional[CachedDocument]:
+        """Resolve a URL through the alias table; returns None on a miss or an expired/missing object."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                """SELECT o.content_hash, o.path, o.size, o.last_access, a.etag, a.last_modified, a.validated_at
+                   FROM aliases a JOIN objects o ON o.content_hash = a.content_hash WHERE a.url = ?""",
+                (cache_key(url),),
+            ).fetchone()
+            if row is None:
+                return None
+            content_hash, path, size, last_access, etag, last_modified, validated_at = row
+            if (self.ttl_s and now - last_access > self.ttl_s) or not os.path.exists(path):
+                self._delete_object(conn, content_hash, path)
+                return None
+            conn.execute("UPDATE objects SET last_access = ? WHERE content_hash = ?", (now, content_hash))
+        return CachedDocument(content_hash, path, size, etag, last_modified, validated_at)
+
+    def mark_validated(self, url: str, etag: Optional[str] = None, last_modified: Optional[str] = None):
+        """Record that the origin confirmed the URL still serves the cached bytes."""
+        with self._connect() as conn:
+            conn.execute(
+                """UPDATE aliases SET validated_at = ?, etag = COALESCE(?, etag),
+                   last_modified = COALESCE(?, last_modified) WHERE url = ?""",
+                (time.time(), etag, last_modified, cache_key(url)),
+            )
+
+    def put(
+        self, url: str, temp_path: str, content_hash: str,
+        etag: Optional[str] = None, last_modified: Optional[str] = None, suffix: str = ".pdf",
+    ) -> CachedDocument:
+        """
+        Move a fully written temp file into the store under its hash and alias the URL to it.
+        `suffix` is the extension of the document's sniffed type, which some loaders rely on.
+        """
+        path = self.object_path(content_hash, suffix)
+        size = os.path.getsize(temp_path)
+        now = time.time()
+        if os.path.exists(path):
+            # Same bytes already stored (e.g. behind another URL); keep the existing copy
+            os.remove(temp_path)
+        else:
+            os.replace(temp_path, path)
+        with self._connect() as conn:
+            conn.execute(
+                """INSERT INTO objects VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT(content_hash) DO UPDATE SET last_access = excluded.last_access""",
+                (content_hash, path, size, now, now),
+            )
+            conn.execute(
+                """INSERT OR REPLACE INTO aliases (url, content_hash, updated_at, etag, last_modified, validated_at)
+                   VALUES (?, ?, ?, ?, ?, ?)""",
+                (cache_key(url), content_hash, now, etag, last_modified, now),
+            )
+        self.evict()
+        return CachedDocument(content_hash, path, size, etag, last_modified, now)
+
+    def discard(self, content_hash: str):
+        with self._connect() as conn:
+            row = conn.execute("SELECT path FROM objects WHERE content_hash = ?", (content_hash,)).fetchone()
+            self._delete_object(conn, content_hash, row[0] if row else self.object_path(content_hash))
+
+    def evict(self):
+        """Drop expired objects, then least recently used ones until the store fits its byte budget."""
+        with self._evict_lock, self._connect() as conn:
+            now = time.time()
+            if self.ttl_s:
+                expired = conn.execute(
+                    "SELECT content_hash, path FROM objects WHERE last_access < ?", (now - self.ttl_s,)
+                ).fetchall()
+                for content_hash, path in expired:
+                    self._delete_object(conn, content_hash, path)
+
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM objects").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            candidates = conn.execute(
+                "SELECT content_hash, path, size FROM objects WHERE last_access < ? ORDER BY last_access",
+                (now - EVICTION_GRACE_S,),
+            ).fetchall()
+            for content_hash, path, size in candidates:
+                if total <= self.max_bytes:
+                    break
+                self._delete_object(conn, content_hash, path)
+                total -= size
+
+    def _delete_object(self, conn: sqlite3.Connection, content_hash: str, path: str):
+        conn.execute("DELETE FROM objects WHERE content_hash = ?", (content_hash,))
+        conn.execute("DELETE FROM aliases WHERE content_hash = ?", (content_hash,))
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Already removed, e.g. by another worker evicting the same object
+            pass
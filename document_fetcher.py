@@ -0,0 +1,245 @@
+import asyncio
+import hashlib
+import threading
+from collections import deque
+from dataclasses import dataclass
+from typing import Optional
+import httpx
+from azure.core import MatchConditions
+from azure.storage.blob.aio import BlobServiceClient, ContainerClient
+from config import (
+    DOCUMENT_MAX_BYTES,
+    DOWNLOAD_CHUNK_BYTES,
+    DOWNLOAD_TIMEOUT_S,
+    HTTP_MAX_CONNECTIONS,
+    RANGED_DOWNLOAD_THRESHOLD,
+    RANGED_DOWNLOAD_PART_BYTES,
+    RANGED_DOWNLOAD_CONCURRENCY,
+    AZURE_STORAGE_ACCOUNT_URL,
+    AZURE_STORAGE_CONTAINER,
+    AZURE_STORAGE_KEY,
+)
+
+BLOB_SCHEME = "blob://"
+
+class DocumentTooLargeError(ValueError):
+    pass
+
+@dataclass
+class FetchResult:
+    content_hash: str
+    size: int
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+    # True when a conditional fetch found the document unchanged; nothing was written
+    not_modified: bool = False
+
+def _conditional_headers(etag: Optional[str], last_modified: Optional[str]) -> dict:
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return headers
+
+class _HashingWriter:
+    """Streams chunks to a file while hashing them and enforcing the size limit."""
+
+    def __init__(self, path: str, max_bytes: int):
+        self.file = open(path, "wb")
+        self.digest = hashlib.sha256()
+        self.size = 0
+        self.max_bytes = max_bytes
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise DocumentTooLargeError(f"Document exceeds the {self.max_bytes} byte limit")
+        self.digest.update(chunk)
+        self.file.write(chunk)
+
+    def close(self):
+        self.file.close()
+
+    def result(self, etag: Optional[str] = None, last_modified: Optional[str] = None) -> FetchResult:
+        return FetchResult(self.digest.hexdigest(), self.size, etag, last_modified)
+
+class DocumentFetcher:
+    """
+    Downloads documents straight to disk, hashing them on the way.
+
+    HTTP(S) URLs go through pooled keep-alive httpx clients; `blob://<name>` URLs are read from
+    the configured Azure container, using parallel ranged reads for large blobs. At most
+    `max_bytes` are accepted from any source. Clients can be injected, e.g. pointed at a local
+    HTTP server.
+    """
+
+    def __init__(
+        self,
+        http_client: Optional[httpx.Client] = None,
+        async_http_client: Optional[httpx.AsyncClient] = None,
+        container_client: Optional[ContainerClient] = None,
+        max_bytes: int = DOCUMENT_MAX_BYTES,
+    ):
+        self.max_bytes = max_bytes
+        self._http_client = http_client
+        self._async_http_client = async_http_client
+        self._async_client_loop = None
+        self._container_client = container_client
+        self._lock = threading.Lock()
+
+    def _http(self) -> httpx.Client:
+        with self._lock:
+            if self._http_client is None:
+                self._http_client = httpx.Client(
+                    timeout=DOWNLOAD_TIMEOUT_S,
+                    follow_redirects=True,
+                    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS),
+                )
+            return self._http_client
+
+    async def _async_http(self) -> httpx.AsyncClient:
+        # Async clients are bound to the loop they were first used on (sync callers run a fresh loop each time)
+        loop = asyncio.get_running_loop()
+        stale = None
+        with self._lock:
+            if self._async_http_client is not None and self._async_client_loop not in (None, loop):
+                stale, stale_loop = self._async_http_client, self._async_client_loop
+                self._async_http_client = None
+            if self._async_http_client is None:
+                self._async_http_client = httpx.AsyncClient(
+                    timeout=DOWNLOAD_TIMEOUT_S,
+                    follow_redirects=True,
+                    limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS),
+                )
+            self._async_client_loop = loop
+            client = self._async_http_client
+        if stale is not None:
+            await self._close_stale_client(stale, stale_loop)
+        return client
+
+    async def _close_stale_client(self, client: httpx.AsyncClient, loop: asyncio.AbstractEventLoop):
+        """Close the pooled connections of a client replaced because the event loop changed."""
+        if loop.is_running() and not loop.is_closed():
+            # Still serving another thread; close it there without waiting
+            asyncio.run_coroutine_threadsafe(client.aclose(), loop)
+            return
+        try:
+            await client.aclose()
+        except Exception as e:
+            print(f"Failed to close a stale HTTP client: {e}")
+
+    def container_client(self) -> ContainerClient:
+        if self._container_client is None:
+            if not AZURE_STORAGE_ACCOUNT_URL or not AZURE_STORAGE_CONTAINER or not AZURE_STORAGE_KEY:
+                raise RuntimeError("Missing Azure Blob Storage env vars")
+            service = BlobServiceClient(account_url=AZURE_STORAGE_ACCOUNT_URL, credential=AZURE_STORAGE_KEY)
+            self._container_client = service.get_container_client(AZURE_STORAGE_CONTAINER)
+        return self._container_client
+
+    def _check_declared_size(self, size: Optional[str | int]):
+        if size is not None and int(size) > self.max_bytes:
+            raise DocumentTooLargeError(f"Document is {size} bytes; the limit is {self.max_bytes}")
+
+    def fetch(self, url: str, dest_path: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> FetchResult:
+        """
+        Synchronous HTTP(S) fetch, used by the sync DocumentManager constructor. Given the
+        validators of a cached copy, the request is conditional and may come back not modified.
+        """
+        if url.startswith(BLOB_SCHEME):
+            raise ValueError("blob:// documents can only be fetched through the async API")
+        writer = _HashingWriter(dest_path, self.max_bytes)
+        try:
+            with self._http().stream("GET", url, headers=_conditional_headers(etag, last_modified)) as response:
+                if response.status_code == 304:
+                    return FetchResult("", 0, etag, last_modified, not_modified=True)
+                response.raise_for_status()
+                self._check_declared_size(response.headers.get("content-length"))
+                for chunk in response.iter_bytes(DOWNLOAD_CHUNK_BYTES):
+                    writer.write(chunk)
+                return writer.result(response.headers.get("etag"), response.headers.get("last-modified"))
+        finally:
+            writer.close()
+
+    async def afetch(self, url: str, dest_path: str, etag: Optional[str] = None, last_modified: Optional[str] = None) -> FetchResult:
+        """Async fetch of HTTP(S) and blob:// URLs; conditional like `fetch` when validators are given."""
+        if url.startswith(BLOB_SCHEME):
+            return await self._afetch_blob(url[len(BLOB_SCHEME):], dest_path, etag)
+        return await self._afetch_http(url, dest_path, etag, last_modified)
+
+    async def _afetch_http(self, url: str, dest_path: str, etag: Optional[str], last_modified: Optional[str]) -> FetchResult:
+        writer = _HashingWriter(dest_path, self.max_bytes)
+        try:
+            async with (await self._async_http()).stream("GET", url, headers=_conditional_headers(etag, last_modified)) as response:
+                if response.status_code == 304:
+                    return FetchResult("", 0, etag, last_modified, not_modified=True)
+                response.raise_for_status()
+                self._check_declared_size(response.headers.get("content-length"))
+                # Chunk writes land in the page cache, so they are cheap enough to do on the loop
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_BYTES):
+                    writer.write(chunk)
+                return writer.result(response.headers.get("etag"), response.headers.get("last-modified"))
+        finally:
+            writer.close()
+
+    async def _afetch_blob(self, blob_name: str, dest_path: str, etag: Optional[str] = None) -> FetchResult:
+        blob = self.container_client().get_blob_client(blob=blob_name)
+        props = await blob.get_blob_properties()
+        last_modified = props.last_modified.isoformat() if props.last_modified else None
+        if etag and props.etag == etag:
+            return FetchResult("", 0, etag, last_modified, not_modified=True)
+        self._check_declared_size(props.size)
+        # Pin every read to the etag we sized against so a concurrent overwrite fails instead of mixing versions
+        conditions = {"etag": props.etag, "match_condition": MatchConditions.IfNotModified}
+
+        writer = _HashingWriter(dest_path, self.max_bytes)
+        try:
+            if props.size < RANGED_DOWNLOAD_THRESHOLD:
+                downloader = await blob.download_blob(**conditions)
+                async for chunk in downloader.chunks():
+                    writer.write(chunk)
+            else:
+                await self._aranged_blob(blob, props.size, writer, conditions)
+            return writer.result(props.etag, last_modified)
+        finally:
+            writer.close()
+
+    async def _aranged_blob(self, blob, size: int, writer: _HashingWriter, conditions: dict):
+        """Download fixed-size parts concurrently, consuming them in order so hashing stays sequential.
+
+        At most RANGED_DOWNLOAD_CONCURRENCY parts are in flight or buffered at any time.
+        """
+        async def read_part(offset: int, length: int) -> bytes:
+            downloader = await blob.download_blob(offset=offset, length=length, **conditions)
+            return await downloader.readall()
+
+        offsets = deque(range(0, size, RANGED_DOWNLOAD_PART_BYTES))
+        pending: deque = deque()
+        try:
+            while offsets or pending:
+                while offsets and len(pending) < RANGED_DOWNLOAD_CONCURRENCY:
+                    offset = offsets.popleft()
+                    length = min(RANGED_DOWNLOAD_PART_BYTES, size - offset)
+                    pending.append(asyncio.ensure_future(read_part(offset, length)))
+                writer.write(await pending.popleft())
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def aclose(self):
+        if self._async_http_client is not None:
+            await self._async_http_client.aclose()
+        if self._http_client is not None:
+            self._http_client.close()
+        if self._container_client is not None:
+            await self._container_client.close()
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+def get_document_fetcher() -> DocumentFetcher:
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = DocumentFetcher()
+        return _fetcher
@@ -1,47 +1,127 @@
 import os
-import uuid
-import requests
-from typing import Tuple
-import shelve
+import time
+import asyncio
+import threading
+from typing import Optional
+from document_cache import DocumentCache, CachedDocument, cache_key
+from document_fetcher import FetchResult, get_document_fetcher
+from document_types import SUFFIXES, detect_document_type
+from single_flight import SingleFlight
+import metrics
+from config import DOC_REVALIDATE_AFTER_S
+
+_cache = None
+_cache_lock = threading.Lock()
+
+# Concurrent misses for the same URL share a single download
+_downloads = SingleFlight()
+
+def get_document_cache() -> DocumentCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = DocumentCache()
+        return _cache
 
 class DocumentManager:
     def __init__(self, document_url: str):
+        self._setup(document_url)
+
+        # Try to resolve the URL from the cache; if it misses, download and cache it
+        with metrics.stage("download"):
+            cached = self.cache.lookup(self.document_url)
+            metrics.record_cache("document", hits=int(cached is not None), misses=int(cached is None))
+            if cached is None:
+                cached = _downloads.run_sync(cache_key(self.document_url), self._download_and_cache)
+            elif self._needs_revalidation(cached):
+                cached = _downloads.run_sync(cache_key(self.document_url), lambda: self._revalidate(cached))
+        self._use_cached(cached)
+
+    @classmethod
+    async def acreate(cls, document_url: str) -> "DocumentManager":
+        """Async counterpart of the constructor; downloads without blocking the event loop."""
+        manager = cls.__new__(cls)
+        manager._setup(document_url)
+
+        with metrics.stage("download"):
+            cached = await asyncio.to_thread(manager.cache.lookup, manager.document_url)
+            metrics.record_cache("document", hits=int(cached is not None), misses=int(cached is None))
+            if cached is None:
+                cached = await _downloads.run(cache_key(manager.document_url), manager._adownload_and_cache)
+            elif manager._needs_revalidation(cached):
+                cached = await _downloads.run(cache_key(manager.document_url), lambda: manager._arevalidate(cached))
+        manager._use_cached(cached)
+        return manager
+
+    def _setup(self, document_url: str):
         self.document_url = document_url
-        self.DIR = 'doc_cache'
-        os.makedirs(self.DIR, exist_ok=True)
-
-        # Try to fetch a cached path; if none, download and cache it
-        cached_path = self._get_cached_path()
-        if cached_path:
-            # Cache hit
-            self.file_path = cached_path
-            self.filename = os.path.basename(cached_path)
-        else:
-            # Cache miss
-            self.file_path, self.filename = self._download_and_cache()
-
-    def _get_cached_path(self) -> str:
-        """Return the cached file path for this URL, or '' if not present."""
-        with shelve.open(os.path.join(self.DIR, 'cache')) as cache:
-            return cache.get(self.document_url, '')
-
-    def _download_and_cache(self) -> Tuple[str, str]:
-        """Download the document, save it, cache the path, and return (path, name)."""
-        print("Downloading file...")
-        response = requests.get(self.document_url, timeout=60)
-        response.raise_for_status()
-
-        filename = f"{uuid.uuid4()}.pdf"
-        file_path = os.path.join(self.DIR, filename)
-
-        with open(file_path, "wb") as f:
-            f.write(response.content)
+        self.cache = get_document_cache()
+
+    def _use_cached(self, cached: CachedDocument):
+        self.file_path = cached.path
+        self.filename = os.path.basename(cached.path)
+        self.content_hash = cached.content_hash
+
+    @staticmethod
+    def _needs_revalidation(cached: CachedDocument) -> bool:
+        return DOC_REVALIDATE_AFTER_S >= 0 and time.time() - cached.validated_at >= DOC_REVALIDATE_AFTER_S
+
+    def _store(self, result: FetchResult, temp_path: str, cached: Optional[CachedDocument]) -> CachedDocument:
+        if result.not_modified:
+            metrics.record_cache("revalidation", hits=1)
+            self.cache.mark_validated(self.document_url, result.etag, result.last_modified)
+            return cached
         print('File downloaded.')
-        # Store in cache
-        with shelve.open(os.path.join(self.DIR, 'cache')) as cache:
-            cache[self.document_url] = file_path
+        if cached is not None:
+            changed = result.content_hash != cached.content_hash
+            metrics.record_cache("revalidation", hits=int(not changed), misses=int(changed))
+            if changed:
+                print("Document changed since it was cached")
+        # Sniffed from the bytes, since URLs rarely carry a trustworthy extension
+        suffix = SUFFIXES[detect_document_type(temp_path)]
+        return self.cache.put(self.document_url, temp_path, result.content_hash, result.etag, result.last_modified, suffix)
+
+    def _download_and_cache(self, cached: Optional[CachedDocument] = None) -> CachedDocument:
+        """
+        Stream the document to a temp file, then move it into the cache under its hash. With a
+        cached copy the request is conditional, and an unchanged document keeps that copy.
+        """
+        print("Downloading file..." if cached is None else "Revalidating cached file...")
+        temp_path = self.cache.new_temp_path()
+        try:
+            validators = (cached.etag, cached.last_modified) if cached else (None, None)
+            result: FetchResult = get_document_fetcher().fetch(self.document_url, temp_path, *validators)
+            return self._store(result, temp_path, cached)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
 
-        return file_path, filename
+    async def _adownload_and_cache(self, cached: Optional[CachedDocument] = None) -> CachedDocument:
+        """Async variant of `_download_and_cache`; handles both HTTP(S) and blob:// URLs."""
+        print("Downloading file..." if cached is None else "Revalidating cached file...")
+        temp_path = self.cache.new_temp_path()
+        try:
+            validators = (cached.etag, cached.last_modified) if cached else (None, None)
+            result: FetchResult = await get_document_fetcher().afetch(self.document_url, temp_path, *validators)
+            return await asyncio.to_thread(self._store, result, temp_path, cached)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _revalidate(self, cached: CachedDocument) -> CachedDocument:
+        try:
+            return self._download_and_cache(cached)
+        except Exception as e:
+            # The origin being unreachable is no reason to fail a request we can answer
+            print(f"Revalidation failed, using the cached copy: {e}")
+            return cached
+
+    async def _arevalidate(self, cached: CachedDocument) -> CachedDocument:
+        try:
+            return await self._adownload_and_cache(cached)
+        except Exception as e:
+            print(f"Revalidation failed, using the cached copy: {e}")
+            return cached
 
     def get_filepath(self) -> str:
         return self.file_path
@@ -49,6 +129,9 @@ class DocumentManager:
     def get_filename(self) -> str:
         return self.filename
 
+    def get_content_hash(self) -> str:
+        return self.content_hash
+
     def cleanup(self):
-        if getattr(self, 'file_path', None) and os.path.exists(self.file_path):
-            os.remove(self.file_path)
+        if getattr(self, 'content_hash', None):
+            self.cache.discard(self.content_hash)
@@ -0,0 +1,53 @@
+import zipfile
+from typing import Optional
+
+PDF = "pdf"
+DOCX = "docx"
+EML = "eml"
+MSG = "msg"
+
+# Extension each type is stored under in the document cache; the email loader relies on it
+SUFFIXES = {PDF: ".pdf", DOCX: ".docx", EML: ".eml", MSG: ".msg"}
+
+_OLE_MAGIC = b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1"
+_EMAIL_HEADERS = (
+    b"from:", b"from ", b"to:", b"subject:", b"date:", b"received:", b"return-path:",
+    b"message-id:", b"mime-version:", b"delivered-to:", b"reply-to:", b"x-",
+)
+
+class UnsupportedDocumentError(ValueError):
+    pass
+
+def detect_document_type(path: str) -> str:
+    """Identify a document from its leading bytes, whatever its URL or file name says."""
+    with open(path, "rb") as f:
+        head = f.read(8192)
+    # Some generators put a few bytes of junk before the PDF header, which readers tolerate
+    if b"%PDF-" in head[:1024]:
+        return PDF
+    if head.startswith(b"PK\x03\x04"):
+        try:
+            with zipfile.ZipFile(path) as archive:
+                if "word/document.xml" in archive.namelist():
+                    return DOCX
+        except zipfile.BadZipFile:
+            pass
+    if head.startswith(_OLE_MAGIC):
+        return MSG
+    if head.lstrip().lower().startswith(_EMAIL_HEADERS):
+        return EML
+    raise UnsupportedDocumentError("Unsupported document type; expected a PDF, DOCX, EML or MSG file")
+
+def create_loader(path: str, document_type: Optional[str] = None):
+    """The loader for a document's sniffed type. DOCX and email support is imported on first use."""
+    document_type = document_type or detect_document_type(path)
+    if document_type == PDF:
+        from pdf_loader import ParallelPDFLoader
+        return ParallelPDFLoader(path)
+    if document_type == DOCX:
+        from docx_loader import DocxLoader
+        return DocxLoader(path)
+    if document_type in (EML, MSG):
+        from email_loader import EmailLoader
+        return EmailLoader(path)
+    raise UnsupportedDocumentError(f"No loader for document type {document_type!r}")
@@ -1,6 +1,7 @@
 import docx2txt
 import os
 from langchain_core.documents import Document
+from typing import Iterator
 
 class DocxLoader:
     """
@@ -17,6 +18,13 @@ class DocxLoader:
         """
         self.file_path = file_path
 
+    def lazy_load(self) -> Iterator[Document]:
+        """
+        Yields the documents produced by `load`, so the loader can feed the
+        streaming ingestion pipeline like the PDF loaders.
+        """
+        yield from self.load()
+
     def load(self) -> list[Document]:
         """
         Loads the DOCX file, extracts all text, and returns a single
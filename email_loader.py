@@ -1,5 +1,6 @@
 import os
 from langchain_core.documents import Document
+from typing import Iterator
 from email.parser import BytesParser
 from email.policy import default
 import extract_msg
@@ -20,6 +21,13 @@ class EmailLoader:
         self.file_path = file_path
         self.file_extension = os.path.splitext(self.file_path)[1].lower()
 
+    def lazy_load(self) -> Iterator[Document]:
+        """
+        Yields the documents produced by `load`, so the loader can feed the
+        streaming ingestion pipeline like the PDF loaders.
+        """
+        yield from self.load()
+
     def load(self) -> list[Document]:
         """
         Loads the email file, extracts relevant information (sender, subject, body),
@@ -50,11 +58,11 @@ class EmailLoader:
             if message.is_multipart():
                 for part in message.walk():
                     if part.get_content_type() == "text/plain":
-                        body = part.get_payload(decode=True).decode(part.get_content_charset(), errors='ignore')
+                        body = part.get_payload(decode=True).decode(part.get_content_charset() or "utf-8", errors='ignore')
                         break
             else:
                 if message.get_content_type() == "text/plain":
-                    body = message.get_payload(decode=True).decode(message.get_content_charset(), errors='ignore')
+                    body = message.get_payload(decode=True).decode(message.get_content_charset() or "utf-8", errors='ignore')
 
             content = f"Subject: {subject}\nFrom: {sender}\n\n{body}"
             metadata = {"source": os.path.basename(self.file_path), "subject": subject, "sender": sender}
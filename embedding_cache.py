@@ -0,0 +1,182 @@
+import os
+import re
+import asyncio
+import hashlib
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Sequence
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from file_lock import FileLock
+from config import EMBEDDING_CACHE_DIR
+import metrics
+
+# sqlite caps the number of bound parameters per statement
+_LOOKUP_BATCH = 500
+
+def normalize_text(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip()
+
+def _as_float32(vectors: List[List[float]]) -> List[List[float]]:
+    # Round fresh vectors the way the store does, so hits and misses return identical values
+    return np.asarray(vectors, dtype=np.float32).tolist()
+
+class EmbeddingStore:
+    """
+    On-disk vector cache for one embedding model.
+
+    Vectors are appended as raw float32 rows to `vectors.f32` and read back through a
+    memory map; `index.sqlite3` maps each text key to its row. Rows are flushed to disk
+    before their index entries are written, so the index never points past the end of the
+    data file. Appends hold a file lock, so worker processes sharing the store never
+    interleave rows, and a partial row left by a crashed writer is cut off under that lock
+    before anything else is appended.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.db_path = os.path.join(directory, "index.sqlite3")
+        self._lock = threading.Lock()
+        self._append_lock = FileLock(os.path.join(directory, "vectors.lock"))
+        self._matrix: Optional[np.memmap] = None
+        with self._connect() as conn:
+            # WAL lets serving workers read while another process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS vectors (key TEXT PRIMARY KEY, row INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+            row = conn.execute("SELECT value FROM meta WHERE name = 'dim'").fetchone()
+        self.dim: Optional[int] = row[0] if row else None
+        with self._append_lock:
+            self._truncate_partial_row()
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _rows_on_disk(self) -> int:
+        if not self.dim or not os.path.exists(self.vectors_path):
+            return 0
+        return os.path.getsize(self.vectors_path) // (4 * self.dim)
+
+    def _truncate_partial_row(self):
+        """Cut the data file back to whole rows; callers hold the append lock."""
+        if not self.dim or not os.path.exists(self.vectors_path):
+            return
+        whole = self._rows_on_disk() * 4 * self.dim
+        if os.path.getsize(self.vectors_path) != whole:
+            print(f"Truncating a partially written row in {self.vectors_path}")
+            os.truncate(self.vectors_path, whole)
+
+    def _map(self, min_rows: int) -> np.memmap:
+        # Remap only when the file has grown past what is currently mapped
+        if self._matrix is None or self._matrix.shape[0] < min_rows:
+            self._matrix = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(self._rows_on_disk(), self.dim))
+        return self._matrix
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        found: Dict[str, int] = {}
+        with self._connect() as conn:
+            for i in range(0, len(keys), _LOOKUP_BATCH):
+                part = keys[i:i + _LOOKUP_BATCH]
+                placeholders = ",".join("?" * len(part))
+                found.update(conn.execute(f"SELECT key, row FROM vectors WHERE key IN ({placeholders})", part).fetchall())
+        if not found:
+            return {}
+        with self._lock:
+            matrix = self._map(max(found.values()) + 1)
+            return {key: matrix[row].tolist() for key, row in found.items()}
+
+    def put_many(self, keys: Sequence[str], vectors: Sequence[Sequence[float]]):
+        if not keys:
+            return
+        array = np.asarray(vectors, dtype=np.float32)
+        with self._lock, self._append_lock:
+            if self.dim is None:
+                self.dim = int(array.shape[1])
+                with self._connect() as conn:
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('dim', ?)", (self.dim,))
+            self._truncate_partial_row()
+            first_row = self._rows_on_disk()
+            try:
+                with open(self.vectors_path, "ab") as f:
+                    f.write(array.tobytes())
+                    f.flush()
+                    os.fsync(f.fileno())
+            except OSError:
+                # Drop whatever part of the batch reached the file; none of it is indexed
+                os.truncate(self.vectors_path, first_row * 4 * self.dim)
+                raise
+            # Index only the rows that are actually on disk
+            flushed = min(len(keys), self._rows_on_disk() - first_row)
+            with self._connect() as conn:
+                conn.executemany(
+                    "INSERT OR IGNORE INTO vectors VALUES (?, ?)",
+                    [(key, first_row + i) for i, key in enumerate(keys[:flushed])],
+                )
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that serves repeated chunk texts from an on-disk cache.
+
+    Keys are SHA-256 digests of (model name, whitespace-normalized text). Each call does one
+    batched lookup and forwards only the misses, de-duplicated, to the wrapped model.
+    Queries are passed straight through.
+    """
+
+    def __init__(self, base: Embeddings, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR):
+        self.base = base
+        self.model_name = model_name
+        self.store = EmbeddingStore(os.path.join(cache_dir, re.sub(r"[^A-Za-z0-9_.-]", "_", model_name)))
+        self.hits = 0
+        self.misses = 0
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": self.hits / total if total else 0.0}
+
+    def _count(self, hits: int, misses: int):
+        # The single place hits and misses are counted, so stats() and /metrics agree
+        self.hits += hits
+        self.misses += misses
+        metrics.record_cache("embedding", hits=hits, misses=misses)
+
+    def _split(self, texts: List[str]):
+        keys = [self._key(t) for t in texts]
+        cached = self.store.get_many(list(dict.fromkeys(keys)))
+        # One remote embedding per distinct missing text; a miss is a text sent to the model
+        missing = {key: text for key, text in zip(keys, texts) if key not in cached}
+        self._count(len(texts) - len(missing), len(missing))
+        return keys, cached, missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, cached, missing = self._split(texts)
+        if missing:
+            vectors = _as_float32(self.base.embed_documents(list(missing.values())))
+            self.store.put_many(list(missing.keys()), vectors)
+            cached.update(zip(missing.keys(), vectors))
+        return [cached[key] for key in keys]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys, cached, missing = await asyncio.to_thread(self._split, texts)
+        if missing:
+            vectors = _as_float32(await self.base.aembed_documents(list(missing.values())))
+            await asyncio.to_thread(self.store.put_many, list(missing.keys()), vectors)
+            cached.update(zip(missing.keys(), vectors))
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.base.aembed_query(text)
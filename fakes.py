@@ -0,0 +1,224 @@
+import os
+import re
+import time
+import asyncio
+import hashlib
+import threading
+from collections import deque
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, List, Optional
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable, RunnableLambda
+from models import FinalAnswer, GeneratedQueries, GeneratedQueriesForEachQuestion, GroupedAnswers
+
+class FakeRateLimitError(Exception):
+    """Raised by the fakes the way the Gemini client reports quota errors."""
+    code = 429
+
+class FakeRateLimit:
+    """
+    Simulated provider quota shared by fake clients: at most `max_concurrency` calls in
+    flight and `requests_per_minute` calls in any sliding minute. Excess calls fail with
+    FakeRateLimitError instead of queueing, like the real API.
+    """
+
+    def __init__(self, max_concurrency: Optional[int] = None, requests_per_minute: Optional[int] = None):
+        self.max_concurrency = max_concurrency
+        self.requests_per_minute = requests_per_minute
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._recent: deque = deque()
+        self.rejected = 0
+
+    def enter(self):
+        now = time.monotonic()
+        with self._lock:
+            while self._recent and now - self._recent[0] > 60:
+                self._recent.popleft()
+            if (
+                (self.max_concurrency and self._in_flight >= self.max_concurrency)
+                or (self.requests_per_minute and len(self._recent) >= self.requests_per_minute)
+            ):
+                self.rejected += 1
+                raise FakeRateLimitError("429 RESOURCE_EXHAUSTED: simulated quota exceeded")
+            self._in_flight += 1
+            self._recent.append(now)
+
+    def exit(self):
+        with self._lock:
+            self._in_flight -= 1
+
+def _prompt_text(value: Any) -> str:
+    return value.to_string() if hasattr(value, "to_string") else str(value)
+
+def _section(text: str, header: str) -> str:
+    body = text.split(header, 1)[1] if header in text else ""
+    return body.split("INSTRUCTIONS:", 1)[0].strip()
+
+def _numbered_lines(block: str) -> List[str]:
+    return [re.sub(r"^\d+\.\s*", "", line.strip()) for line in block.splitlines() if line.strip()]
+
+class FakeChatModel:
+    """
+    Offline stand-in for ChatGoogleGenerativeAI supporting the structured outputs the
+    workflow requests. Answers are derived from the prompt, so they are deterministic.
+    """
+
+    def __init__(self, latency_s: float = 0.05, rate_limit: Optional[FakeRateLimit] = None):
+        self.latency_s = latency_s
+        self.rate_limit = rate_limit
+        self.calls = 0
+
+    def _respond(self, schema: Any, text: str) -> Any:
+        if schema is GeneratedQueries:
+            questions = _numbered_lines(_section(text, "QUESTIONS:"))
+            return GeneratedQueries(lst=[
+                GeneratedQueriesForEachQuestion(queries=[f"{q} definition", f"{q} conditions", f"{q} limits"])
+                for q in questions
+            ])
+        context = _section(text, "CONTEXT:").split("QUESTION", 1)[0].strip()
+        snippet = context[:80].replace("\n", " ")
+        if schema is GroupedAnswers:
+            questions = _numbered_lines(_section(text, "QUESTIONS:"))
+            return GroupedAnswers(answers=[FinalAnswer(answer=f"{q} -> {snippet}") for q in questions])
+        question = text.split("QUESTION:", 1)[1].strip().splitlines()[0] if "QUESTION:" in text else ""
+        return FinalAnswer(answer=f"{question} -> {snippet}")
+
+    def with_structured_output(self, schema: Any, **kwargs: Any) -> Runnable:
+        def call(value: Any) -> Any:
+            self.calls += 1
+            if self.rate_limit:
+                self.rate_limit.enter()
+            try:
+                time.sleep(self.latency_s)
+                return self._respond(schema, _prompt_text(value))
+            finally:
+                if self.rate_limit:
+                    self.rate_limit.exit()
+
+        async def acall(value: Any) -> Any:
+            self.calls += 1
+            if self.rate_limit:
+                self.rate_limit.enter()
+            try:
+                await asyncio.sleep(self.latency_s)
+                return self._respond(schema, _prompt_text(value))
+            finally:
+                if self.rate_limit:
+                    self.rate_limit.exit()
+
+        return RunnableLambda(call, afunc=acall, name="FakeChatModel")
+
+class FakeEmbeddings(Embeddings):
+    """
+    Offline stand-in for GoogleGenerativeAIEmbeddings: unit vectors seeded from a hash of
+    the text, with simulated per-call latency and an optional shared quota.
+    """
+
+    def __init__(self, size: int = 64, latency_s: float = 0.02, rate_limit: Optional[FakeRateLimit] = None):
+        self.size = size
+        self.latency_s = latency_s
+        self.rate_limit = rate_limit
+        self.calls = 0
+
+    def _vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode("utf-8")).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.size)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _enter(self):
+        self.calls += 1
+        if self.rate_limit:
+            self.rate_limit.enter()
+
+    def _exit(self):
+        if self.rate_limit:
+            self.rate_limit.exit()
+
+    def embed_documents(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        self._enter()
+        try:
+            time.sleep(self.latency_s)
+            return [self._vector(text) for text in texts]
+        finally:
+            self._exit()
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        self._enter()
+        try:
+            await asyncio.sleep(self.latency_s)
+            return [self._vector(text) for text in texts]
+        finally:
+            self._exit()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+class _FakeBlobDownloader:
+    def __init__(self, data: bytes, chunk_size: int):
+        self.data = data
+        self.chunk_size = chunk_size
+
+    async def readall(self) -> bytes:
+        return self.data
+
+    async def chunks(self) -> AsyncIterator[bytes]:
+        for offset in range(0, len(self.data), self.chunk_size):
+            yield self.data[offset:offset + self.chunk_size]
+
+class FakeBlobClient:
+    def __init__(self, container: "FakeContainerClient", name: str):
+        self.container = container
+        self.path = os.path.join(container.directory, name)
+
+    def _etag(self) -> str:
+        stat = os.stat(self.path)
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    async def get_blob_properties(self):
+        await asyncio.sleep(self.container.latency_s)
+        stat = os.stat(self.path)
+        return SimpleNamespace(
+            size=stat.st_size,
+            etag=self._etag(),
+            last_modified=datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc),
+        )
+
+    async def download_blob(self, offset: Optional[int] = None, length: Optional[int] = None, etag: Optional[str] = None, **kwargs: Any):
+        await asyncio.sleep(self.container.latency_s)
+        if etag is not None and etag != self._etag():
+            raise ValueError("ConditionNotMet: blob was modified since its properties were read")
+        with open(self.path, "rb") as f:
+            f.seek(offset or 0)
+            data = f.read(length if length is not None else -1)
+        return _FakeBlobDownloader(data, self.container.chunk_size)
+
+    async def upload_blob(self, data: bytes, overwrite: bool = False, **kwargs: Any):
+        await asyncio.sleep(self.container.latency_s)
+        if not overwrite and os.path.exists(self.path):
+            raise FileExistsError(self.path)
+        with open(self.path, "wb") as f:
+            f.write(data)
+
+class FakeContainerClient:
+    """
+    Directory-backed stand-in for the Azure ContainerClient calls DocumentFetcher and the
+    upload helper make, with a fixed per-request latency.
+    """
+
+    def __init__(self, directory: str, latency_s: float = 0.005, chunk_size: int = 4 * 1024 * 1024):
+        self.directory = directory
+        self.latency_s = latency_s
+        self.chunk_size = chunk_size
+        os.makedirs(directory, exist_ok=True)
+
+    def get_blob_client(self, blob: str) -> FakeBlobClient:
+        return FakeBlobClient(self, blob)
+
+    async def close(self):
+        pass
@@ -0,0 +1,70 @@
+import os
+import time
+import fcntl
+import asyncio
+import threading
+from typing import Optional
+
+_POLL_S = 0.05
+
+class FileLock:
+    """
+    Exclusive advisory lock (flock) on a file, shared by every process on the host.
+
+    Each instance opens its own descriptor, so two instances on the same path also exclude
+    each other within a process. The kernel releases the lock if the holder dies, so a
+    crashed writer never leaves a document locked.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = True) -> bool:
+        with self._lock:
+            if self._fd is not None:
+                return True
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                os.close(fd)
+                return False
+            self._fd = fd
+            return True
+
+    async def aacquire(self, timeout: Optional[float] = None):
+        """Wait for the lock without blocking the event loop; raises TimeoutError after `timeout` seconds."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        while not self.acquire(blocking=False):
+            if deadline is not None and time.monotonic() >= deadline:
+                raise TimeoutError(f"Timed out waiting for lock {self.path}")
+            await asyncio.sleep(_POLL_S)
+
+    def release(self):
+        with self._lock:
+            if self._fd is None:
+                return
+            fd, self._fd = self._fd, None
+        fcntl.flock(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    def __enter__(self) -> "FileLock":
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    async def __aenter__(self) -> "FileLock":
+        await self.aacquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
@@ -0,0 +1,324 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, Iterator, List, Optional
+from config import INGEST_JOB_WORKERS, INGEST_JOB_QUEUE_SIZE, INGEST_JOB_HISTORY, VECTOR_DB_DIR
+from document_cache import cache_key
+
+# Owners refresh their active jobs this often; a job not refreshed for _STALE_AFTER_S lost its worker
+_HEARTBEAT_S = 5
+_STALE_AFTER_S = 30
+# How often a worker waiting on another process's job re-reads its status
+_POLL_S = 0.25
+
+ACTIVE_STATUSES = ("queued", "running")
+_JOB_COLUMNS = "job_id, document_url, status, stage, content_hash, error, stages, heartbeat_at"
+
+class IngestionQueueFullError(RuntimeError):
+    pass
+
+@dataclass
+class IngestionJob:
+    job_id: str
+    document_url: str
+    status: str = "queued"  # queued -> running -> completed | failed
+    stage: str = "queued"  # queued -> downloading -> downloaded -> indexing -> indexed
+    content_hash: Optional[str] = None
+    error: Optional[str] = None
+    # Time each stage was entered, so clients can see where the time went
+    stages: Dict[str, float] = field(default_factory=lambda: {"queued": time.time()})
+    heartbeat_at: float = field(default_factory=time.time)
+    # Set only in the worker process running the job
+    done: Optional[asyncio.Future] = field(default=None, repr=False)
+
+    def enter(self, stage: str):
+        self.stage = stage
+        self.stages[stage] = time.time()
+
+    @property
+    def active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+class IngestionJobStore:
+    """
+    Ingestion jobs in a sqlite table next to the ingestion manifest, shared by every worker
+    process. A partial unique index allows one queued or running job per document URL, so
+    two workers submitting the same URL at once get the same job.
+    """
+
+    def __init__(self, path: str = os.path.join(VECTOR_DB_DIR, "ingestion_jobs.sqlite3")):
+        self.path = path
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as conn:
+            # WAL lets serving workers read while another process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS jobs (
+                    job_id TEXT PRIMARY KEY,
+                    document_url TEXT NOT NULL,
+                    url_key TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    stage TEXT NOT NULL,
+                    content_hash TEXT,
+                    error TEXT,
+                    stages TEXT NOT NULL,
+                    owner TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    heartbeat_at REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_url ON jobs (url_key)
+                   WHERE status IN ('queued', 'running')"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _job(row) -> IngestionJob:
+        job_id, document_url, status, stage, content_hash, error, stages, heartbeat_at = row
+        return IngestionJob(job_id, document_url, status, stage, content_hash, error, json.loads(stages), heartbeat_at)
+
+    def create(self, job: IngestionJob, owner: str) -> IngestionJob:
+        """Insert a queued job, or return the job already queued or running for its URL."""
+        with self._connect() as conn:
+            try:
+                conn.execute(
+                    "INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        job.job_id, job.document_url, cache_key(job.document_url), job.status, job.stage,
+                        job.content_hash, job.error, json.dumps(job.stages), owner, job.stages["queued"], job.heartbeat_at,
+                    ),
+                )
+                return job
+            except sqlite3.IntegrityError:
+                pass
+        existing = self.active(job.document_url)
+        # The other job may have finished between the insert and the lookup
+        return existing if existing is not None else self.create(job, owner)
+
+    def save(self, job: IngestionJob):
+        with self._connect() as conn:
+            conn.execute(
+                """UPDATE jobs SET status = ?, stage = ?, content_hash = ?, error = ?, stages = ?, heartbeat_at = ?
+                   WHERE job_id = ?""",
+                (job.status, job.stage, job.content_hash, job.error, json.dumps(job.stages), time.time(), job.job_id),
+            )
+
+    def get(self, job_id: str) -> Optional[IngestionJob]:
+        with self._connect() as conn:
+            row = conn.execute(f"SELECT {_JOB_COLUMNS} FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._job(row) if row else None
+
+    def active(self, document_url: str) -> Optional[IngestionJob]:
+        """The queued or running job for a URL, if any."""
+        with self._connect() as conn:
+            row = conn.execute(
+                f"SELECT {_JOB_COLUMNS} FROM jobs WHERE url_key = ? AND status IN ('queued', 'running')",
+                (cache_key(document_url),),
+            ).fetchone()
+        return self._job(row) if row else None
+
+    def discard(self, job_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM jobs WHERE job_id = ?", (job_id,))
+
+    def heartbeat(self, owner: str):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET heartbeat_at = ? WHERE owner = ? AND status IN ('queued', 'running')",
+                (time.time(), owner),
+            )
+
+    def fail_owned(self, owner: str, error: str):
+        """Fail every unfinished job of an owner, e.g. one whose worker is shutting down."""
+        self._fail("owner = ?", (owner,), error)
+
+    def reap(self, stale_before: float) -> int:
+        """Fail unfinished jobs whose owner stopped refreshing them, i.e. whose worker process died."""
+        return self._fail("heartbeat_at < ?", (stale_before,), "The worker running this job exited before it finished")
+
+    def _fail(self, condition: str, params: tuple, error: str) -> int:
+        now = time.time()
+        with self._connect() as conn:
+            cursor = conn.execute(
+                f"""UPDATE jobs SET status = 'failed', error = ?, stages = json_set(stages, '$.failed', ?)
+                    WHERE status IN ('queued', 'running') AND {condition}""",
+                (error, now, *params),
+            )
+            return cursor.rowcount
+
+    def prune(self, history: int):
+        """Keep the `history` most recent finished jobs; unfinished ones are never pruned."""
+        with self._connect() as conn:
+            conn.execute(
+                """DELETE FROM jobs WHERE status NOT IN ('queued', 'running') AND job_id NOT IN (
+                       SELECT job_id FROM jobs ORDER BY created_at DESC LIMIT ?)""",
+                (history,),
+            )
+
+class IngestionQueue:
+    """
+    Bounded background queue that warms documents before questions arrive.
+
+    `submit` enqueues a fetch -> parse -> embed -> index job and returns immediately; at most
+    `max_queued` jobs wait and `workers` run at once in each process. Jobs are recorded in an
+    IngestionJobStore shared by all worker processes, so any worker can report a job's status,
+    a URL with a job already queued or running anywhere gets that job back instead of a
+    duplicate, and requests wait for it wherever it runs. The last `history` jobs are kept
+    for status lookups.
+    """
+
+    def __init__(
+        self,
+        workers: int = INGEST_JOB_WORKERS,
+        max_queued: int = INGEST_JOB_QUEUE_SIZE,
+        history: int = INGEST_JOB_HISTORY,
+        store: Optional[IngestionJobStore] = None,
+    ):
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.history = history
+        self.store = store or IngestionJobStore()
+        # Identifies this process's jobs in the shared store
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex}"
+        self._local: Dict[str, IngestionJob] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    def _ensure_workers(self):
+        # Workers live on the serving event loop, so they are started by the first submit
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queued)
+            self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+            self._tasks.append(asyncio.ensure_future(self._heartbeat()))
+
+    def _queue_full_error(self) -> IngestionQueueFullError:
+        return IngestionQueueFullError(f"Ingestion queue is full ({self.max_queued} jobs waiting)")
+
+    async def submit(self, document_url: str) -> IngestionJob:
+        # Store calls may wait on another worker's write, so they run off the event loop
+        await asyncio.to_thread(self.store.reap, time.time() - _STALE_AFTER_S)
+        existing = await asyncio.to_thread(self.store.active, document_url)
+        if existing is not None:
+            return self._local.get(existing.job_id, existing)
+        self._ensure_workers()
+        if self._queue.full():
+            raise self._queue_full_error()
+        job = IngestionJob(job_id=uuid.uuid4().hex, document_url=document_url)
+        stored = await asyncio.to_thread(self.store.create, job, self.owner)
+        if stored is not job:
+            # Another worker queued this URL a moment ago
+            return self._local.get(stored.job_id, stored)
+        if self._queue.full():
+            # Filled by concurrent submits while the job was being recorded
+            await asyncio.to_thread(self.store.discard, job.job_id)
+            raise self._queue_full_error()
+        job.done = asyncio.get_running_loop().create_future()
+        self._local[job.job_id] = job
+        self._queue.put_nowait(job)
+        await asyncio.to_thread(self.store.prune, self.history)
+        return job
+
+    async def get(self, job_id: str) -> Optional[IngestionJob]:
+        if job_id in self._local:
+            return self._local[job_id]
+        await asyncio.to_thread(self.store.reap, time.time() - _STALE_AFTER_S)
+        return await asyncio.to_thread(self.store.get, job_id)
+
+    async def wait_for(self, document_url: str):
+        """Wait for a queued or running job on this URL to finish. Failures are left to the caller's own attempt."""
+        job = await asyncio.to_thread(self.store.active, document_url)
+        if job is None:
+            return
+        print(f"Waiting for ingestion job {job.job_id}")
+        local = self._local.get(job.job_id)
+        if local is not None:
+            await asyncio.shield(local.done)
+            return
+        # Run by another worker process; follow it through the shared store
+        while job is not None and job.active:
+            if time.time() - job.heartbeat_at > _STALE_AFTER_S:
+                await asyncio.to_thread(self.store.reap, time.time() - _STALE_AFTER_S)
+                return
+            await asyncio.sleep(_POLL_S)
+            job = await asyncio.to_thread(self.store.get, job.job_id)
+
+    async def _enter(self, job: IngestionJob, stage: str):
+        job.enter(stage)
+        await asyncio.to_thread(self.store.save, job)
+
+    async def _run(self, job: IngestionJob):
+        # Imported here so the API can import this module without loading the RAG stack
+        from document_manager import DocumentManager
+        from retriever import VectorStoreProvider
+        job.status = "running"
+        await self._enter(job, "downloading")
+        manager = await DocumentManager.acreate(job.document_url)
+        job.content_hash = manager.get_content_hash()
+        await self._enter(job, "downloaded")
+        await self._enter(job, "indexing")
+        await VectorStoreProvider.acreate(manager)
+        job.enter("indexed")
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._run(job)
+                job.status = "completed"
+            except Exception as e:
+                print(f"Ingestion job {job.job_id} failed: {e}")
+                job.status = "failed"
+                job.error = str(e)
+            finally:
+                job.stages[job.status] = time.time()
+                try:
+                    await asyncio.to_thread(self.store.save, job)
+                finally:
+                    self._local.pop(job.job_id, None)
+                    job.done.set_result(None)
+
+    async def _heartbeat(self):
+        while True:
+            await asyncio.sleep(_HEARTBEAT_S)
+            try:
+                await asyncio.to_thread(self.store.heartbeat, self.owner)
+            except sqlite3.Error as e:
+                print(f"Failed to refresh ingestion jobs: {e}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks, self._queue = [], None
+        # Jobs this worker will never finish must not keep other workers waiting
+        await asyncio.to_thread(self.store.fail_owned, self.owner, "The worker running this job shut down before it finished")
+        for job in self._local.values():
+            if not job.done.done():
+                job.done.set_result(None)
+        self._local.clear()
+
+_queue_lock = threading.Lock()
+_ingestion_queue: Optional[IngestionQueue] = None
+
+def get_ingestion_queue() -> IngestionQueue:
+    global _ingestion_queue
+    with _queue_lock:
+        if _ingestion_queue is None:
+            _ingestion_queue = IngestionQueue()
+        return _ingestion_queue
@@ -0,0 +1,184 @@
+import os
+import time
+import sqlite3
+from contextlib import contextmanager
+from typing import Iterator, List, Optional, Set, Tuple
+from config import VECTOR_DB_DIR
+from document_cache import cache_key
+
+class IngestionManifest:
+    """
+    Persistent record of which documents have been fully embedded into the vector store.
+
+    An entry is keyed by the document's content hash together with the index backend,
+    splitter settings and embedding model used, so changing any of them forces a re-ingest.
+    Entries are only written after every chunk has been stored, so a partially embedded
+    document is never reported as indexed. The `indexes` table tracks each stored index's
+    size and last access, which drives eviction, and `retired` lists indexes superseded by a
+    newer version of their document, which compaction removes once nothing uses them.
+    """
+
+    def __init__(self, path: str = os.path.join(VECTOR_DB_DIR, "manifest.sqlite3")):
+        self.path = path
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._connect() as conn:
+            # WAL lets serving workers read while another process writes
+            conn.execute("PRAGMA journal_mode=WAL")
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(ingestions)")]
+            if columns and "backend" not in columns:
+                # Manifests written before backends were selectable only described the Chroma store
+                conn.execute("ALTER TABLE ingestions RENAME TO ingestions_v1")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS ingestions (
+                    content_hash TEXT NOT NULL,
+                    backend TEXT NOT NULL,
+                    splitter TEXT NOT NULL,
+                    embedding_model TEXT NOT NULL,
+                    chunk_count INTEGER NOT NULL,
+                    completed_at REAL NOT NULL,
+                    PRIMARY KEY (content_hash, backend, splitter, embedding_model)
+                )"""
+            )
+            if columns and "backend" not in columns:
+                conn.execute(
+                    """INSERT INTO ingestions SELECT content_hash, 'chroma', splitter, embedding_model,
+                       chunk_count, completed_at FROM ingestions_v1"""
+                )
+                conn.execute("DROP TABLE ingestions_v1")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS sources (
+                    url TEXT PRIMARY KEY,
+                    content_hash TEXT NOT NULL,
+                    seen_at REAL NOT NULL
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS indexes (
+                    content_hash TEXT NOT NULL,
+                    backend TEXT NOT NULL,
+                    size_bytes INTEGER NOT NULL,
+                    chunk_count INTEGER NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (content_hash, backend)
+                )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS retired (
+                    content_hash TEXT NOT NULL,
+                    backend TEXT NOT NULL,
+                    retired_at REAL NOT NULL,
+                    PRIMARY KEY (content_hash, backend)
+                )"""
+            )
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def lookup(self, content_hash: str, backend: str, splitter: str, embedding_model: str) -> Optional[int]:
+        """Return the chunk count of a completed ingestion, or None if the document is not indexed."""
+        with self._connect() as conn:
+            row = conn.execute(
+                """SELECT chunk_count FROM ingestions
+                   WHERE content_hash = ? AND backend = ? AND splitter = ? AND embedding_model = ?""",
+                (content_hash, backend, splitter, embedding_model),
+            ).fetchone()
+        return row[0] if row else None
+
+    def record(
+        self, url: str, content_hash: str, backend: str, splitter: str, embedding_model: str,
+        chunk_count: int, size_bytes: int = 0,
+    ):
+        """Mark an ingestion as complete. All rows are written in one transaction."""
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO ingestions VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash, backend, splitter, embedding_model, chunk_count, now),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO sources VALUES (?, ?, ?)",
+                (cache_key(url), content_hash, now),
+            )
+            conn.execute(
+                "INSERT OR REPLACE INTO indexes VALUES (?, ?, ?, ?, ?)",
+                (content_hash, backend, size_bytes, chunk_count, now),
+            )
+            # A URL serving this version again brings a retired index back into use
+            conn.execute("DELETE FROM retired WHERE content_hash = ? AND backend = ?", (content_hash, backend))
+
+    def track(self, content_hash: str, backend: str, size_bytes: int, chunk_count: int):
+        """Start tracking an index stored before access tracking existed."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO indexes VALUES (?, ?, ?, ?, ?)",
+                (content_hash, backend, size_bytes, chunk_count, time.time()),
+            )
+
+    def touch(self, content_hash: str, backend: str):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE indexes SET last_access = ? WHERE content_hash = ? AND backend = ?",
+                (time.time(), content_hash, backend),
+            )
+
+    def indexes(self, backend: str) -> List[Tuple[str, int, int, float]]:
+        """(content_hash, size_bytes, chunk_count, last_access) of every tracked index, least recently used first."""
+        with self._connect() as conn:
+            return conn.execute(
+                """SELECT content_hash, size_bytes, chunk_count, last_access FROM indexes
+                   WHERE backend = ? ORDER BY last_access""",
+                (backend,),
+            ).fetchall()
+
+    def tracked(self, backend: str) -> Set[str]:
+        with self._connect() as conn:
+            return {row[0] for row in conn.execute("SELECT content_hash FROM indexes WHERE backend = ?", (backend,))}
+
+    def latest_chunk_count(self, content_hash: str, backend: str) -> Optional[int]:
+        """Chunk count of the most recent completed ingestion of a document into a backend, under any settings."""
+        with self._connect() as conn:
+            row = conn.execute(
+                """SELECT chunk_count FROM ingestions WHERE content_hash = ? AND backend = ?
+                   ORDER BY completed_at DESC LIMIT 1""",
+                (content_hash, backend),
+            ).fetchone()
+        return row[0] if row else None
+
+    def source_hash(self, url: str) -> Optional[str]:
+        """Content hash the URL resolved to when it was last indexed."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT content_hash FROM sources WHERE url = ?", (cache_key(url),)).fetchone()
+        return row[0] if row else None
+
+    def urls_for(self, content_hash: str) -> List[str]:
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute("SELECT url FROM sources WHERE content_hash = ?", (content_hash,))]
+
+    def retire(self, content_hash: str, backend: str):
+        """Mark an index as superseded; `retired` reports it once the grace period has passed."""
+        with self._connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO retired VALUES (?, ?, ?)", (content_hash, backend, time.time()))
+
+    def retired(self, backend: str, before: float) -> List[str]:
+        """Indexes retired and last used before `before` that no URL serves any more."""
+        with self._connect() as conn:
+            return [row[0] for row in conn.execute(
+                """SELECT r.content_hash FROM retired r
+                   LEFT JOIN indexes i ON i.content_hash = r.content_hash AND i.backend = r.backend
+                   WHERE r.backend = ? AND r.retired_at < ? AND COALESCE(i.last_access, 0) < ?
+                   AND NOT EXISTS (SELECT 1 FROM sources s WHERE s.content_hash = r.content_hash)""",
+                (backend, before, before),
+            )]
+
+    def forget(self, content_hash: str, backend: str):
+        """Drop every record of a document's index, so the next request re-ingests it."""
+        with self._connect() as conn:
+            conn.execute("DELETE FROM ingestions WHERE content_hash = ? AND backend = ?", (content_hash, backend))
+            conn.execute("DELETE FROM indexes WHERE content_hash = ? AND backend = ?", (content_hash, backend))
+            conn.execute("DELETE FROM retired WHERE content_hash = ? AND backend = ?", (content_hash, backend))
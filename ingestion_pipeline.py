@@ -0,0 +1,106 @@
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, Iterable, Iterator, List, Tuple
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from config import CHUNK_SIZE, CHUNK_OVERLAP, EMBED_BATCH_SIZE, INGEST_QUEUE_BATCHES, EMBED_CONCURRENCY
+
+# A sink receives one batch of chunks plus the index of its first chunk within the document
+Sink = Callable[[List[Document], int], None]
+AsyncSink = Callable[[List[Document], int], Awaitable[None]]
+
+_END = None
+
+async def aiter_documents(loader) -> AsyncIterator[Document]:
+    """Iterate any of the loaders asynchronously, preferring a native `alazy_load`."""
+    if hasattr(loader, "alazy_load"):
+        async for doc in loader.alazy_load():
+            yield doc
+        return
+    iterator = iter(loader.lazy_load())
+    while True:
+        doc = await asyncio.to_thread(next, iterator, _END)
+        if doc is _END:
+            return
+        yield doc
+
+class IngestionPipeline:
+    """
+    Streams pages through split -> embed in fixed-size batches.
+
+    Pages are split as soon as they are produced and chunks are handed to the sink in
+    batches of `batch_size`, so embedding starts while parsing is still running. In the async
+    variant the stages are connected by a queue of at most `max_pending_batches` batches:
+    when the embedder falls behind, the splitter blocks, which in turn stops pulling pages
+    from the loader. Memory therefore stays bounded by the queue size, not the page count.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = CHUNK_SIZE,
+        chunk_overlap: int = CHUNK_OVERLAP,
+        batch_size: int = EMBED_BATCH_SIZE,
+        max_pending_batches: int = INGEST_QUEUE_BATCHES,
+        embed_concurrency: int = EMBED_CONCURRENCY,
+    ):
+        self.splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+        self.batch_size = max(1, batch_size)
+        self.max_pending_batches = max(1, max_pending_batches)
+        self.embed_concurrency = max(1, embed_concurrency)
+
+    def iter_batches(self, pages: Iterable[Document]) -> Iterator[Tuple[List[Document], int]]:
+        batch: List[Document] = []
+        start = 0
+        for page in pages:
+            for chunk in self.splitter.split_documents([page]):
+                batch.append(chunk)
+                if len(batch) == self.batch_size:
+                    yield batch, start
+                    start += len(batch)
+                    batch = []
+        if batch:
+            yield batch, start
+
+    def run(self, pages: Iterable[Document], sink: Sink) -> int:
+        """Synchronous, sequential variant. Returns the number of chunks written."""
+        count = 0
+        for batch, start in self.iter_batches(pages):
+            sink(batch, start)
+            count = start + len(batch)
+        return count
+
+    async def arun(self, pages: AsyncIterator[Document], sink: AsyncSink) -> int:
+        """Run parse/split and embed concurrently with backpressure. Returns the number of chunks written."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.max_pending_batches)
+
+        async def produce() -> int:
+            batch: List[Document] = []
+            start = 0
+            async for page in pages:
+                # Splitting one page is cheap, so it runs inline between page arrivals
+                for chunk in self.splitter.split_documents([page]):
+                    batch.append(chunk)
+                    if len(batch) == self.batch_size:
+                        await queue.put((batch, start))
+                        start += len(batch)
+                        batch = []
+            if batch:
+                await queue.put((batch, start))
+                start += len(batch)
+            for _ in range(self.embed_concurrency):
+                await queue.put(_END)
+            return start
+
+        async def consume():
+            while (item := await queue.get()) is not _END:
+                batch, start = item
+                await sink(batch, start)
+
+        producer = asyncio.ensure_future(produce())
+        consumers = [asyncio.ensure_future(consume()) for _ in range(self.embed_concurrency)]
+        try:
+            await asyncio.gather(producer, *consumers)
+        except BaseException:
+            for task in (producer, *consumers):
+                task.cancel()
+            raise
+        return producer.result()
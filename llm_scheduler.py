@@ -0,0 +1,299 @@
+import time
+import random
+import asyncio
+import threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple, TypeVar
+from langchain_core.embeddings import Embeddings
+from langchain_core.runnables import Runnable, RunnableLambda
+import metrics
+from config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_TOKENS_PER_MINUTE,
+    EMBEDDING_MAX_CONCURRENCY,
+    EMBEDDING_TOKENS_PER_MINUTE,
+    RATE_LIMIT_RETRIES,
+    RATE_LIMIT_BACKOFF_BASE_S,
+    RATE_LIMIT_BACKOFF_MAX_S,
+    EMBED_COALESCE_WINDOW_MS,
+    EMBED_COALESCE_MAX_TEXTS,
+)
+
+T = TypeVar("T")
+
+# Rough size of a structured answer, charged up front with the prompt
+OUTPUT_TOKEN_ESTIMATE = 256
+_POLL_S = 0.02
+
+def estimate_tokens(value: Any) -> int:
+    if hasattr(value, "to_string"):
+        value = value.to_string()
+    elif isinstance(value, (list, tuple)):
+        return sum(estimate_tokens(item) for item in value)
+    elif isinstance(value, dict):
+        return sum(estimate_tokens(item) for item in value.values())
+    return (len(str(value)) + 3) // 4
+
+def _rate_limit_error_types() -> tuple:
+    try:
+        from google.api_core.exceptions import ResourceExhausted, TooManyRequests
+    except ImportError:
+        # Only installed alongside the gRPC clients; google-genai errors carry the status code instead
+        return ()
+    return (ResourceExhausted, TooManyRequests)
+
+_RATE_LIMIT_ERROR_TYPES = _rate_limit_error_types()
+
+def _status_code(error: BaseException) -> Any:
+    response = getattr(error, "response", None)
+    for value in (getattr(error, "code", None), getattr(error, "status_code", None), getattr(response, "status_code", None)):
+        if value is not None:
+            return value
+    return None
+
+def is_rate_limit_error(error: BaseException) -> bool:
+    """True for 429 / RESOURCE_EXHAUSTED errors, however deeply the client library wrapped them."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, _RATE_LIMIT_ERROR_TYPES) or _status_code(error) == 429:
+            return True
+        if getattr(error, "status", None) == "RESOURCE_EXHAUSTED":
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+class ModelLimiter:
+    """
+    Process-wide admission control for one model.
+
+    A call needs a concurrency slot and its estimated tokens from a per-minute token
+    bucket. On a rate-limit error every caller of the model pauses for an exponentially
+    growing backoff and the concurrency limit is halved; successes shrink the backoff and
+    restore the limit one slot at a time. State is guarded by a thread lock so the sync
+    and async paths, and any event loop, share the same budget.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_concurrency: int,
+        tokens_per_minute: int = 0,
+        max_retries: int = RATE_LIMIT_RETRIES,
+        backoff_base_s: float = RATE_LIMIT_BACKOFF_BASE_S,
+        backoff_max_s: float = RATE_LIMIT_BACKOFF_MAX_S,
+    ):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.backoff_base_s = backoff_base_s
+        self.backoff_max_s = backoff_max_s
+        self._lock = threading.Lock()
+        self._limit = self.max_concurrency
+        self._in_flight = 0
+        self._tokens = float(tokens_per_minute)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._backoff_s = 0.0
+        self.rate_limited = 0
+
+    def _try_acquire(self, tokens: int) -> float:
+        """Take a slot and the tokens, or return how long to wait before trying again."""
+        now = time.monotonic()
+        with self._lock:
+            if now < self._paused_until:
+                return self._paused_until - now
+            if self._in_flight >= self._limit:
+                return _POLL_S
+            if self.tokens_per_minute:
+                rate = self.tokens_per_minute / 60.0
+                self._tokens = min(self.tokens_per_minute, self._tokens + (now - self._refilled_at) * rate)
+                self._refilled_at = now
+                # A request larger than the whole bucket waits for a full bucket rather than forever
+                needed = min(tokens, self.tokens_per_minute)
+                if self._tokens < needed:
+                    return (needed - self._tokens) / rate
+                self._tokens -= needed
+            self._in_flight += 1
+            return 0.0
+
+    def _release(self, error: Optional[BaseException]):
+        with self._lock:
+            self._in_flight -= 1
+            if error is not None and is_rate_limit_error(error):
+                self.rate_limited += 1
+                self._backoff_s = min(self.backoff_max_s, max(self.backoff_base_s, self._backoff_s * 2))
+                self._paused_until = max(self._paused_until, time.monotonic() + self._backoff_s * random.uniform(0.8, 1.2))
+                self._limit = max(1, self._limit // 2)
+            elif error is None:
+                self._backoff_s /= 2
+                self._limit = min(self.max_concurrency, self._limit + 1)
+
+    def _record(self, started: float, error: Optional[BaseException], tokens: int):
+        outcome = "ok" if error is None else "rate_limited" if is_rate_limit_error(error) else "error"
+        metrics.record_llm_call(self.name, time.perf_counter() - started, outcome)
+        metrics.record_tokens("model_input_estimate", tokens)
+
+    async def arun(self, func: Callable[[], Awaitable[T]], tokens: int = 0) -> T:
+        for attempt in range(self.max_retries + 1):
+            while (wait := self._try_acquire(tokens)) > 0:
+                await asyncio.sleep(wait)
+            started = time.perf_counter()
+            try:
+                result = await func()
+            except BaseException as e:
+                self._record(started, e, tokens)
+                self._release(e)
+                if attempt < self.max_retries and is_rate_limit_error(e):
+                    print(f"{self.name}: rate limited, retrying ({attempt + 1}/{self.max_retries})")
+                    continue
+                raise
+            self._record(started, None, tokens)
+            self._release(None)
+            return result
+        raise AssertionError("unreachable")
+
+    def run(self, func: Callable[[], T], tokens: int = 0) -> T:
+        for attempt in range(self.max_retries + 1):
+            while (wait := self._try_acquire(tokens)) > 0:
+                time.sleep(wait)
+            started = time.perf_counter()
+            try:
+                result = func()
+            except BaseException as e:
+                self._record(started, e, tokens)
+                self._release(e)
+                if attempt < self.max_retries and is_rate_limit_error(e):
+                    print(f"{self.name}: rate limited, retrying ({attempt + 1}/{self.max_retries})")
+                    continue
+                raise
+            self._record(started, None, tokens)
+            self._release(None)
+            return result
+        raise AssertionError("unreachable")
+
+class ScheduledChatModel:
+    """
+    Chat model whose structured-output calls go through a ModelLimiter.
+
+    Only `with_structured_output` is exposed, which is all the workflow uses; the returned
+    runnable composes with prompts like the underlying one.
+    """
+
+    def __init__(self, model: Any, limiter: ModelLimiter):
+        self.model = model
+        self.limiter = limiter
+
+    def with_structured_output(self, schema: Any, **kwargs: Any) -> Runnable:
+        inner = self.model.with_structured_output(schema, **kwargs)
+
+        def call(value: Any) -> Any:
+            return self.limiter.run(lambda: inner.invoke(value), estimate_tokens(value) + OUTPUT_TOKEN_ESTIMATE)
+
+        async def acall(value: Any) -> Any:
+            return await self.limiter.arun(lambda: inner.ainvoke(value), estimate_tokens(value) + OUTPUT_TOKEN_ESTIMATE)
+
+        return RunnableLambda(call, afunc=acall, name=f"Scheduled{type(self.model).__name__}")
+
+class ScheduledEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that rate-limits calls and coalesces concurrent async requests.
+
+    `aembed_documents` calls arriving within `window_ms` of each other (from any request)
+    with the same keyword arguments are merged into one call of up to `max_texts` texts,
+    and the vectors are handed back to each caller. Sync calls are rate-limited only.
+    """
+
+    def __init__(
+        self,
+        wrapped: Embeddings,
+        limiter: ModelLimiter,
+        window_ms: float = EMBED_COALESCE_WINDOW_MS,
+        max_texts: int = EMBED_COALESCE_MAX_TEXTS,
+    ):
+        self.wrapped = wrapped
+        self.limiter = limiter
+        self.window_s = window_ms / 1000.0
+        self.max_texts = max(1, max_texts)
+        self._lock = threading.Lock()
+        self._pending: Dict[Tuple, List[Tuple[List[str], asyncio.Future]]] = {}
+        # Window timer of each pending batch, cancelled when the batch fills up first
+        self._timers: Dict[Tuple, asyncio.TimerHandle] = {}
+        # The loop only keeps weak references to tasks, so in-flight flushes are held here
+        self._flushes: Set[asyncio.Task] = set()
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        self.calls += 1
+        return self.limiter.run(lambda: self.wrapped.embed_documents(texts, **kwargs), estimate_tokens(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        return self.limiter.run(lambda: self.wrapped.embed_query(text), estimate_tokens(text))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        self.calls += 1
+        return await self.limiter.arun(lambda: self.wrapped.aembed_query(text), estimate_tokens(text))
+
+    async def aembed_documents(self, texts: List[str], **kwargs: Any) -> List[List[float]]:
+        if not texts:
+            return []
+        loop = asyncio.get_running_loop()
+        key = (loop, tuple(sorted(kwargs.items())))
+        future = loop.create_future()
+        with self._lock:
+            pending = self._pending.setdefault(key, [])
+            pending.append((texts, future))
+            first = len(pending) == 1
+            full = sum(len(t) for t, _ in pending) >= self.max_texts
+            if full:
+                timer = self._timers.pop(key, None)
+                if timer is not None:
+                    timer.cancel()
+            elif first:
+                self._timers[key] = loop.call_later(self.window_s, lambda: self._start_flush(key, kwargs))
+        if full:
+            self._start_flush(key, kwargs)
+        return await future
+
+    def _start_flush(self, key: Tuple, kwargs: Dict[str, Any]):
+        task = asyncio.ensure_future(self._flush(key, kwargs))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, key: Tuple, kwargs: Dict[str, Any]):
+        with self._lock:
+            pending = self._pending.pop(key, [])
+            self._timers.pop(key, None)
+        if not pending:
+            return
+        texts = [text for batch, _ in pending for text in batch]
+        self.calls += 1
+        try:
+            vectors = await self.limiter.arun(lambda: self.wrapped.aembed_documents(texts, **kwargs), estimate_tokens(texts))
+        except BaseException as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        offset = 0
+        for batch, future in pending:
+            if not future.done():
+                future.set_result(vectors[offset:offset + len(batch)])
+            offset += len(batch)
+
+_limiters_lock = threading.Lock()
+_limiters: Dict[str, ModelLimiter] = {}
+
+def get_limiter(model_name: str, max_concurrency: int = LLM_MAX_CONCURRENCY, tokens_per_minute: int = LLM_TOKENS_PER_MINUTE) -> ModelLimiter:
+    """One limiter per model name, shared by every client of that model in the process."""
+    with _limiters_lock:
+        if model_name not in _limiters:
+            _limiters[model_name] = ModelLimiter(model_name, max_concurrency, tokens_per_minute)
+        return _limiters[model_name]
+
+def schedule_chat_model(model: Any, model_name: str) -> ScheduledChatModel:
+    return ScheduledChatModel(model, get_limiter(model_name))
+
+def schedule_embeddings(embeddings: Embeddings, model_name: str) -> ScheduledEmbeddings:
+    return ScheduledEmbeddings(embeddings, get_limiter(model_name, EMBEDDING_MAX_CONCURRENCY, EMBEDDING_TOKENS_PER_MINUTE))
@@ -1,37 +1,26 @@
 from fastapi import FastAPI, HTTPException, status, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from typing import List
 from rich import print as rprint
 from rich.panel import Panel
-import requests, os, tempfile, time, traceback
+import asyncio, json, os, threading, time, traceback
 from dotenv import load_dotenv
-from azure.storage.blob import BlobServiceClient
 from config import *
-from models import QueryRequest, QueryResponse, FinalAnswer, Question
-from query_service import QueryService
+from models import QueryRequest, QueryResponse, CitedAnswer, Question, DocumentIngestRequest, IngestionJobResponse
+from worker_pool import shutdown_process_pool
+import metrics
+from ingestion_jobs import get_ingestion_queue, IngestionJob, IngestionQueueFullError
+from admission import RequestBudget, OverloadedError, AdmissionTimeoutError
 
 # Load env vars
 load_dotenv()
 
-# --- Azure Blob Storage Setup ---
-account_url = os.getenv("AZURE_STORAGE_ACCOUNT_URL")
-container_name = os.getenv("AZURE_STORAGE_CONTAINER")
-account_key = os.getenv("AZURE_STORAGE_KEY")
-
-if not account_url or not container_name or not account_key:
-    raise RuntimeError("Missing Azure Blob Storage env vars")
-
-blob_service = BlobServiceClient(account_url=account_url, credential=account_key)
-container_client = blob_service.get_container_client(container_name)
-
-def upload_blob(blob_name: str, data: bytes):
-    blob_client = container_client.get_blob_client(blob=blob_name)
-    blob_client.upload_blob(data, overwrite=True)
-
-def download_blob_to_path(blob_name: str, local_path: str):
-    blob_client = container_client.get_blob_client(blob=blob_name)
-    with open(local_path, "wb") as f:
-        f.write(blob_client.download_blob().readall())
+# blob:// documents are streamed by the shared DocumentFetcher; uploads reuse its container client
+async def upload_blob(blob_name: str, data: bytes):
+    from document_fetcher import get_document_fetcher
+    blob_client = get_document_fetcher().container_client().get_blob_client(blob=blob_name)
+    await blob_client.upload_blob(data, overwrite=True)
 
 # --- FastAPI App Initialization ---
 app = FastAPI(
@@ -40,9 +29,51 @@ app = FastAPI(
     version="1.0.0",
 )
 
-query_service = QueryService()
 security = HTTPBearer()
 
+# --- Lazily Constructed Services ---
+# Importing the RAG stack (LangChain, Chroma, the model clients) takes seconds, so it is
+# loaded by the startup warmup or the first request that needs it, not when this module loads
+_query_service = None
+_query_service_lock = threading.Lock()
+readiness = {"status": "starting", "error": None, "warmup_s": None}
+
+def get_query_service():
+    global _query_service
+    with _query_service_lock:
+        if _query_service is None:
+            from query_service import QueryService
+            _query_service = QueryService()
+            # Built lazily (no warmup, or a request racing it); a running warmup reports for itself
+            if readiness["status"] != "warming":
+                readiness.update(status="ready", error=None)
+        return _query_service
+
+async def aget_query_service():
+    if _query_service is not None:
+        return _query_service
+    # A request racing the warmup waits for it off the event loop
+    return await asyncio.to_thread(get_query_service)
+
+def warm_up():
+    """Builds the query service, model clients, vector backend and fetcher ahead of the first request."""
+    start = time.perf_counter()
+    readiness["status"] = "warming"
+    try:
+        get_query_service()
+        from retriever import get_embeddings, get_backend, start_index_maintenance
+        from document_fetcher import get_document_fetcher
+        get_embeddings()
+        get_backend()
+        get_document_fetcher()
+        start_index_maintenance()
+    except Exception as e:
+        readiness.update(status="error", error=str(e))
+        rprint(Panel(f"[bold red]Warmup failed:[/bold red]\n{e}", title="[red]System Status[/red]"))
+        return
+    readiness.update(status="ready", warmup_s=round(time.perf_counter() - start, 3))
+    rprint(f"[green]Warmup complete in {readiness['warmup_s']:.2f}s[/green]")
+
 # --- Security Dependency ---
 async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     if credentials.scheme != "Bearer" or credentials.credentials != API_AUTH_TOKEN:
@@ -56,20 +87,79 @@ async def verify_token(credentials: HTTPAuthorizationCredentials = Depends(secur
 # --- Application Events ---
 @app.on_event("startup")
 def on_startup():
-    if not GOOGLE_API_KEY:
-        raise RuntimeError("Missing critical environment variable: GOOGLE_API_KEY")
-    rprint(Panel("Application startup complete. API token loaded.", title="[green]System Status[/green]"))
+    missing = missing_settings()
+    if missing:
+        rprint(Panel(f"Missing environment variables: {', '.join(missing)}", title="[red]System Status[/red]"))
+    if WARMUP_ON_STARTUP:
+        # The server starts accepting connections (and answering /health) while this runs
+        readiness["status"] = "warming"
+        threading.Thread(target=warm_up, name="warmup", daemon=True).start()
+    worker = f" Worker {os.getpid()} of {WORKERS}, sharing the {VECTOR_BACKEND} store." if WORKERS > 1 else ""
+    rprint(Panel(f"Application startup complete. API token loaded.{worker}", title="[green]System Status[/green]"))
+
+@app.on_event("shutdown")
+async def on_shutdown():
+    from document_fetcher import get_document_fetcher
+    await get_ingestion_queue().stop()
+    if _query_service is not None:
+        from retriever import stop_index_maintenance
+        stop_index_maintenance()
+    shutdown_process_pool()
+    await get_document_fetcher().aclose()
 
 # --- Middleware ---
 @app.middleware("http")
 async def add_process_time_header(request: Request, call_next):
     start_time = time.time()
+    timings = metrics.start_request_timings()
     response = await call_next(request)
     process_time = time.time() - start_time
     response.headers["X-Process-Time"] = f"{process_time:.4f} sec"
+    if TIMING_HEADER_ENABLED and timings:
+        response.headers["Server-Timing"] = metrics.server_timing_header(timings)
     rprint(f"[cyan]Request[/cyan] '{request.method} {request.url.path}' [bold green]completed in {process_time:.4f}s[/bold green]")
     return response
 
+# --- Error Mapping ---
+def to_http_exception(e: Exception) -> HTTPException:
+    import httpx
+    from azure.core.exceptions import AzureError
+    from document_fetcher import DocumentTooLargeError
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, OverloadedError):
+        # Saturated: 429 when the request was turned away at once, 503 when it ran out of budget waiting
+        code = status.HTTP_503_SERVICE_UNAVAILABLE if isinstance(e, AdmissionTimeoutError) else status.HTTP_429_TOO_MANY_REQUESTS
+        return HTTPException(status_code=code, detail=str(e), headers={"Retry-After": str(e.retry_after_s)})
+    if isinstance(e, IngestionQueueFullError):
+        return HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail=str(e), headers={"Retry-After": "5"})
+    if isinstance(e, DocumentTooLargeError):
+        rprint(Panel(f"[bold red]Document Too Large:[/bold red]\n{e}", title="[red]Error[/red]"))
+        return HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    if isinstance(e, (httpx.HTTPError, AzureError)):
+        rprint(Panel(f"[bold red]Document Download Failed:[/bold red]\n{e}", title="[red]Error[/red]"))
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to download document: {e}")
+    if isinstance(e, ValueError):
+        rprint(Panel(f"[bold red]Processing Error:[/bold red]\n{e}", title="[red]Error[/red]"))
+        return HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
+    tb_str = "".join(traceback.format_exception(e))
+    rprint(Panel(f"[bold red]An unexpected server error occurred:[/bold red]\n{tb_str}", title="[red]Server Error[/red]"))
+    return HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An internal server error occurred.")
+
+def request_budget(request: Request) -> RequestBudget:
+    """The request's latency budget: the X-Request-Budget-Ms header if present, else REQUEST_BUDGET_S."""
+    header = request.headers.get("x-request-budget-ms")
+    if header is None:
+        return RequestBudget()
+    try:
+        return RequestBudget(float(header) / 1000)
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="X-Request-Budget-Ms must be a number")
+
+def encode_event(event: dict, sse: bool) -> str:
+    data = json.dumps(event)
+    return f"event: {event['event']}\ndata: {data}\n\n" if sse else data + "\n"
+
 # --- API Endpoints ---
 @app.post(
     "/api/v1/hackrx/run",
@@ -80,38 +170,155 @@ async def add_process_time_header(request: Request, call_next):
 )
 async def run_submission(
     request_body: QueryRequest,
-    authenticated: bool = Depends(verify_token)
+    authenticated: bool = Depends(verify_token),
+    budget: RequestBudget = Depends(request_budget),
 ):
-    rprint(Panel(f"Processing request for document: [blue]{str(request_body.documents)}[/blue]", title="[cyan]New Request[/cyan]"))
+    document_urls = request_body.document_urls()
+    rprint(Panel(f"Processing request for documents: [blue]{', '.join(document_urls)}[/blue]", title="[cyan]New Request[/cyan]"))
     try:
         questions_as_models = [Question(question=q) for q in request_body.questions]
 
-        document_url = str(request_body.documents)
-        if document_url.startswith("blob://"):
-            blob_name = document_url.replace("blob://", "")
-            local_pdf_path = tempfile.NamedTemporaryFile(delete=False, suffix=".pdf").name
-            download_blob_to_path(blob_name, local_pdf_path)
-            document_url = local_pdf_path
+        # A pre-ingestion job already working on one of the documents finishes instead of being duplicated
+        await asyncio.gather(*[get_ingestion_queue().wait_for(url) for url in document_urls])
 
-        results: List[FinalAnswer] = query_service.process_queries(
-            document_url=document_url,
+        query_service = await aget_query_service()
+        results: List[CitedAnswer] = await query_service.aprocess_queries(
+            document_urls=document_urls,
             questions=questions_as_models,
+            budget=budget,
         )
 
         final_answers = [result.answer for result in results]
-        return QueryResponse(answers=final_answers)
+        sources = [result.sources for result in results]
+        return QueryResponse(answers=final_answers, sources=sources, degradations=budget.degradations)
 
-    except requests.exceptions.RequestException as e:
-        rprint(Panel(f"[bold red]Document Download Failed:[/bold red]\n{e}", title="[red]Error[/red]"))
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Failed to download document: {e}")
-    except ValueError as e:
-        rprint(Panel(f"[bold red]Processing Error:[/bold red]\n{e}", title="[red]Error[/red]"))
-        raise HTTPException(status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(e))
-    except Exception:
-        tb_str = traceback.format_exc()
-        rprint(Panel(f"[bold red]An unexpected server error occurred:[/bold red]\n{tb_str}", title="[red]Server Error[/red]"))
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="An internal server error occurred.")
+    except Exception as e:
+        raise to_http_exception(e)
+
+@app.post(
+    "/api/v1/hackrx/run/stream",
+    tags=["Query Processing"],
+    summary="Process a Document and Stream Answers as They Complete",
+    status_code=status.HTTP_200_OK
+)
+async def run_submission_stream(
+    request_body: QueryRequest,
+    request: Request,
+    authenticated: bool = Depends(verify_token),
+    budget: RequestBudget = Depends(request_budget),
+):
+    """
+    Streams newline-delimited JSON events, or Server-Sent Events when the client accepts
+    `text/event-stream`:
+    - `{"event": "stage", "stage": "downloaded" | "indexed" | "retrieved"}`
+    - `{"event": "answer", "index": i, "answer": "...", "sources": [...]}` as each answer completes
+    - `{"event": "done", "degradations": [...]}`, or `{"event": "error", "status": ..., "detail": ...}` if processing fails midway
+    """
+    document_urls = request_body.document_urls()
+    rprint(Panel(f"Streaming request for documents: [blue]{', '.join(document_urls)}[/blue]", title="[cyan]New Request[/cyan]"))
+    questions_as_models = [Question(question=q) for q in request_body.questions]
+    await asyncio.gather(*[get_ingestion_queue().wait_for(url) for url in document_urls])
+    query_service = await aget_query_service()
+    events = query_service.astream_queries(document_urls, questions_as_models, budget)
+
+    # Wait for the first event so download errors still get a proper status code
+    try:
+        first_event = await anext(events)
+    except Exception as e:
+        raise to_http_exception(e)
+
+    sse = "text/event-stream" in request.headers.get("accept", "")
+
+    async def body():
+        try:
+            yield encode_event(first_event, sse)
+            async for event in events:
+                yield encode_event(event, sse)
+            yield encode_event({"event": "done", "degradations": budget.degradations}, sse)
+        except Exception as e:
+            error = to_http_exception(e)
+            yield encode_event({"event": "error", "status": error.status_code, "detail": error.detail}, sse)
+        finally:
+            await events.aclose()
+
+    return StreamingResponse(
+        body(),
+        media_type="text/event-stream" if sse else "application/x-ndjson",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+def job_response(job: IngestionJob) -> IngestionJobResponse:
+    return IngestionJobResponse(
+        job_id=job.job_id,
+        document=job.document_url,
+        status=job.status,
+        stage=job.stage,
+        content_hash=job.content_hash,
+        error=job.error,
+        stages=job.stages,
+    )
+
+@app.post(
+    "/api/v1/documents",
+    response_model=IngestionJobResponse,
+    tags=["Ingestion"],
+    summary="Queue a Document for Background Ingestion",
+    status_code=status.HTTP_202_ACCEPTED
+)
+async def submit_document(
+    request_body: DocumentIngestRequest,
+    authenticated: bool = Depends(verify_token)
+):
+    try:
+        job = await get_ingestion_queue().submit(str(request_body.documents))
+    except Exception as e:
+        raise to_http_exception(e)
+    rprint(f"[cyan]Queued ingestion job[/cyan] {job.job_id} for [blue]{job.document_url}[/blue]")
+    return job_response(job)
+
+@app.get(
+    "/api/v1/documents/{job_id}",
+    response_model=IngestionJobResponse,
+    tags=["Ingestion"],
+    summary="Get the Status of an Ingestion Job"
+)
+async def get_document_job(
+    job_id: str,
+    authenticated: bool = Depends(verify_token)
+):
+    job = await get_ingestion_queue().get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Unknown ingestion job")
+    return job_response(job)
+
+@app.get("/metrics", tags=["Monitoring"], summary="Prometheus Metrics")
+def get_metrics():
+    content, content_type = metrics.render()
+    return Response(content=content, media_type=content_type)
 
 @app.get("/health", tags=["Monitoring"], summary="API Health Check")
 def health_check():
     return {"status": "ok"}
+
+@app.get("/ready", tags=["Monitoring"], summary="API Readiness Check")
+async def readiness_check():
+    """
+    200 once configuration is complete and the query service is built, 503 until then.
+    Without the startup warmup, the first probe builds the service.
+    """
+    missing = missing_settings()
+    if not missing and readiness["status"] == "starting":
+        try:
+            await aget_query_service()
+        except Exception as e:
+            readiness.update(status="error", error=str(e))
+    ready = not missing and readiness["status"] == "ready"
+    return JSONResponse(
+        status_code=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={
+            "status": "ready" if ready else readiness["status"],
+            "missing_settings": missing,
+            "error": readiness["error"],
+            "warmup_s": readiness["warmup_s"],
+        },
+    )
@@ -0,0 +1,118 @@
+import time
+import contextvars
+from contextlib import contextmanager, nullcontext
+from typing import Dict, Iterator, Optional, Tuple
+from config import METRICS_ENABLED
+
+# Per-request stage timings (seconds), shared by every task the request spawns
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar("request_timings", default=None)
+
+_NULL_STAGE = nullcontext()
+
+class _Metrics:
+    def __init__(self):
+        from prometheus_client import Counter, Histogram, CollectorRegistry
+        self.registry = CollectorRegistry()
+        latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+        self.stage_seconds = Histogram(
+            "rag_stage_seconds", "Time spent in each request stage", ["stage"],
+            buckets=latency_buckets, registry=self.registry,
+        )
+        self.cache_events = Counter(
+            "rag_cache_events_total", "Cache lookups by cache and result", ["cache", "result"], registry=self.registry,
+        )
+        self.chunks = Counter("rag_chunks_total", "Chunks written or sent to the answer model", ["kind"], registry=self.registry)
+        self.tokens = Counter("rag_tokens_total", "Estimated or counted tokens by kind", ["kind"], registry=self.registry)
+        self.llm_calls = Counter("rag_llm_calls_total", "Model calls by model and outcome", ["model", "outcome"], registry=self.registry)
+        self.degradations = Counter("rag_degradations_total", "Shortcuts taken to meet request budgets", ["kind"], registry=self.registry)
+        self.admissions = Counter(
+            "rag_admissions_total", "Admission decisions by stage and outcome", ["stage", "outcome"], registry=self.registry,
+        )
+        self.llm_seconds = Histogram(
+            "rag_llm_call_seconds", "Latency of individual model calls", ["model"],
+            buckets=latency_buckets, registry=self.registry,
+        )
+
+def _create_metrics() -> Optional[_Metrics]:
+    if not METRICS_ENABLED:
+        return None
+    try:
+        return _Metrics()
+    except ImportError:
+        print("prometheus_client is not installed; metrics are disabled")
+        return None
+
+_metrics = _create_metrics()
+
+def enabled() -> bool:
+    return _metrics is not None
+
+@contextmanager
+def _timed_stage(name: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        _metrics.stage_seconds.labels(name).observe(elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            # Concurrent occurrences of a stage (e.g. one per question) add up
+            timings[name] = timings.get(name, 0.0) + elapsed
+
+def stage(name: str):
+    """Context manager timing one stage of the current request. A shared no-op when metrics are off."""
+    return _timed_stage(name) if _metrics is not None else _NULL_STAGE
+
+def record_cache(cache: str, hits: int = 0, misses: int = 0):
+    if _metrics is not None:
+        if hits:
+            _metrics.cache_events.labels(cache, "hit").inc(hits)
+        if misses:
+            _metrics.cache_events.labels(cache, "miss").inc(misses)
+
+def record_chunks(kind: str, count: int):
+    if _metrics is not None and count:
+        _metrics.chunks.labels(kind).inc(count)
+
+def record_tokens(kind: str, count: int):
+    if _metrics is not None and count:
+        _metrics.tokens.labels(kind).inc(count)
+
+def record_llm_call(model: str, seconds: float, outcome: str):
+    if _metrics is not None:
+        _metrics.llm_calls.labels(model, outcome).inc()
+        _metrics.llm_seconds.labels(model).observe(seconds)
+
+def record_degradation(kind: str):
+    if _metrics is not None:
+        _metrics.degradations.labels(kind).inc()
+
+def record_admission(stage: str, outcome: str):
+    if _metrics is not None:
+        _metrics.admissions.labels(stage, outcome).inc()
+
+def start_request_timings() -> Optional[Dict[str, float]]:
+    """Begin collecting a stage breakdown for the request running in this context."""
+    if _metrics is None:
+        return None
+    timings: Dict[str, float] = {}
+    _request_timings.set(timings)
+    return timings
+
+def server_timing_header(timings: Dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in timings.items())
+
+def timed(name: str, func):
+    """Wrap an async graph node so its runtime is recorded as a stage."""
+    async def wrapper(*args, **kwargs):
+        with stage(name):
+            return await func(*args, **kwargs)
+    return wrapper
+
+def render() -> Tuple[bytes, str]:
+    """Prometheus text exposition of every metric."""
+    if _metrics is None:
+        return b"", "text/plain; version=0.0.4; charset=utf-8"
+    from prometheus_client import generate_latest, CONTENT_TYPE_LATEST
+    return generate_latest(_metrics.registry), CONTENT_TYPE_LATEST
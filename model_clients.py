@@ -0,0 +1,44 @@
+import threading
+from typing import Optional
+from langchain_core.embeddings import Embeddings
+from llm_scheduler import ScheduledChatModel, ScheduledEmbeddings, schedule_chat_model, schedule_embeddings
+from config import (
+    GOOGLE_API_KEY,
+    EMBEDDING_MODEL,
+    MODEL_PROVIDER,
+    FAKE_MODEL_LATENCY_MS,
+    FAKE_MODEL_MAX_CONCURRENCY,
+    FAKE_MODEL_RPM,
+)
+
+_lock = threading.Lock()
+_fake_rate_limit = None
+
+def _get_fake_rate_limit():
+    # One simulated quota for every fake client, like a shared API key
+    global _fake_rate_limit
+    from fakes import FakeRateLimit
+    with _lock:
+        if _fake_rate_limit is None and (FAKE_MODEL_MAX_CONCURRENCY or FAKE_MODEL_RPM):
+            _fake_rate_limit = FakeRateLimit(FAKE_MODEL_MAX_CONCURRENCY or None, FAKE_MODEL_RPM or None)
+        return _fake_rate_limit
+
+def create_chat_model(model_name: str, provider: Optional[str] = None) -> ScheduledChatModel:
+    """Chat model for `model_name` behind the process-wide scheduler. MODEL_PROVIDER=fake runs offline."""
+    if (provider or MODEL_PROVIDER) == "fake":
+        from fakes import FakeChatModel
+        model = FakeChatModel(latency_s=FAKE_MODEL_LATENCY_MS / 1000.0, rate_limit=_get_fake_rate_limit())
+    else:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        # Rate-limit retries are the scheduler's job; client-side retries would bypass its backoff
+        model = ChatGoogleGenerativeAI(model=model_name, api_key=GOOGLE_API_KEY, temperature=0, max_retries=0)
+    return schedule_chat_model(model, model_name)
+
+def create_embeddings(model_name: str = EMBEDDING_MODEL, provider: Optional[str] = None) -> ScheduledEmbeddings:
+    if (provider or MODEL_PROVIDER) == "fake":
+        from fakes import FakeEmbeddings
+        embeddings: Embeddings = FakeEmbeddings(latency_s=FAKE_MODEL_LATENCY_MS / 1000.0, rate_limit=_get_fake_rate_limit())
+    else:
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        embeddings = GoogleGenerativeAIEmbeddings(model=model_name)
+    return schedule_embeddings(embeddings, model_name)
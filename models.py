@@ -1,5 +1,6 @@
-from pydantic import BaseModel, HttpUrl, Field
-from typing import List
+from pydantic import BaseModel, HttpUrl, Field, field_validator
+from typing import Dict, List, Optional, Union
+from config import MAX_DOCUMENTS_PER_REQUEST
 
 class Question(BaseModel):
     question: str
@@ -7,6 +8,13 @@ class Question(BaseModel):
 class FinalAnswer(BaseModel):
     answer: str
 
+class CitedAnswer(FinalAnswer):
+    # Documents the answer's context was drawn from, most relevant first
+    sources: List[str] = Field(default_factory=list)
+
+class GroupedAnswers(BaseModel):
+    answers: List[FinalAnswer] = Field(description="One answer per question, in the same order as the questions.")
+
 class GeneratedQueriesForEachQuestion(BaseModel):
     queries: List[str] = Field(description="A list of 3 distinct, self-contained search queries based on the original question.")
 
@@ -15,7 +23,36 @@ class GeneratedQueries(BaseModel):
 
 class QueryResponse(BaseModel):
     answers: List[str]
+    # Per answer, the URLs of the documents it was drawn from
+    sources: List[List[str]] = Field(default_factory=list)
+    # Shortcuts taken to answer within the request's latency budget, e.g. "skipped_decomposition"
+    degradations: List[str] = Field(default_factory=list)
 
 class QueryRequest(BaseModel):
+    # One URL, or a list of URLs answered together
+    documents: Union[HttpUrl, List[HttpUrl]]
+    questions: List[str]
+
+    @field_validator("documents")
+    @classmethod
+    def _check_documents(cls, documents):
+        if isinstance(documents, list) and not 1 <= len(documents) <= MAX_DOCUMENTS_PER_REQUEST:
+            raise ValueError(f"Expected between 1 and {MAX_DOCUMENTS_PER_REQUEST} documents")
+        return documents
+
+    def document_urls(self) -> List[str]:
+        """The requested URLs in order, without duplicates."""
+        documents = self.documents if isinstance(self.documents, list) else [self.documents]
+        return list(dict.fromkeys(str(url) for url in documents))
+
+class DocumentIngestRequest(BaseModel):
     documents: HttpUrl
-    questions: List[str]
\ No newline at end of file
+
+class IngestionJobResponse(BaseModel):
+    job_id: str
+    document: str
+    status: str
+    stage: str
+    content_hash: Optional[str] = None
+    error: Optional[str] = None
+    stages: Dict[str, float]
\ No newline at end of file
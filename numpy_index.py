@@ -0,0 +1,145 @@
+import os
+import json
+import shutil
+import asyncio
+import threading
+from typing import Any, List, Optional, Sequence, Tuple
+import numpy as np
+from pydantic import ConfigDict
+from langchain_core.callbacks import AsyncCallbackManagerForRetrieverRun, CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.runnables import RunnableConfig
+
+EMBEDDINGS_FILE = "embeddings.npy"
+CHUNKS_FILE = "chunks.jsonl"
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+class NumpyVectorIndex:
+    """
+    Brute-force cosine index over one document's chunks.
+
+    Embeddings are held as a contiguous (n, d) float32 matrix of unit rows, optionally
+    memory-mapped from disk; scoring a batch of m queries is a single (m, d) x (d, n)
+    product followed by a vectorized top-k.
+    """
+
+    def __init__(self, matrix: np.ndarray, documents: List[Document]):
+        self.matrix = matrix
+        self.documents = documents
+
+    @classmethod
+    def load(cls, directory: str, mmap: bool = True) -> "NumpyVectorIndex":
+        matrix = np.load(os.path.join(directory, EMBEDDINGS_FILE), mmap_mode="r" if mmap else None)
+        documents = []
+        with open(os.path.join(directory, CHUNKS_FILE), encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                documents.append(Document(id=record["id"], page_content=record["page_content"], metadata=record["metadata"]))
+        return cls(matrix, documents)
+
+    def search_by_vectors(self, vectors: Sequence[Sequence[float]], k: int) -> List[List[Tuple[Document, float]]]:
+        """Top-k (document, cosine score) pairs for each query vector, best first."""
+        if not len(vectors):
+            return []
+        n = self.matrix.shape[0]
+        if n == 0:
+            return [[] for _ in vectors]
+        queries = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        scores = queries @ self.matrix.T
+        k = min(k, n)
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        top_scores = np.take_along_axis(top_scores, order, axis=1)
+        return [
+            [(self._copy(self.documents[j]), float(score)) for j, score in zip(row, row_scores)]
+            for row, row_scores in zip(top, top_scores)
+        ]
+
+    def _copy(self, doc: Document) -> Document:
+        # Callers annotate metadata, so never hand out the indexed instance
+        return Document(id=doc.id, page_content=doc.page_content, metadata=dict(doc.metadata))
+
+class NumpyIndexWriter:
+    """
+    Builds a NumpyVectorIndex for one document batch by batch.
+
+    Chunks are appended to a private temp directory and the finished index is moved into
+    place with a single rename on `commit`, so readers never observe a partial index.
+    """
+
+    def __init__(self, root: str, content_hash: str, embeddings: Embeddings):
+        self.embeddings = embeddings
+        self.final_dir = os.path.join(root, content_hash)
+        self.tmp_dir = f"{self.final_dir}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        self._chunks = open(os.path.join(self.tmp_dir, CHUNKS_FILE), "w", encoding="utf-8")
+        self._blocks: List[np.ndarray] = []
+        self._lock = threading.Lock()
+
+    def _append(self, docs: List[Document], vectors: List[List[float]]):
+        block = _normalize_rows(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            # Rows and chunk lines are appended together so they stay aligned whatever order batches finish in
+            self._blocks.append(block)
+            for doc in docs:
+                self._chunks.write(json.dumps({"id": doc.id, "page_content": doc.page_content, "metadata": doc.metadata}) + "\n")
+
+    def add(self, docs: List[Document]):
+        self._append(docs, self.embeddings.embed_documents([doc.page_content for doc in docs]))
+
+    async def aadd(self, docs: List[Document]):
+        vectors = await self.embeddings.aembed_documents([doc.page_content for doc in docs])
+        await asyncio.to_thread(self._append, docs, vectors)
+
+    def commit(self):
+        self._chunks.close()
+        matrix = np.vstack(self._blocks) if self._blocks else np.zeros((0, 0), dtype=np.float32)
+        np.save(os.path.join(self.tmp_dir, EMBEDDINGS_FILE), matrix)
+        if os.path.exists(self.final_dir):
+            # Another writer finished the same document first; its index is equivalent
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+        else:
+            os.replace(self.tmp_dir, self.final_dir)
+
+    def abort(self):
+        self._chunks.close()
+        shutil.rmtree(self.tmp_dir, ignore_errors=True)
+
+class NumpyRetriever(BaseRetriever):
+    """
+    Retriever over a NumpyVectorIndex, usable wherever a VectorStoreRetriever is.
+
+    `batch`/`abatch` embed all queries and score them against the index in one matrix
+    multiply instead of running one search per query.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    index: Any
+    embeddings: Embeddings
+    k: int = 3
+
+    def search_by_vectors(self, vectors: Sequence[Sequence[float]]) -> List[List[Document]]:
+        results = self.index.search_by_vectors(vectors, self.k)
+        return [[doc for doc, _ in hits] for hits in results]
+
+    def _get_relevant_documents(self, query: str, *, run_manager: CallbackManagerForRetrieverRun) -> List[Document]:
+        return self.search_by_vectors([self.embeddings.embed_query(query)])[0]
+
+    async def _aget_relevant_documents(self, query: str, *, run_manager: AsyncCallbackManagerForRetrieverRun) -> List[Document]:
+        return self.search_by_vectors([await self.embeddings.aembed_query(query)])[0]
+
+    def batch(self, inputs: List[str], config: Optional[RunnableConfig | List[RunnableConfig]] = None, **kwargs: Any) -> List[List[Document]]:
+        return self.search_by_vectors([self.embeddings.embed_query(query) for query in inputs])
+
+    async def abatch(self, inputs: List[str], config: Optional[RunnableConfig | List[RunnableConfig]] = None, **kwargs: Any) -> List[List[Document]]:
+        vectors = await asyncio.gather(*[self.embeddings.aembed_query(query) for query in inputs])
+        return self.search_by_vectors(vectors)
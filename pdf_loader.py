@@ -1,8 +1,12 @@
 import os
 import re
+import asyncio
+from collections import deque
 import fitz
 from langchain_core.documents import Document
-from typing import List
+from typing import AsyncIterator, Iterator, List, Optional, Tuple
+from config import PARSE_PAGES_PER_TASK, PARSE_MAX_INFLIGHT_TASKS
+from worker_pool import get_process_pool, run_in_process
 
 class PDFLoader:
     def __init__(self, file_path: str):
@@ -11,39 +15,109 @@ class PDFLoader:
     def _is_table_line(self, line_text: str) -> bool:
         return bool(re.search(r"(\s{2,}|\t)", line_text)) and len(line_text.strip()) > 10
 
+    def _page_document(self, page, page_number: int) -> Optional[Document]:
+        page_dict = page.get_text("dict")
+        blocks = page_dict.get("blocks", [])
+        text_lines, table_lines = [], []
+        for block in blocks:
+            if block["type"] == 0:
+                for line in block.get("lines", []):
+                    line_text = " ".join([span["text"] for span in line.get("spans", [])]).strip()
+                    if self._is_table_line(line_text):
+                        table_lines.append(line_text)
+                    else:
+                        text_lines.append(line_text)
+
+        full_text = "\n".join(text_lines).strip()
+        table_text = "\n".join(table_lines).strip()
+
+        combined_text = ""
+        if full_text:
+            combined_text += "### Text Content ###\n" + full_text + "\n"
+        if table_text:
+            combined_text += "\n### Table Content ###\n" + table_text + "\n"
+
+        if not combined_text:
+            return None
+        return Document(
+            page_content=combined_text.strip(),
+            metadata={
+                "page": page_number + 1,
+                "source_file": os.path.basename(self.file_path),
+            }
+        )
+
+    def _iter_pages(self, start: int, end: int) -> Iterator[Document]:
+        with fitz.open(self.file_path) as doc:
+            for page_number in range(start, min(end, doc.page_count)):
+                page_document = self._page_document(doc[page_number], page_number)
+                if page_document is not None:
+                    yield page_document
+
+    def load_pages(self, start: int, end: int) -> list[Document]:
+        """Load pages [start, end) (0-based). Pages without text are skipped."""
+        return list(self._iter_pages(start, end))
+
+    def lazy_load(self) -> Iterator[Document]:
+        """Yield page Documents one at a time, e.g. to feed the ingestion pipeline."""
+        yield from self._iter_pages(0, self.page_count())
+
     def load(self) -> list[Document]:
-        documents = []
+        return list(self.lazy_load())
+
+    def page_count(self) -> int:
         with fitz.open(self.file_path) as doc:
-            for page_number, page in enumerate(doc):
-                page_dict = page.get_text("dict")
-                blocks = page_dict.get("blocks", [])
-                text_lines, table_lines = [], []
-                for block in blocks:
-                    if block["type"] == 0:
-                        for line in block.get("lines", []):
-                            line_text = " ".join([span["text"] for span in line.get("spans", [])]).strip()
-                            if self._is_table_line(line_text):
-                                table_lines.append(line_text)
-                            else:
-                                text_lines.append(line_text)
-                
-                full_text = "\n".join(text_lines).strip()
-                table_text = "\n".join(table_lines).strip()
-                
-                combined_text = ""
-                if full_text:
-                    combined_text += "### Text Content ###\n" + full_text + "\n"
-                if table_text:
-                    combined_text += "\n### Table Content ###\n" + table_text + "\n"
-                
-                if combined_text:
-                    documents.append(
-                        Document(
-                            page_content=combined_text.strip(),
-                            metadata={
-                                "page": page_number + 1,
-                                "source_file": os.path.basename(self.file_path),
-                            }
-                        )
-                    )
-        return documents
\ No newline at end of file
+            return doc.page_count
+
+def _load_page_range(file_path: str, start: int, end: int) -> List[Document]:
+    # Runs in a pool worker: each worker opens the file with fitz itself
+    return PDFLoader(file_path).load_pages(start, end)
+
+class ParallelPDFLoader(PDFLoader):
+    """
+    PDFLoader that splits the page range into shards and parses them across the shared
+    process pool. Page Documents come back in page order. The lazy variants keep at most
+    `max_inflight` shards submitted ahead of the consumer, so a slow consumer throttles parsing.
+    """
+
+    def __init__(self, file_path: str, pages_per_task: int = PARSE_PAGES_PER_TASK, max_inflight: int = PARSE_MAX_INFLIGHT_TASKS):
+        super().__init__(file_path)
+        self.pages_per_task = max(1, pages_per_task)
+        self.max_inflight = max(1, max_inflight)
+
+    def _page_ranges(self, page_count: int) -> List[Tuple[int, int]]:
+        return [
+            (start, min(start + self.pages_per_task, page_count))
+            for start in range(0, page_count, self.pages_per_task)
+        ]
+
+    def lazy_load(self) -> Iterator[Document]:
+        ranges = deque(self._page_ranges(self.page_count()))
+        pending: deque = deque()
+        try:
+            while ranges or pending:
+                while ranges and len(pending) < self.max_inflight:
+                    start, end = ranges.popleft()
+                    pending.append(get_process_pool().submit(_load_page_range, self.file_path, start, end))
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+
+    async def alazy_load(self) -> AsyncIterator[Document]:
+        page_count = await asyncio.to_thread(self.page_count)
+        ranges = deque(self._page_ranges(page_count))
+        pending: deque = deque()
+        try:
+            while ranges or pending:
+                while ranges and len(pending) < self.max_inflight:
+                    start, end = ranges.popleft()
+                    pending.append(asyncio.ensure_future(run_in_process(_load_page_range, self.file_path, start, end)))
+                for doc in await pending.popleft():
+                    yield doc
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def aload(self) -> list[Document]:
+        return [doc async for doc in self.alazy_load()]
@@ -0,0 +1,116 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from langchain_core.language_models import BaseChatModel
+from langchain_core.prompts import ChatPromptTemplate
+from models import GeneratedQueries, GeneratedQueriesForEachQuestion
+from embedding_cache import normalize_text
+import metrics
+from config import DECOMPOSITION_SHARD_SIZE, DECOMPOSITION_CACHE_SIZE, DECOMPOSITION_QUERIES_PER_QUESTION
+
+DECOMPOSITION_PROMPT = ChatPromptTemplate.from_template(
+    """You are an expert research assistant.
+
+    Given a list of N user questions, generate for each question exactly {per_question} diverse, relevant search queries
+    useful for retrieving related information from documents.
+
+    Return a valid Pydantic object of type `GeneratedQueries`, which has a field `lst`, a list of length N.
+    Each element of `lst` must be a `GeneratedQueriesForEachQuestion`, containing a `queries` list of length {per_question}.
+
+    N = {count}
+
+    QUESTIONS:
+    {questions}
+    """
+)
+
+class QueryDecomposer:
+    """
+    Expands questions into search queries with concurrent, fixed-size LLM calls.
+
+    Questions are split into shards of `shard_size` that are decomposed in parallel, so
+    latency tracks the largest shard rather than the whole batch. Each question's result is
+    validated on its own: a shard that fails or returns the wrong number of entries, or an
+    entry without usable queries, only falls back to "no decomposition" for the questions
+    concerned. Successful decompositions are kept in an LRU keyed by question text.
+    """
+
+    def __init__(
+        self,
+        llm: BaseChatModel,
+        shard_size: int = DECOMPOSITION_SHARD_SIZE,
+        max_size: int = DECOMPOSITION_CACHE_SIZE,
+        per_question: int = DECOMPOSITION_QUERIES_PER_QUESTION,
+    ):
+        self.llm = llm
+        self.shard_size = max(1, shard_size)
+        self.max_size = max_size
+        self.per_question = per_question
+        self._cache: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[str]]:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    found[key] = self._cache[key]
+        return found
+
+    def _remember(self, decompositions: Dict[str, List[str]]):
+        with self._lock:
+            for key, queries in decompositions.items():
+                self._cache[key] = queries
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def _validate(self, entry: Optional[GeneratedQueriesForEachQuestion]) -> Optional[List[str]]:
+        if entry is None:
+            return None
+        queries = [q.strip() for q in entry.queries if isinstance(q, str) and q.strip()]
+        queries = list(dict.fromkeys(queries))[:self.per_question]
+        return queries or None
+
+    async def _adecompose_shard(self, questions: List[str]) -> List[Optional[List[str]]]:
+        chain = DECOMPOSITION_PROMPT | self.llm.with_structured_output(GeneratedQueries)
+        try:
+            generated: GeneratedQueries = await chain.ainvoke({  # type: ignore
+                "per_question": self.per_question,
+                "count": len(questions),
+                "questions": "\n".join(f"{i+1}. {q}" for i, q in enumerate(questions)),
+            })
+        except Exception as e:
+            print(f"Query decomposition failed for a shard of {len(questions)} questions: {e}")
+            return [None] * len(questions)
+        if not generated or len(generated.lst) != len(questions):
+            # Entries cannot be matched to questions reliably, so none of them are used
+            print(f"Query decomposition returned {len(generated.lst) if generated else 0} entries for {len(questions)} questions")
+            return [None] * len(questions)
+        return [self._validate(entry) for entry in generated.lst]
+
+    async def adecompose(self, questions: List[str]) -> List[List[str]]:
+        """
+        Returns the retrieval queries for each question: its generated queries followed by
+        the original question. Lists may differ in length between questions.
+        """
+        keys = [normalize_text(q) for q in questions]
+        decompositions = self._lookup(list(dict.fromkeys(keys)))
+        missing = list(dict.fromkeys(key for key in keys if key not in decompositions))
+        metrics.record_cache("decomposition", hits=len(decompositions), misses=len(missing))
+        shards = [missing[i:i + self.shard_size] for i in range(0, len(missing), self.shard_size)]
+        results = await asyncio.gather(*[self._adecompose_shard(shard) for shard in shards])
+        fresh = {
+            key: queries
+            for shard, shard_results in zip(shards, results)
+            for key, queries in zip(shard, shard_results)
+            if queries is not None
+        }
+        self._remember(fresh)
+        decompositions.update(fresh)
+        return [
+            decompositions.get(key, []) + [question]
+            for key, question in zip(keys, questions)
+        ]
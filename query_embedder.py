@@ -0,0 +1,60 @@
+import asyncio
+import threading
+from collections import OrderedDict
+from typing import List
+from langchain_core.embeddings import Embeddings
+from langchain_google_genai import GoogleGenerativeAIEmbeddings
+from embedding_cache import normalize_text
+from config import QUERY_EMBEDDING_CACHE_SIZE
+import metrics
+
+class QueryEmbedder:
+    """
+    Embeds the retrieval queries of a request in one batched call.
+
+    Identical query strings are embedded once, and vectors are kept in an in-process LRU
+    cache of `max_size` entries so question sets that are resent against other documents
+    skip the remote call entirely.
+    """
+
+    def __init__(self, embeddings: Embeddings, max_size: int = QUERY_EMBEDDING_CACHE_SIZE):
+        self.embeddings = embeddings
+        self.max_size = max_size
+        self._cache: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, keys: List[str]) -> dict:
+        found = {}
+        with self._lock:
+            for key in keys:
+                if key in self._cache:
+                    self._cache.move_to_end(key)
+                    found[key] = self._cache[key]
+        return found
+
+    def _remember(self, keys: List[str], vectors: List[List[float]]):
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._cache[key] = vector
+                self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    async def _aembed_batch(self, texts: List[str]) -> List[List[float]]:
+        # The chunk cache only wraps document embeddings; queries go to the underlying (scheduled) model
+        base = getattr(self.embeddings, "base", self.embeddings)
+        if isinstance(getattr(base, "wrapped", base), GoogleGenerativeAIEmbeddings):
+            return await base.aembed_documents(texts, task_type="RETRIEVAL_QUERY")
+        return list(await asyncio.gather(*[base.aembed_query(text) for text in texts]))
+
+    async def aembed(self, queries: List[str]) -> List[List[float]]:
+        keys = [normalize_text(query) for query in queries]
+        unique = list(dict.fromkeys(keys))
+        vectors = self._lookup(unique)
+        missing = [key for key in unique if key not in vectors]
+        metrics.record_cache("query_embedding", hits=len(vectors), misses=len(missing))
+        if missing:
+            fresh = await self._aembed_batch(missing)
+            self._remember(missing, fresh)
+            vectors.update(zip(missing, fresh))
+        return [vectors[key] for key in keys]
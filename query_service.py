@@ -1,32 +1,166 @@
-from typing import List
-from models import Question,FinalAnswer
+import asyncio
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+from models import Question, CitedAnswer
 from document_manager import DocumentManager
 from retriever import VectorStoreProvider
-from workflow import RAGWorkflow
+from workflow import RAGWorkflow, EventCallback, ANSWER_PROMPT_VERSION
+from answer_cache import AnswerCache, scope_key
+from admission import RequestBudget, get_admission
+import metrics
+from config import ANSWER_LLM_MODEL, ANSWER_CACHE_ENABLED, ANSWER_CACHE_SEMANTIC_THRESHOLD
 
 class QueryService:
     """
     A service class to orchestrate the RAG process:
-    - Downloads documents
+    - Downloads the requested documents concurrently
     - Manages a cache of processed vector stores
+    - Serves repeated (document, question) pairs from the answer cache
     - Generates responses based on retrieved information and questions.
     """
     def __init__(self):
         self.llm = RAGWorkflow()
+        self.answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
 
-    def process_queries(
+    async def _cached_answers(
         self,
-        document_url: str,
+        scope: str,
         questions: List[Question]
-    ) -> List[FinalAnswer]:
+    ) -> Tuple[Dict[int, Tuple[str, List[str]]], Dict[int, List[float]]]:
+        """
+        Looks up answers for the questions, exactly and then (if enabled) semantically.
+        Returns the hits (answer, cited content hashes) by question index and any question
+        embeddings computed on the way.
+        """
+        texts = [q.question for q in questions]
+        hits = await asyncio.to_thread(
+            self.answer_cache.get_many, scope, texts, ANSWER_LLM_MODEL, ANSWER_PROMPT_VERSION
+        )
+        vectors: Dict[int, List[float]] = {}
+        misses = [i for i in range(len(texts)) if i not in hits]
+        if ANSWER_CACHE_SEMANTIC_THRESHOLD > 0 and misses:
+            # Embeddings come from the query-embedding LRU, which retrieval reuses for the original questions
+            embedded = await self.llm.query_embedder.aembed([texts[i] for i in misses])
+            vectors = dict(zip(misses, embedded))
+            hits.update(await asyncio.to_thread(
+                self.answer_cache.get_similar, scope, vectors,
+                ANSWER_LLM_MODEL, ANSWER_PROMPT_VERSION, ANSWER_CACHE_SEMANTIC_THRESHOLD,
+            ))
+        return hits, vectors
+
+    async def aprocess_queries(
+        self,
+        document_urls: Union[str, List[str]],
+        questions: List[Question],
+        on_event: Optional[EventCallback] = None,
+        budget: Optional[RequestBudget] = None,
+    ) -> List[CitedAnswer]:
         """
-        Processes a list of questions against a document URL.
+        Processes a list of questions against one document URL or several without blocking the event loop.
+        The documents are fetched and ingested concurrently and searched together; each answer cites the
+        URLs of the documents it was drawn from.
+        If given, `on_event` receives stage events and each answer (with its question index) as it completes.
+        Ingestion and generation are admitted within `budget`, which also records any degradations
+        the workflow applies to stay inside it.
         """
-        print("Processing new document and building vector store...")
-        document_manager = DocumentManager(document_url)
-        retriever = VectorStoreProvider(document_manager).retriever
-        print("retriever created....\ncalling llm")
+        budget = budget or RequestBudget()
+        urls = [document_urls] if isinstance(document_urls, str) else list(dict.fromkeys(document_urls))
+        async def emit(event: dict):
+            if on_event:
+                await on_event(event)
+
+        print(f"Processing {len(urls)} document(s) and building vector stores...")
+        managers = await asyncio.gather(*[DocumentManager.acreate(url) for url in urls])
+        # The same bytes behind two URLs are indexed and cited once, under the first of them
+        url_by_hash: Dict[str, str] = {}
+        for url, manager in zip(urls, managers):
+            url_by_hash.setdefault(manager.get_content_hash(), url)
+        managers = [manager for manager in managers if url_by_hash[manager.get_content_hash()] == manager.document_url]
+        scope = scope_key(list(url_by_hash))
+        await emit({"event": "stage", "stage": "downloaded"})
+
+        def cite(answer: str, content_hashes: List[str]) -> CitedAnswer:
+            return CitedAnswer(answer=answer, sources=[url_by_hash[h] for h in content_hashes if h in url_by_hash])
+
+        answers: Dict[int, CitedAnswer] = {}
+        vectors: Dict[int, List[float]] = {}
+        if self.answer_cache is not None:
+            hits, vectors = await self._cached_answers(scope, questions)
+            for i, (answer, content_hashes) in sorted(hits.items()):
+                # Entries cached before answers cited their sources drew on the single document
+                answers[i] = cite(answer, content_hashes or list(url_by_hash))
+                await emit({"event": "answer", "index": i, "answer": answer, "sources": answers[i].sources, "cached": True})
+        pending = [i for i in range(len(questions)) if i not in answers]
+        if self.answer_cache is not None:
+            metrics.record_cache("answer", hits=len(answers), misses=len(pending))
+        if not pending:
+            print("All answers served from cache")
+            return [answers[i] for i in range(len(questions))]
+
+        with metrics.stage("index"):
+            providers = await asyncio.gather(*[VectorStoreProvider.acreate(manager, budget) for manager in managers])
+        retrievers = [provider.retriever for provider in providers]
+        await emit({"event": "stage", "stage": "indexed"})
+        print("retrievers created....\ncalling llm")
+
+        async def forward(event: dict):
+            # The workflow only sees the pending questions and content hashes; report indices into
+            # the full request and the URLs the client asked for
+            if "index" in event:
+                event = {**event, "index": pending[event["index"]]}
+            if "sources" in event:
+                event = {**event, "sources": [url_by_hash[h] for h in event["sources"] if h in url_by_hash]}
+            await emit(event)
+
+        async with get_admission("generation").admit(budget):
+            results = await self.llm.ainvoke(
+                [questions[i] for i in pending], retrievers, on_event=forward if on_event else None, budget=budget,
+            )
+        answers.update((i, cite(result.answer, result.sources) if result else None) for i, result in zip(pending, results))
 
-        results = self.llm.invoke(questions,retriever)
+        # Answers produced with less work than usual are not worth serving to later requests
+        if self.answer_cache is not None and not budget.degradations:
+            fresh = [(i, result) for i, result in zip(pending, results) if result is not None]
+            await asyncio.to_thread(
+                self.answer_cache.put_many,
+                scope,
+                [questions[i].question for i, _ in fresh],
+                [result.answer for _, result in fresh],
+                ANSWER_LLM_MODEL,
+                ANSWER_PROMPT_VERSION,
+                [vectors.get(i) for i, _ in fresh],
+                [result.sources for _, result in fresh],
+            )
 
-        return results
+        return [answers[i] for i in range(len(questions))]
+
+    async def astream_queries(
+        self,
+        document_urls: Union[str, List[str]],
+        questions: List[Question],
+        budget: Optional[RequestBudget] = None,
+    ) -> AsyncIterator[dict]:
+        """
+        Runs `aprocess_queries` and yields its events as they happen.
+        Errors are raised from the iterator after the events that preceded them.
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        done = object()
+        task = asyncio.ensure_future(self.aprocess_queries(document_urls, questions, on_event=queue.put, budget=budget))
+        task.add_done_callback(lambda _: queue.put_nowait(done))
+        try:
+            while (event := await queue.get()) is not done:
+                yield event
+            task.result()
+        finally:
+            # The client may stop reading early; don't leave the request running
+            task.cancel()
+
+    def process_queries(
+        self,
+        document_urls: Union[str, List[str]],
+        questions: List[Question]
+    ) -> List[CitedAnswer]:
+        """
+        Processes a list of questions against one document URL or several.
+        """
+        return asyncio.run(self.aprocess_queries(document_urls, questions))
@@ -0,0 +1,31 @@
+from typing import Hashable, List, Set
+from config import GROUPED_GENERATION_MIN_OVERLAP, GROUPED_GENERATION_MAX_GROUP_SIZE
+
+def jaccard(a: Set[Hashable], b: Set[Hashable]) -> float:
+    union = a | b
+    return len(a & b) / len(union) if union else 0.0
+
+def group_questions(
+    chunk_sets: List[Set[Hashable]],
+    min_overlap: float = GROUPED_GENERATION_MIN_OVERLAP,
+    max_group_size: int = GROUPED_GENERATION_MAX_GROUP_SIZE,
+) -> List[List[int]]:
+    """
+    Greedily groups question indices whose retrieved chunk sets overlap.
+
+    Each question joins the first group that still has room and whose combined chunk set
+    has a Jaccard similarity of at least `min_overlap` with its own; otherwise it starts a
+    new group. Groups keep question order and every question is in exactly one group.
+    """
+    groups: List[List[int]] = []
+    unions: List[Set[Hashable]] = []
+    for i, chunks in enumerate(chunk_sets):
+        for group, union in zip(groups, unions):
+            if len(group) < max_group_size and jaccard(chunks, union) >= min_overlap:
+                group.append(i)
+                union |= chunks
+                break
+        else:
+            groups.append([i])
+            unions.append(set(chunks))
+    return groups
@@ -1,49 +1,647 @@
+import os
+import time
+import shutil
+import sqlite3
+import asyncio
+import weakref
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
 from langchain_chroma import Chroma
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain.vectorstores.base import VectorStoreRetriever
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.document_loaders import PyMuPDFLoader
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.vectorstores import VectorStoreRetriever
+from document_types import create_loader
+from ingestion_pipeline import IngestionPipeline, aiter_documents
+from embedding_cache import CachedEmbeddings
+from model_clients import create_embeddings
+import metrics
 from document_manager import DocumentManager
-from config import EMBEDDING_MODEL
+from ingestion_manifest import IngestionManifest
+from numpy_index import NumpyIndexWriter, NumpyRetriever, NumpyVectorIndex
+from admission import RequestBudget, get_admission
+from file_lock import FileLock
+from config import (
+    EMBEDDING_MODEL,
+    CHUNK_SIZE,
+    CHUNK_OVERLAP,
+    VECTOR_DB_DIR,
+    VECTOR_BACKEND,
+    WORKERS,
+    RETRIEVAL_K,
+    NUMPY_INDEX_MMAP,
+    NUMPY_INDEX_CACHE_SIZE,
+    EMBEDDING_CACHE_ENABLED,
+    VECTOR_STORE_MAX_BYTES,
+    VECTOR_STORE_MAX_CHUNKS,
+    VECTOR_STORE_TTL_S,
+    VECTOR_STORE_COMPACTION_INTERVAL_S,
+)
+
+# Identifies the loader + splitter combination in the ingestion manifest
+SPLITTER_SIGNATURE = f"pdfloader-pages/recursive:{CHUNK_SIZE}:{CHUNK_OVERLAP}"
+
+# Indexes used this recently are never evicted, so a request that just resolved one can still search it
+EVICTION_GRACE_S = 300
+
+_lock = threading.Lock()
+_manifest = None
+_embeddings = None
+_backend = None
+
+# One in-flight ingestion per content hash within this process. Entries disappear once no
+# caller holds or waits on the lock, so the maps do not grow with every document ever seen.
+_ingest_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+_ingest_thread_locks: "weakref.WeakValueDictionary[str, threading.Lock]" = weakref.WeakValueDictionary()
+
+# Across processes, each document has one writer at a time, and one process runs maintenance
+LOCK_DIR = os.path.join(VECTOR_DB_DIR, "locks")
+_maintenance_leader = FileLock(os.path.join(LOCK_DIR, "maintenance.lock"))
+
+def _writer_lock(content_hash: str) -> FileLock:
+    return FileLock(os.path.join(LOCK_DIR, f"{content_hash}.lock"))
+
+def _ingest_lock(locks: weakref.WeakValueDictionary, content_hash: str, factory):
+    """The in-process ingestion lock for a document; callers keep a reference while they use it."""
+    with _lock:
+        lock = locks.get(content_hash)
+        if lock is None:
+            lock = locks[content_hash] = factory()
+        return lock
+
+def get_embeddings() -> Embeddings:
+    """Process-wide embedding model behind the call scheduler, wrapped in the persistent chunk cache unless disabled."""
+    global _embeddings
+    with _lock:
+        if _embeddings is None:
+            _embeddings = create_embeddings(EMBEDDING_MODEL)
+            if EMBEDDING_CACHE_ENABLED:
+                _embeddings = CachedEmbeddings(_embeddings, EMBEDDING_MODEL)
+        return _embeddings
+
+def get_manifest() -> IngestionManifest:
+    global _manifest
+    with _lock:
+        if _manifest is None:
+            _manifest = IngestionManifest()
+        return _manifest
+
+def _directory_bytes(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+class _ChromaWriter:
+    def __init__(self, backend: "ChromaBackend", content_hash: str, embeddings: Optional[Embeddings] = None):
+        self.backend = backend
+        self.content_hash = content_hash
+        self.db = backend._open_store(content_hash, embeddings)
+
+    def add(self, docs: List[Document]):
+        self.db.add_documents(docs)
+
+    async def aadd(self, docs: List[Document]):
+        await self.db.aadd_documents(docs)
+
+    def commit(self):
+        pass
+
+    def abort(self):
+        self.backend.delete(self.content_hash)
+
+class ChromaBackend:
+    """One Chroma collection per document, named after its content hash, in a shared persistent client."""
+    name = "chroma"
+    # Before per-document collections every document shared this one; it is dropped by compaction
+    LEGACY_COLLECTION = "pdf_docs"
+
+    def __init__(self, persist_directory: str = VECTOR_DB_DIR):
+        self.persist_directory = persist_directory
+        self._client = None
+        self._stores: Dict[str, Chroma] = {}
+        self._db_lock = threading.Lock()
+
+    @staticmethod
+    def collection_name(content_hash: str) -> str:
+        return f"doc_{content_hash}"
+
+    def _get_client(self):
+        # Chroma clients must not be constructed concurrently, so one client is shared per process
+        with self._db_lock:
+            if self._client is None:
+                import chromadb
+                self._client = chromadb.PersistentClient(path=self.persist_directory)
+            return self._client
+
+    def _open_store(self, content_hash: str, embeddings: Optional[Embeddings] = None) -> Chroma:
+        client = self._get_client()
+        if embeddings is not None:
+            # A writer embedding through its own wrapper gets a private, uncached store
+            return Chroma(collection_name=self.collection_name(content_hash), embedding_function=embeddings, client=client)
+        embedding_model = get_embeddings()
+        with self._db_lock:
+            if content_hash not in self._stores:
+                self._stores[content_hash] = Chroma(
+                    collection_name=self.collection_name(content_hash),
+                    embedding_function=embedding_model,
+                    client=client,
+                )
+            return self._stores[content_hash]
+
+    def has_index(self, content_hash: str) -> bool:
+        from chromadb.errors import NotFoundError
+        try:
+            self._get_client().get_collection(self.collection_name(content_hash))
+        except NotFoundError:
+            return False
+        return True
+
+    def list_indexes(self) -> List[str]:
+        prefix = self.collection_name("")
+        return [
+            collection.name[len(prefix):]
+            for collection in self._get_client().list_collections()
+            if collection.name.startswith(prefix)
+        ]
+
+    def index_bytes(self, content_hash: str) -> int:
+        # Collections share Chroma's files, so this is an estimate: chunk text plus each vector,
+        # which is held in both the HNSW segment and the write-ahead log
+        collection = self._get_client().get_collection(self.collection_name(content_hash))
+        rows = collection.count()
+        if not rows:
+            return 0
+        sample = collection.get(limit=1, include=["embeddings"])
+        return rows * (CHUNK_SIZE + len(sample["embeddings"][0]) * 8)
+
+    def vectors(self, content_hash: str) -> Dict[str, List[float]]:
+        """Stored embedding of every chunk, keyed by chunk text."""
+        stored = self._get_client().get_collection(self.collection_name(content_hash)).get(include=["documents", "embeddings"])
+        return {text: list(vector) for text, vector in zip(stored["documents"], stored["embeddings"])}
+
+    def writer(self, content_hash: str, embeddings: Optional[Embeddings] = None) -> _ChromaWriter:
+        # Drop chunks left behind by an interrupted ingestion before writing a fresh set
+        self.delete(content_hash)
+        return _ChromaWriter(self, content_hash, embeddings)
+
+    def retriever(self, content_hash: str) -> BaseRetriever:
+        return self._open_store(content_hash).as_retriever(search_kwargs={"k": RETRIEVAL_K})
+
+    def delete(self, content_hash: str):
+        self._drop_collection(self.collection_name(content_hash))
+        with self._db_lock:
+            self._stores.pop(content_hash, None)
+
+    def _drop_collection(self, name: str) -> bool:
+        from chromadb.errors import NotFoundError
+        try:
+            self._get_client().delete_collection(name)
+        except NotFoundError:
+            return False
+        return True
+
+    def compact(self, reclaim: bool):
+        if self._drop_collection(self.LEGACY_COLLECTION):
+            print(f"Dropped legacy shared collection '{self.LEGACY_COLLECTION}'; documents are re-indexed on demand")
+            reclaim = True
+        if not reclaim:
+            return
+        # Deleted collections leave free pages behind in Chroma's SQLite file until it is vacuumed
+        path = os.path.join(self.persist_directory, "chroma.sqlite3")
+        conn = sqlite3.connect(path, timeout=30)
+        try:
+            conn.execute("VACUUM")
+        except sqlite3.OperationalError as e:
+            print(f"Skipped vacuuming the Chroma store: {e}")
+        finally:
+            conn.close()
+
+class NumpyBackend:
+    """One brute-force NumPy index per document, loaded (memory-mapped by default) on demand."""
+    name = "numpy"
+
+    def __init__(self, root: str = os.path.join(VECTOR_DB_DIR, "numpy"), mmap: bool = NUMPY_INDEX_MMAP, cache_size: int = NUMPY_INDEX_CACHE_SIZE):
+        self.root = root
+        self.mmap = mmap
+        self.cache_size = cache_size
+        self._open: "OrderedDict[str, NumpyVectorIndex]" = OrderedDict()
+        self._open_lock = threading.Lock()
+        os.makedirs(self.root, exist_ok=True)
+
+    def has_index(self, content_hash: str) -> bool:
+        return os.path.isdir(os.path.join(self.root, content_hash))
+
+    def list_indexes(self) -> List[str]:
+        return [
+            name for name in os.listdir(self.root)
+            if ".tmp-" not in name and os.path.isdir(os.path.join(self.root, name))
+        ]
+
+    def index_bytes(self, content_hash: str) -> int:
+        return _directory_bytes(os.path.join(self.root, content_hash))
+
+    def vectors(self, content_hash: str) -> Dict[str, List[float]]:
+        """Stored (unit-length) embedding of every chunk, keyed by chunk text."""
+        index = NumpyVectorIndex.load(os.path.join(self.root, content_hash), mmap=self.mmap)
+        return {doc.page_content: index.matrix[i] for i, doc in enumerate(index.documents)}
+
+    def writer(self, content_hash: str, embeddings: Optional[Embeddings] = None) -> NumpyIndexWriter:
+        return NumpyIndexWriter(self.root, content_hash, embeddings or get_embeddings())
+
+    def delete(self, content_hash: str):
+        with self._open_lock:
+            # Searches already holding the index keep their memory map; the pages are freed once they finish
+            self._open.pop(content_hash, None)
+        shutil.rmtree(os.path.join(self.root, content_hash), ignore_errors=True)
+
+    def compact(self, reclaim: bool):
+        # Temp directories of writers that crashed before commit or abort
+        cutoff = time.time() - EVICTION_GRACE_S
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if ".tmp-" in name and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def _load(self, content_hash: str) -> NumpyVectorIndex:
+        with self._open_lock:
+            index = self._open.get(content_hash)
+            if index is not None:
+                self._open.move_to_end(content_hash)
+                return index
+        index = NumpyVectorIndex.load(os.path.join(self.root, content_hash), mmap=self.mmap)
+        with self._open_lock:
+            self._open[content_hash] = index
+            while len(self._open) > self.cache_size:
+                self._open.popitem(last=False)
+        return index
+
+    def retriever(self, content_hash: str) -> BaseRetriever:
+        return NumpyRetriever(index=self._load(content_hash), embeddings=get_embeddings(), k=RETRIEVAL_K)
+
+def get_backend():
+    global _backend
+    with _lock:
+        if _backend is None:
+            if VECTOR_BACKEND == "numpy":
+                _backend = NumpyBackend()
+            elif VECTOR_BACKEND == "chroma" and WORKERS > 1:
+                raise ValueError("The chroma backend cannot be shared by several worker processes; use VECTOR_BACKEND=numpy")
+            elif VECTOR_BACKEND == "chroma":
+                _backend = ChromaBackend()
+            else:
+                raise ValueError(f"Unknown VECTOR_BACKEND: {VECTOR_BACKEND}")
+        return _backend
+
+class _ReusingEmbeddings(Embeddings):
+    """
+    Embeds a changed document's chunks, taking the vector of every chunk whose text is
+    unchanged from the index of its previous version and embedding only the rest.
+    """
+
+    def __init__(self, base: Embeddings, vectors: Dict[str, List[float]]):
+        self.base = base
+        self.vectors = vectors
+        self.reused = 0
+        self.embedded = 0
+
+    def _missing(self, texts: List[str]) -> List[str]:
+        missing = list(dict.fromkeys(text for text in texts if text not in self.vectors))
+        self.embedded += len(missing)
+        self.reused += len(texts) - len(missing)
+        return missing
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        missing = self._missing(texts)
+        fresh = dict(zip(missing, self.base.embed_documents(missing))) if missing else {}
+        return [self.vectors[text] if text in self.vectors else fresh[text] for text in texts]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        missing = self._missing(texts)
+        fresh = dict(zip(missing, await self.base.aembed_documents(missing))) if missing else {}
+        return [self.vectors[text] if text in self.vectors else fresh[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.base.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return await self.base.aembed_query(text)
+
+def _ingesting(content_hash: str) -> bool:
+    locks = (_ingest_locks.get(content_hash), _ingest_thread_locks.get(content_hash))
+    return any(lock is not None and lock.locked() for lock in locks)
+
+def _drop_index(content_hash: str):
+    backend = get_backend()
+    # The manifest goes first, so a request arriving meanwhile re-ingests instead of searching a deleted index
+    get_manifest().forget(content_hash, backend.name)
+    backend.delete(content_hash)
+
+def evict_indexes() -> int:
+    """Drop expired indexes, then least recently used ones until the store fits its quotas. Returns the number dropped."""
+    backend, manifest = get_backend(), get_manifest()
+    indexes = manifest.indexes(backend.name)
+    total_bytes = sum(size for _, size, _, _ in indexes)
+    total_chunks = sum(chunks for _, _, chunks, _ in indexes)
+    now = time.time()
+    evicted = 0
+    for content_hash, size, chunks, last_access in indexes:
+        if now - last_access < EVICTION_GRACE_S:
+            break
+        expired = VECTOR_STORE_TTL_S and now - last_access > VECTOR_STORE_TTL_S
+        over_quota = (
+            (VECTOR_STORE_MAX_BYTES and total_bytes > VECTOR_STORE_MAX_BYTES)
+            or (VECTOR_STORE_MAX_CHUNKS and total_chunks > VECTOR_STORE_MAX_CHUNKS)
+        )
+        if not (expired or over_quota):
+            break
+        _drop_index(content_hash)
+        total_bytes -= size
+        total_chunks -= chunks
+        evicted += 1
+    if evicted:
+        print(f"Evicted {evicted} document indexes from the {backend.name} store")
+    return evicted
+
+def compact_indexes():
+    """
+    One housekeeping pass over the vector store: evict, drop retired indexes past their grace
+    period, reconcile what is on disk with the manifest, and reclaim the space freed.
+
+    Indexes completed before access tracking existed start being tracked; indexes the
+    manifest knows nothing about (interrupted ingestions) are deleted. An index whose writer
+    lock is held, by this process or another, is left alone.
+    """
+    backend, manifest = get_backend(), get_manifest()
+    removed = evict_indexes()
+    for content_hash in manifest.retired(backend.name, time.time() - EVICTION_GRACE_S):
+        writer_lock = _writer_lock(content_hash)
+        if _ingesting(content_hash) or not writer_lock.acquire(blocking=False):
+            continue
+        try:
+            _drop_index(content_hash)
+            removed += 1
+        finally:
+            writer_lock.release()
+    tracked = manifest.tracked(backend.name)
+    for content_hash in backend.list_indexes():
+        if content_hash in tracked or _ingesting(content_hash):
+            continue
+        writer_lock = _writer_lock(content_hash)
+        if not writer_lock.acquire(blocking=False):
+            continue
+        try:
+            chunk_count = manifest.latest_chunk_count(content_hash, backend.name)
+            if chunk_count is not None:
+                manifest.track(content_hash, backend.name, backend.index_bytes(content_hash), chunk_count)
+            else:
+                backend.delete(content_hash)
+                removed += 1
+        finally:
+            writer_lock.release()
+    backend.compact(reclaim=removed > 0)
+
+_maintenance_stop = threading.Event()
+_maintenance_thread: Optional[threading.Thread] = None
+
+def _maintenance_loop(interval_s: float):
+    while True:
+        # With several workers only the holder of the leader lock compacts; another takes over if it exits
+        if _maintenance_leader.held or _maintenance_leader.acquire(blocking=False):
+            try:
+                compact_indexes()
+            except Exception as e:
+                print(f"Vector store compaction failed: {e}")
+        if _maintenance_stop.wait(interval_s):
+            return
+
+def start_index_maintenance(interval_s: float = VECTOR_STORE_COMPACTION_INTERVAL_S):
+    """Run `compact_indexes` now and then every `interval_s` seconds in a daemon thread. 0 disables it."""
+    global _maintenance_thread
+    with _lock:
+        if interval_s <= 0 or _maintenance_thread is not None:
+            return
+        _maintenance_stop.clear()
+        _maintenance_thread = threading.Thread(target=_maintenance_loop, args=(interval_s,), name="index-maintenance", daemon=True)
+        _maintenance_thread.start()
+
+def stop_index_maintenance():
+    global _maintenance_thread
+    with _lock:
+        thread, _maintenance_thread = _maintenance_thread, None
+    if thread is not None:
+        _maintenance_stop.set()
+        thread.join()
+    _maintenance_leader.release()
+
+async def asearch_by_vectors_with_scores(
+    retriever: BaseRetriever, vectors: List[List[float]], k: Optional[int] = None,
+) -> List[List[Tuple[Document, float]]]:
+    """
+    Search precomputed query vectors against a retriever from either backend, with relevance
+    scores (higher is better). `k` overrides the retriever's own.
+    """
+    if isinstance(retriever, NumpyRetriever):
+        # One matrix multiply for the whole batch; numpy releases the GIL while it runs
+        return await asyncio.to_thread(retriever.index.search_by_vectors, vectors, k or retriever.k)
+    if isinstance(retriever, VectorStoreRetriever):
+        store, search_kwargs = retriever.vectorstore, retriever.search_kwargs
+        if k:
+            search_kwargs = {**search_kwargs, "k": k}
+        relevance = store._select_relevance_score_fn()
+        results = await asyncio.gather(*[
+            asyncio.to_thread(store.similarity_search_by_vector_with_relevance_scores, vector, **search_kwargs)
+            for vector in vectors
+        ])
+        return [[(doc, relevance(distance)) for doc, distance in hits] for hits in results]
+    raise TypeError(f"Unsupported retriever type: {type(retriever).__name__}")
+
+async def asearch_union_with_scores(
+    retrievers: List[BaseRetriever], vectors: List[List[float]], k: Optional[int] = None,
+) -> List[List[Tuple[Document, float]]]:
+    """
+    Search query vectors against several documents' indexes at once and keep, per query, the
+    `k` best hits across all of them, so one document cannot crowd out the others by default.
+    """
+    if len(retrievers) == 1:
+        return await asearch_by_vectors_with_scores(retrievers[0], vectors, k)
+    per_retriever = await asyncio.gather(*[asearch_by_vectors_with_scores(r, vectors, k) for r in retrievers])
+    merged = []
+    for i in range(len(vectors)):
+        hits = [hit for results in per_retriever for hit in results[i]]
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        merged.append(hits[:k or RETRIEVAL_K])
+    return merged
+
+async def asearch_by_vectors(retriever: BaseRetriever, vectors: List[List[float]], k: Optional[int] = None) -> List[List[Document]]:
+    """Search precomputed query vectors against a retriever from either backend."""
+    results = await asearch_by_vectors_with_scores(retriever, vectors, k)
+    return [[doc for doc, _ in hits] for hits in results]
 
 class VectorStoreProvider:
     def __init__(self, manager: DocumentManager):
         self.manager = manager
+        self.backend = get_backend()
         self.retriever = self._create_retriever()
 
-    def _create_retriever(self) -> VectorStoreRetriever:
-        file_path = self.manager.get_filepath()
-        loader = PyMuPDFLoader(file_path, mode="single")
-        raw_documents = loader.load()
-        if not raw_documents:
-            raise ValueError(f"Couldn’t load any content from {file_path}")
-
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=1000, chunk_overlap=150)
-        split_docs = text_splitter.split_documents(raw_documents)
-        for doc in split_docs:
+    @classmethod
+    async def acreate(cls, manager: DocumentManager, budget: Optional[RequestBudget] = None) -> "VectorStoreProvider":
+        """
+        Async counterpart of the constructor: parsing runs in the process pool, I/O off the event loop.
+        Ingestion waits for a slot from the ingestion admission controller, within `budget` if given.
+        """
+        provider = cls.__new__(cls)
+        provider.manager = manager
+        provider.backend = get_backend()
+        provider.retriever = await provider._acreate_retriever(budget)
+        return provider
+
+    def _tag_chunks(self, split_docs: List[Document], start: int = 0) -> List[Document]:
+        content_hash = self.manager.get_content_hash()
+        for i, doc in enumerate(split_docs, start=start):
+            doc.id = f"{content_hash}:{i}"
             doc.metadata["source"] = self.manager.document_url
+            doc.metadata["content_hash"] = content_hash
+        return split_docs
+
+    def _is_indexed(self) -> bool:
+        content_hash = self.manager.get_content_hash()
+        chunk_count = get_manifest().lookup(content_hash, self.backend.name, SPLITTER_SIGNATURE, EMBEDDING_MODEL)
+        return chunk_count is not None and self.backend.has_index(content_hash)
+
+    def _previous_version(self) -> Optional[str]:
+        """Content hash of the indexed version this URL served before, if its content has changed since."""
+        manifest = get_manifest()
+        previous = manifest.source_hash(self.manager.document_url)
+        if previous is None or previous == self.manager.get_content_hash():
+            return None
+        if manifest.lookup(previous, self.backend.name, SPLITTER_SIGNATURE, EMBEDDING_MODEL) is None:
+            return None
+        return previous if self.backend.has_index(previous) else None
+
+    def _open_writer(self, previous: Optional[str]):
+        content_hash = self.manager.get_content_hash()
+        if previous is None:
+            return self.backend.writer(content_hash), None
+        vectors = self.backend.vectors(previous)
+        print(f"Document changed; re-indexing with the embeddings of its previous version ({len(vectors)} chunks)")
+        embeddings = _ReusingEmbeddings(get_embeddings(), vectors)
+        return self.backend.writer(content_hash, embeddings), embeddings
 
-        embedding_model = GoogleGenerativeAIEmbeddings(model=EMBEDDING_MODEL)
-        db = Chroma(
-            collection_name="pdf_docs",
-            embedding_function=embedding_model,
-            persist_directory="./vector_db",
+    def _retire_previous(self, previous: Optional[str], embeddings: Optional[_ReusingEmbeddings]):
+        """
+        Hand the index of the version a changed document replaced to compaction. Searches that
+        resolved it moments ago may still be running, so it is dropped only after the grace
+        period, and only if no other URL serves it by then.
+        """
+        if previous is None:
+            return
+        metrics.record_cache("chunk_reuse", hits=embeddings.reused, misses=embeddings.embedded)
+        print(f"Re-indexed changed document: {embeddings.reused} chunks reused, {embeddings.embedded} embedded")
+        get_manifest().retire(previous, self.backend.name)
+
+    def _open_indexed(self) -> BaseRetriever:
+        content_hash = self.manager.get_content_hash()
+        get_manifest().touch(content_hash, self.backend.name)
+        return self.backend.retriever(content_hash)
+
+    def _record_completion(self, chunk_count: int):
+        metrics.record_chunks("indexed", chunk_count)
+        embeddings = get_embeddings()
+        if isinstance(embeddings, CachedEmbeddings):
+            print(f"Embedding cache: {embeddings.stats()}")
+        content_hash = self.manager.get_content_hash()
+        get_manifest().record(
+            self.manager.document_url,
+            content_hash,
+            self.backend.name,
+            SPLITTER_SIGNATURE,
+            EMBEDDING_MODEL,
+            chunk_count,
+            self.backend.index_bytes(content_hash),
         )
+        # Keep the store within its quotas as it grows, not only when compaction runs
+        evict_indexes()
 
-        # check if already stored ANY chunk for this URL
-        existing = db.get(
-            ids=None,
-            include=["metadatas"],
-            where={"source": self.manager.document_url}
-        )["metadatas"]
+    def _create_retriever(self) -> BaseRetriever:
+        content_hash = self.manager.get_content_hash()
+        lock = _ingest_lock(_ingest_thread_locks, content_hash, threading.Lock)
+        with lock, _writer_lock(content_hash):
+            # Checked under the writer lock, so a document another process is writing is waited for, not re-ingested
+            if self._is_indexed():
+                print("Embeddings already exist")
+                metrics.record_cache("ingestion", hits=1)
+                return self._open_indexed()
+            metrics.record_cache("ingestion", misses=1)
 
-        if not existing:
+            file_path = self.manager.get_filepath()
             print("Creating new embeddings.")
-            db.add_documents(split_docs)
-        else:
-            print("Embeddings already exist")
+            previous = self._previous_version()
+            writer, reusing = self._open_writer(previous)
+            def store_batch(batch: List[Document], start: int):
+                with metrics.stage("embed"):
+                    writer.add(self._tag_chunks(batch, start))
 
-        retriever = db.as_retriever(
-            search_kwargs={"k": 3, "filter": {"source": self.manager.document_url}}
-        )
-        return retriever
\ No newline at end of file
+            try:
+                with metrics.stage("ingest"):
+                    chunk_count = IngestionPipeline().run(create_loader(file_path).lazy_load(), store_batch)
+                if not chunk_count:
+                    raise ValueError(f"Couldn’t load any content from {file_path}")
+                writer.commit()
+            except BaseException:
+                writer.abort()
+                raise
+            self._record_completion(chunk_count)
+            self._retire_previous(previous, reusing)
+        return self.backend.retriever(content_hash)
+
+    async def _acreate_retriever(self, budget: Optional[RequestBudget]) -> BaseRetriever:
+        content_hash = self.manager.get_content_hash()
+        lock = _ingest_lock(_ingest_locks, content_hash, asyncio.Lock)
+        async with lock:
+            # Warm path: the manifest says every chunk is stored, so skip parse/split/embed entirely
+            if await asyncio.to_thread(self._is_indexed):
+                print("Embeddings already exist")
+                metrics.record_cache("ingestion", hits=1)
+                return await asyncio.to_thread(self._open_indexed)
+
+            # Another worker process may be writing this document; wait for it and use its index
+            async with _writer_lock(content_hash):
+                if await asyncio.to_thread(self._is_indexed):
+                    print("Embeddings written by another process")
+                    metrics.record_cache("ingestion", hits=1)
+                    return await asyncio.to_thread(self._open_indexed)
+                metrics.record_cache("ingestion", misses=1)
+                async with get_admission("ingestion").admit(budget):
+                    await self._aingest()
+        return await asyncio.to_thread(self.backend.retriever, content_hash)
+
+    async def _aingest(self):
+        file_path = self.manager.get_filepath()
+        print("Creating new embeddings.")
+        # A new version of a document already indexed under this URL only embeds its changed chunks
+        previous = await asyncio.to_thread(self._previous_version)
+        writer, reusing = await asyncio.to_thread(self._open_writer, previous)
+
+        async def store_batch(batch: List[Document], start: int):
+            # Batches embed concurrently, so "embed" is total embedding time, not wall time
+            with metrics.stage("embed"):
+                await writer.aadd(self._tag_chunks(batch, start))
+
+        try:
+            # Pages parsed across the process pool stream through split -> embed batches
+            with metrics.stage("ingest"):
+                chunk_count = await IngestionPipeline().arun(aiter_documents(create_loader(file_path)), store_batch)
+            if not chunk_count:
+                raise ValueError(f"Couldn’t load any content from {file_path}")
+            await asyncio.to_thread(writer.commit)
+        except BaseException:
+            await asyncio.to_thread(writer.abort)
+            raise
+        await asyncio.to_thread(self._record_completion, chunk_count)
+        await asyncio.to_thread(self._retire_previous, previous, reusing)
@@ -0,0 +1,139 @@
+import os
+import sys
+import hashlib
+import tempfile
+import threading
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Offline models and throwaway stores; set before config is imported anywhere
+_STATE_DIR = tempfile.mkdtemp(prefix="rag-tests-")
+os.environ.update(
+    MODEL_PROVIDER="fake",
+    GOOGLE_API_KEY="test",
+    AZURE_STORAGE_ACCOUNT_URL="https://account.blob.core.windows.net",
+    AZURE_STORAGE_CONTAINER="documents",
+    AZURE_STORAGE_KEY="dGVzdA==",
+    DOC_CACHE_DIR=os.path.join(_STATE_DIR, "doc_cache"),
+    VECTOR_DB_DIR=os.path.join(_STATE_DIR, "vector_db"),
+    EMBEDDING_CACHE_DIR=os.path.join(_STATE_DIR, "embedding_cache"),
+    ANSWER_CACHE_PATH=os.path.join(_STATE_DIR, "answer_cache", "answers.sqlite3"),
+    WARMUP_ON_STARTUP="false",
+)
+
+import pytest
+
+class _Handler(SimpleHTTPRequestHandler):
+    """Static files with strong ETags and If-None-Match, plus `/redirect/<name>` -> `/<name>`."""
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        path = self.path.split("?", 1)[0]
+        if path.startswith("/redirect/"):
+            self.send_response(302)
+            self.send_header("Location", "/" + path[len("/redirect/"):])
+            self.end_headers()
+            return
+        file_path = os.path.join(self.server.directory, path.lstrip("/"))
+        if not os.path.isfile(file_path):
+            self.send_error(404)
+            return
+        with open(file_path, "rb") as f:
+            body = f.read()
+        etag = f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+class DocumentServer:
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.httpd.directory = directory
+        self.httpd.requests = []
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def requests(self):
+        return self.httpd.requests
+
+    def url(self, path: str) -> str:
+        return f"http://127.0.0.1:{self.httpd.server_address[1]}/{path.lstrip('/')}"
+
+    def write(self, name: str, data: bytes):
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(data)
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+def make_pdf(pages: int = 2, label: str = "doc") -> bytes:
+    import pymupdf
+    doc = pymupdf.open()
+    for i in range(pages):
+        doc.new_page().insert_text((72, 72), f"{label} page {i}: the grace period is {i} days.")
+    return doc.tobytes()
+
+@pytest.fixture
+def doc_server(tmp_path):
+    directory = tmp_path / "www"
+    directory.mkdir()
+    server = DocumentServer(str(directory))
+    yield server
+    server.close()
+
+@pytest.fixture
+def document_cache(tmp_path, monkeypatch):
+    """A private DocumentCache behind DocumentManager."""
+    import document_manager
+    from document_cache import DocumentCache
+    cache = DocumentCache(root=str(tmp_path / "doc_cache"))
+    monkeypatch.setattr(document_manager, "_cache", cache)
+    return cache
+
+@pytest.fixture
+def stub_query_service(tmp_path, monkeypatch):
+    """
+    Builds QueryServices over a private answer cache, with indexing and generation stubbed.
+    Returns (service, indexed content hashes, questions sent to the LLM); each answer cites every indexed document.
+    """
+    import query_service
+    from types import SimpleNamespace
+    from answer_cache import AnswerCache
+    from models import CitedAnswer
+    indexed, calls = [], []
+
+    async def index(manager, budget=None):
+        indexed.append(manager.get_content_hash())
+        return SimpleNamespace(retriever=manager.get_content_hash())
+
+    monkeypatch.setattr(query_service.VectorStoreProvider, "acreate", index)
+
+    def build(degrade: bool = False):
+        service = query_service.QueryService()
+        service.answer_cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+
+        async def ainvoke(questions, retrievers, on_event=None, budget=None):
+            calls.append([q.question for q in questions])
+            if degrade:
+                budget.degrade("skip_decomposition")
+            return [CitedAnswer(answer=f"answer to {q.question}", sources=list(retrievers)) for q in questions]
+
+        service.llm.ainvoke = ainvoke
+        return service, indexed, calls
+
+    return build
@@ -0,0 +1,81 @@
+import time
+import asyncio
+import pytest
+from admission import AdmissionController, AdmissionTimeoutError, OverloadedError, RequestBudget
+
+def test_waiters_are_admitted_in_arrival_order():
+    controller = AdmissionController("test", max_concurrent=1, max_queue=10)
+    order = []
+
+    async def worker(i: int):
+        async with controller.admit(RequestBudget(5)):
+            order.append(i)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        tasks = []
+        for i in range(5):
+            tasks.append(asyncio.create_task(worker(i)))
+            # Let each one reach the queue before the next arrives
+            await asyncio.sleep(0)
+        await asyncio.gather(*tasks)
+
+    asyncio.run(main())
+    assert order == [0, 1, 2, 3, 4]
+    assert controller._in_flight == 0 and not controller._waiters
+
+def test_full_queue_rejects_at_once():
+    controller = AdmissionController("test", max_concurrent=1, max_queue=1)
+
+    async def main():
+        async with controller.admit():
+            waiter = asyncio.create_task(controller.admit(RequestBudget(5)).__aenter__())
+            await asyncio.sleep(0)
+            with pytest.raises(OverloadedError):
+                async with controller.admit(RequestBudget(5)):
+                    pass
+            waiter.cancel()
+            await asyncio.gather(waiter, return_exceptions=True)
+            assert not controller._waiters
+
+    asyncio.run(main())
+    assert controller._in_flight == 0
+
+def test_waiter_times_out_within_budget_and_frees_its_place():
+    controller = AdmissionController("test", max_concurrent=1, max_queue=10, max_wait_s=10)
+
+    async def main():
+        async with controller.admit():
+            started = time.monotonic()
+            with pytest.raises(AdmissionTimeoutError):
+                async with controller.admit(RequestBudget(0.1)):
+                    pass
+            assert 0.08 <= time.monotonic() - started < 1
+            assert not controller._waiters
+        # The slot is free again once the holder leaves
+        async with controller.admit(RequestBudget(0.1)):
+            pass
+
+    asyncio.run(main())
+    assert controller._in_flight == 0
+
+def test_slot_is_handed_to_waiter_on_another_loop():
+    import threading
+    controller = AdmissionController("test", max_concurrent=1)
+    admitted = threading.Event()
+
+    async def hold_then_release():
+        async with controller.admit():
+            thread = threading.Thread(target=lambda: asyncio.run(wait_for_slot()))
+            thread.start()
+            while not controller._waiters:
+                await asyncio.sleep(0.01)
+        await asyncio.to_thread(thread.join, 5)
+
+    async def wait_for_slot():
+        async with controller.admit(RequestBudget(5)):
+            admitted.set()
+
+    asyncio.run(hold_then_release())
+    assert admitted.is_set()
+    assert controller._in_flight == 0
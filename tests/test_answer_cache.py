@@ -0,0 +1,53 @@
+import time
+import asyncio
+from answer_cache import AnswerCache
+from conftest import make_pdf
+from models import CitedAnswer, Question
+
+MODEL, PROMPT = "fake-model", "v1"
+
+def test_semantic_tier_respects_threshold(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"))
+    cache.put_many("doc", ["What is the grace period?"], ["30 days"], MODEL, PROMPT, vectors=[[1.0, 0.0]])
+    close, far = [0.96, 0.28], [0.6, 0.8]  # cosine 0.96 and 0.6
+    assert cache.get_similar("doc", {0: close, 1: far}, MODEL, PROMPT, threshold=0.9) == {0: ("30 days", [])}
+    assert cache.get_similar("doc", {0: close}, MODEL, PROMPT, threshold=0.99) == {}
+    # Another document's entries are never reused
+    assert cache.get_similar("other", {0: close}, MODEL, PROMPT, threshold=0.9) == {}
+
+def test_entries_expire_after_ttl(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"), ttl_s=60)
+    cache.put_many("doc", ["What is the grace period?"], ["30 days"], MODEL, PROMPT, vectors=[[1.0, 0.0]])
+    assert cache.get_many("doc", ["what is  the grace period?"], MODEL, PROMPT) == {0: ("30 days", [])}
+    with cache._connect() as conn:
+        conn.execute("UPDATE answers SET created_at = created_at - 61")
+    assert cache.get_many("doc", ["What is the grace period?"], MODEL, PROMPT) == {}
+    assert cache.get_similar("doc", {0: [1.0, 0.0]}, MODEL, PROMPT, threshold=0.9) == {}
+
+def test_least_recently_used_entries_are_trimmed(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.sqlite3"), max_entries=2)
+    for question in ("first", "second"):
+        cache.put_many("doc", [question], [f"{question} answer"], MODEL, PROMPT)
+        time.sleep(0.01)
+    assert cache.get_many("doc", ["first"], MODEL, PROMPT)
+    time.sleep(0.01)
+    cache.put_many("doc", ["third"], ["third answer"], MODEL, PROMPT)
+    assert set(cache.get_many("doc", ["first", "second", "third"], MODEL, PROMPT)) == {0, 2}
+
+def test_exact_hit_makes_no_llm_call(doc_server, document_cache, stub_query_service):
+    doc_server.write("policy.pdf", make_pdf())
+    url = doc_server.url("policy.pdf")
+    service, _, calls = stub_query_service()
+    first = asyncio.run(service.aprocess_queries(url, [Question(question="What is the grace period?")]))
+    again = asyncio.run(service.aprocess_queries(url, [Question(question="what is the  Grace period?")]))
+    assert len(calls) == 1
+    assert again == first == [CitedAnswer(answer="answer to What is the grace period?", sources=[url])]
+
+def test_degraded_answers_are_not_cached(doc_server, document_cache, stub_query_service):
+    doc_server.write("policy.pdf", make_pdf())
+    url = doc_server.url("policy.pdf")
+    service, _, calls = stub_query_service(degrade=True)
+    questions = [Question(question="What is the grace period?")]
+    asyncio.run(service.aprocess_queries(url, questions))
+    asyncio.run(service.aprocess_queries(url, questions))
+    assert len(calls) == 2
@@ -0,0 +1,55 @@
+from langchain_core.documents import Document
+from context_packer import CONTEXT_SEPARATOR, ContextPacker, join_overlapping
+
+def _chunk(index: int, text: str, page: int = 1, content_hash: str = "doc") -> Document:
+    return Document(id=f"{content_hash}:{index}", page_content=text, metadata={"page": page, "content_hash": content_hash})
+
+def _packer(token_budget: int = 1000) -> ContextPacker:
+    packer = ContextPacker(token_budget=token_budget)
+    # Count ~4 characters per token whether or not tiktoken can load its encoding
+    packer._encoding_failed = True
+    return packer
+
+def test_join_overlapping_keeps_the_overlap_once():
+    assert join_overlapping("The grace period is thirty", "period is thirty days.") == "The grace period is thirty days."
+    assert join_overlapping("First part.", "Unrelated second.") == "First part.\nUnrelated second."
+
+def test_adjacent_chunks_on_one_page_merge_into_one_span():
+    left = _chunk(3, "Premiums are due monthly. The grace period is thirty")
+    right = _chunk(4, "grace period is thirty days after the due date.")
+    spans = _packer().merge_spans([(right, 0.5), (left, 0.9)])
+    assert len(spans) == 1
+    assert spans[0].text == "Premiums are due monthly. The grace period is thirty days after the due date."
+    assert spans[0].score == 0.9
+    assert spans[0].text.count("grace period is thirty") == 1
+
+def test_non_adjacent_or_cross_page_chunks_stay_separate():
+    packer = _packer()
+    gap = packer.merge_spans([(_chunk(1, "alpha"), 0.9), (_chunk(3, "gamma"), 0.8)])
+    assert [s.text for s in gap] == ["alpha", "gamma"]
+    pages = packer.merge_spans([(_chunk(1, "end of page one"), 0.9), (_chunk(2, "start of page two", page=2), 0.8)])
+    assert [s.text for s in pages] == ["end of page one", "start of page two"]
+    documents = packer.merge_spans([(_chunk(1, "doc a", content_hash="a"), 0.9), (_chunk(2, "doc b", content_hash="b"), 0.8)])
+    assert len(documents) == 2
+
+def test_duplicate_chunk_keeps_best_score():
+    spans = _packer().merge_spans([(_chunk(1, "same"), 0.2), (_chunk(1, "same"), 0.7)])
+    assert [(s.text, s.score) for s in spans] == [("same", 0.7)]
+
+def test_spans_are_packed_best_first_within_budget():
+    packer = _packer(token_budget=10)
+    context, sources = packer.pack_with_sources([
+        (_chunk(1, "low " * 4, content_hash="a"), 0.1),
+        (_chunk(5, "best" * 4, content_hash="b"), 0.9),
+        (_chunk(9, "x" * 200, content_hash="c"), 0.5),
+    ])
+    # The 50-token span does not fit after the best one and is skipped, not truncated
+    assert context == "best" * 4 + CONTEXT_SEPARATOR + "low " * 4
+    assert sources == ["b", "a"]
+    assert packer.count_tokens(context) <= 10
+
+def test_oversized_first_span_is_truncated_to_budget():
+    packer = _packer(token_budget=5)
+    context, sources = packer.pack_with_sources([(_chunk(1, "y" * 100), 0.9), (_chunk(7, "short"), 0.1)])
+    assert context == "y" * 20
+    assert sources == ["doc"]
@@ -0,0 +1,54 @@
+from document_cache import DocumentCache, cache_key
+from document_manager import DocumentManager
+from conftest import make_pdf
+
+def test_cache_key_drops_signature_and_expiry_parameters():
+    sas = "https://acct.blob.core.windows.net/c/policy.pdf?sv=2022-11-02&sr=b&st=2024-01-01&se=2024-01-02&sp=r&sig=abc%2F"
+    s3 = "https://bucket.s3.amazonaws.com/policy.pdf?X-Amz-Algorithm=AWS4&X-Amz-Signature=deadbeef&X-Amz-Expires=600"
+    assert cache_key(sas) == "https://acct.blob.core.windows.net/c/policy.pdf"
+    assert cache_key(s3) == "https://bucket.s3.amazonaws.com/policy.pdf"
+
+def test_cache_key_keeps_identifying_parameters():
+    url = "https://example.com/download?id=42&version=3&sig=abc"
+    assert cache_key(url) == "https://example.com/download?id=42&version=3"
+    assert cache_key("https://example.com/a.pdf?id=1") != cache_key("https://example.com/a.pdf?id=2")
+
+def test_cache_key_keeps_parameters_of_unsigned_urls():
+    assert cache_key("https://insurer.example/docs?policy=HDFC-001") != cache_key("https://insurer.example/docs?policy=BAJAJ-777")
+    assert cache_key("https://insurer.example/docs?policy=HDFC-001") == "https://insurer.example/docs?policy=HDFC-001"
+    # SAS-like names without a signature, and CloudFront names without Key-Pair-Id, are not a signature
+    assert cache_key("https://example.com/a.pdf?sp=2&sr=b") == "https://example.com/a.pdf?sp=2&sr=b"
+    assert cache_key("https://example.com/a.pdf?expires=2030&signature=v2") == "https://example.com/a.pdf?expires=2030&signature=v2"
+    assert cache_key("https://example.com/a.pdf?X-Amz-Date=1") == "https://example.com/a.pdf?X-Amz-Date=1"
+
+def test_cache_key_drops_cloudfront_signature():
+    url = "https://d1.cloudfront.net/policy.pdf?id=7&Expires=1700000000&Signature=abc&Key-Pair-Id=K2"
+    assert cache_key(url) == "https://d1.cloudfront.net/policy.pdf?id=7"
+
+def test_unsigned_urls_differing_in_parameters_get_their_own_documents(doc_server, document_cache):
+    doc_server.write("docs", make_pdf(label="first"))
+    first = DocumentManager(doc_server.url("docs?policy=HDFC-001"))
+    doc_server.write("docs", make_pdf(label="second"))
+    second = DocumentManager(doc_server.url("docs?policy=BAJAJ-777"))
+    assert doc_server.requests == ["/docs?policy=HDFC-001", "/docs?policy=BAJAJ-777"]
+    assert second.get_content_hash() != first.get_content_hash()
+
+def test_resigned_url_resolves_to_cached_object(tmp_path):
+    cache = DocumentCache(root=str(tmp_path))
+    temp = cache.new_temp_path()
+    with open(temp, "wb") as f:
+        f.write(b"%PDF-1.4 test")
+    stored = cache.put("https://a.blob.core.windows.net/c/x.pdf?se=1&sig=first", temp, "hash1")
+    hit = cache.lookup("https://a.blob.core.windows.net/c/x.pdf?se=2&sig=second")
+    assert hit is not None and hit.content_hash == "hash1" and hit.path == stored.path
+    assert cache.lookup("https://a.blob.core.windows.net/c/other.pdf?sig=first") is None
+
+def test_manager_fetches_raw_url_and_reuses_cache_for_resigned_url(doc_server, document_cache):
+    doc_server.write("policy.pdf", make_pdf())
+    first = DocumentManager(doc_server.url("policy.pdf?se=1&sig=first"))
+    # The origin sees the signed URL as given
+    assert doc_server.requests == ["/policy.pdf?se=1&sig=first"]
+
+    second = DocumentManager(doc_server.url("policy.pdf?se=2&sig=second"))
+    assert doc_server.requests == ["/policy.pdf?se=1&sig=first"]
+    assert second.get_content_hash() == first.get_content_hash()
@@ -0,0 +1,59 @@
+import asyncio
+import httpx
+import pytest
+import document_manager
+from document_fetcher import DocumentFetcher, DocumentTooLargeError
+from document_manager import DocumentManager
+from main import to_http_exception
+from conftest import make_pdf
+
+def test_follows_redirects(doc_server, tmp_path):
+    doc_server.write("policy.pdf", b"%PDF-1.4 redirected")
+    dest = tmp_path / "out.pdf"
+    result = DocumentFetcher().fetch(doc_server.url("redirect/policy.pdf"), str(dest))
+    assert dest.read_bytes() == b"%PDF-1.4 redirected"
+    assert result.size == len(b"%PDF-1.4 redirected") and result.etag
+    assert doc_server.requests == ["/redirect/policy.pdf", "/policy.pdf"]
+
+def test_missing_document_maps_to_400(doc_server, tmp_path):
+    with pytest.raises(httpx.HTTPStatusError) as info:
+        asyncio.run(DocumentFetcher().afetch(doc_server.url("missing.pdf"), str(tmp_path / "out.pdf")))
+    assert to_http_exception(info.value).status_code == 400
+
+def test_oversized_document_maps_to_413(doc_server, tmp_path):
+    doc_server.write("big.pdf", b"%PDF-1.4 " + b"x" * 4096)
+    with pytest.raises(DocumentTooLargeError) as info:
+        DocumentFetcher(max_bytes=1024).fetch(doc_server.url("big.pdf"), str(tmp_path / "out.pdf"))
+    assert to_http_exception(info.value).status_code == 413
+
+def test_conditional_fetch_reports_not_modified(doc_server, tmp_path):
+    doc_server.write("policy.pdf", b"%PDF-1.4 v1")
+    fetcher = DocumentFetcher()
+    first = fetcher.fetch(doc_server.url("policy.pdf"), str(tmp_path / "a.pdf"))
+    again = asyncio.run(fetcher.afetch(doc_server.url("policy.pdf"), str(tmp_path / "b.pdf"), etag=first.etag))
+    assert again.not_modified and again.etag == first.etag
+
+    doc_server.write("policy.pdf", b"%PDF-1.4 v2")
+    changed = fetcher.fetch(doc_server.url("policy.pdf"), str(tmp_path / "c.pdf"), etag=first.etag)
+    assert not changed.not_modified and changed.content_hash != first.content_hash
+
+def test_manager_revalidates_stale_copy(doc_server, document_cache, monkeypatch):
+    monkeypatch.setattr(document_manager, "DOC_REVALIDATE_AFTER_S", 0)
+    doc_server.write("policy.pdf", make_pdf(label="v1"))
+    first = DocumentManager(doc_server.url("policy.pdf"))
+    unchanged = DocumentManager(doc_server.url("policy.pdf"))
+    assert len(doc_server.requests) == 2
+    assert unchanged.get_content_hash() == first.get_content_hash()
+
+    doc_server.write("policy.pdf", make_pdf(label="v2"))
+    updated = DocumentManager(doc_server.url("policy.pdf"))
+    assert updated.get_content_hash() != first.get_content_hash()
+
+def test_client_from_previous_loop_is_closed(doc_server, tmp_path):
+    doc_server.write("policy.pdf", b"%PDF-1.4 loops")
+    fetcher = DocumentFetcher()
+    asyncio.run(fetcher.afetch(doc_server.url("policy.pdf"), str(tmp_path / "a.pdf")))
+    first_client = fetcher._async_http_client
+    asyncio.run(fetcher.afetch(doc_server.url("policy.pdf"), str(tmp_path / "b.pdf")))
+    assert first_client.is_closed
+    assert fetcher._async_http_client is not first_client
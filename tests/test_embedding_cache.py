@@ -0,0 +1,66 @@
+import os
+import numpy as np
+import embedding_cache
+from embedding_cache import CachedEmbeddings, EmbeddingStore
+from fakes import FakeEmbeddings
+
+def _vectors(count: int, dim: int = 4, start: int = 0):
+    return [[float(start + i)] * dim for i in range(count)]
+
+def test_partial_row_is_truncated_on_open(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.put_many(["a", "b"], _vectors(2))
+    # A writer that died halfway through a row
+    with open(store.vectors_path, "ab") as f:
+        f.write(np.zeros(4, dtype=np.float32).tobytes()[:6])
+
+    reopened = EmbeddingStore(str(tmp_path))
+    assert os.path.getsize(reopened.vectors_path) == 2 * 4 * 4
+    reopened.put_many(["c"], _vectors(1, start=7))
+    assert reopened.get_many(["a", "b", "c"]) == {"a": [0.0] * 4, "b": [1.0] * 4, "c": [7.0] * 4}
+
+def test_partial_row_is_truncated_before_append(tmp_path):
+    store = EmbeddingStore(str(tmp_path))
+    store.put_many(["a"], _vectors(1))
+    with open(store.vectors_path, "ab") as f:
+        f.write(b"\0" * 5)
+    store.put_many(["b"], _vectors(1, start=3))
+    assert store.get_many(["a", "b"]) == {"a": [0.0] * 4, "b": [3.0] * 4}
+
+def test_failed_append_indexes_nothing(tmp_path, monkeypatch):
+    store = EmbeddingStore(str(tmp_path))
+    store.put_many(["a"], _vectors(1))
+
+    def fail(fd):
+        raise OSError("disk full")
+
+    monkeypatch.setattr(embedding_cache.os, "fsync", fail)
+    try:
+        store.put_many(["b", "c"], _vectors(2, start=5))
+    except OSError:
+        pass
+    monkeypatch.undo()
+    assert store.get_many(["b", "c"]) == {}
+    store.put_many(["d"], _vectors(1, start=9))
+    assert store.get_many(["a", "d"]) == {"a": [0.0] * 4, "d": [9.0] * 4}
+    assert os.path.getsize(store.vectors_path) == 2 * 4 * 4
+
+def test_stats_match_recorded_metrics(tmp_path, monkeypatch):
+    recorded = {"hits": 0, "misses": 0}
+
+    def record_cache(cache, hits=0, misses=0):
+        if cache == "embedding":
+            recorded["hits"] += hits
+            recorded["misses"] += misses
+
+    monkeypatch.setattr(embedding_cache.metrics, "record_cache", record_cache)
+    fake = FakeEmbeddings(size=8, latency_s=0)
+    embeddings = CachedEmbeddings(fake, "fake-model", cache_dir=str(tmp_path))
+    # A duplicate of a missing text is embedded once, so it counts as a hit
+    embeddings.embed_documents(["alpha", "beta", "alpha"])
+    embeddings.embed_documents(["alpha", "gamma"])
+
+    stats = embeddings.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 3)
+    assert recorded == {"hits": 2, "misses": 3}
+    assert fake.calls == 2
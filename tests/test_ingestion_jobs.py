@@ -0,0 +1,153 @@
+import time
+import asyncio
+from ingestion_jobs import IngestionJob, IngestionJobStore, IngestionQueue
+
+URL = "https://example.com/policy.pdf"
+
+def _slow_run(release: asyncio.Event):
+    async def run(self, job: IngestionJob):
+        job.status = "running"
+        await self._enter(job, "indexing")
+        await release.wait()
+        job.enter("indexed")
+    return run
+
+def test_workers_share_jobs_through_the_store(tmp_path, monkeypatch):
+    path = str(tmp_path / "jobs.sqlite3")
+
+    async def main():
+        release = asyncio.Event()
+        monkeypatch.setattr(IngestionQueue, "_run", _slow_run(release))
+        # Two queues over one store stand in for two worker processes
+        first, second = IngestionQueue(store=IngestionJobStore(path)), IngestionQueue(store=IngestionJobStore(path))
+        job = await first.submit(URL)
+        # A re-signed URL for the same document is the same job
+        assert (await second.submit(URL + "?sig=other")).job_id == job.job_id
+        assert (await second.get(job.job_id)).status in ("queued", "running")
+
+        waiter = asyncio.create_task(second.wait_for(URL))
+        await asyncio.sleep(0.3)
+        assert not waiter.done()
+        release.set()
+        await asyncio.wait_for(waiter, 5)
+        assert (await second.get(job.job_id)).status == "completed"
+        assert (await second.get(job.job_id)).stage == "indexed"
+        await first.stop()
+        await second.stop()
+
+    asyncio.run(main())
+
+def test_unsigned_urls_differing_in_parameters_get_their_own_jobs(tmp_path, monkeypatch):
+    async def main():
+        monkeypatch.setattr(IngestionQueue, "_run", _slow_run(asyncio.Event()))
+        queue = IngestionQueue(store=IngestionJobStore(str(tmp_path / "jobs.sqlite3")))
+        first = await queue.submit("https://insurer.example/docs?policy=1")
+        second = await queue.submit("https://insurer.example/docs?policy=2")
+        assert second.job_id != first.job_id
+        assert (await asyncio.to_thread(queue.store.active, "https://insurer.example/docs?policy=2")).job_id == second.job_id
+        await queue.stop()
+
+    asyncio.run(main())
+
+def test_wait_for_covers_queued_jobs(tmp_path, monkeypatch):
+    async def main():
+        release = asyncio.Event()
+        monkeypatch.setattr(IngestionQueue, "_run", _slow_run(release))
+        queue = IngestionQueue(workers=1, store=IngestionJobStore(str(tmp_path / "jobs.sqlite3")))
+        await queue.submit("https://example.com/a.pdf")
+        queued = await queue.submit("https://example.com/b.pdf")
+        await asyncio.sleep(0.05)
+        assert (await queue.get(queued.job_id)).status == "queued"
+
+        waiter = asyncio.create_task(queue.wait_for("https://example.com/b.pdf"))
+        await asyncio.sleep(0.05)
+        assert not waiter.done()
+        release.set()
+        await asyncio.wait_for(waiter, 5)
+        assert (await queue.get(queued.job_id)).status == "completed"
+        await queue.stop()
+
+    asyncio.run(main())
+
+def test_jobs_of_a_dead_worker_are_failed_and_resubmittable(tmp_path, monkeypatch):
+    store = IngestionJobStore(str(tmp_path / "jobs.sqlite3"))
+    orphan = store.create(IngestionJob(job_id="orphan", document_url=URL, heartbeat_at=time.time() - 60), owner="gone")
+
+    async def main():
+        release = asyncio.Event()
+        release.set()
+        monkeypatch.setattr(IngestionQueue, "_run", _slow_run(release))
+        queue = IngestionQueue(store=store)
+        # Nobody refreshes the orphan, so waiting on it returns instead of hanging
+        await asyncio.wait_for(queue.wait_for(URL), 5)
+        assert store.get(orphan.job_id).status == "failed"
+        assert (await queue.submit(URL)).job_id != orphan.job_id
+        await queue.stop()
+
+    asyncio.run(main())
+
+def test_stop_fails_unfinished_jobs(tmp_path, monkeypatch):
+    store = IngestionJobStore(str(tmp_path / "jobs.sqlite3"))
+
+    async def main():
+        monkeypatch.setattr(IngestionQueue, "_run", _slow_run(asyncio.Event()))
+        queue = IngestionQueue(store=store)
+        job = await queue.submit(URL)
+        await asyncio.sleep(0.05)
+        await queue.stop()
+        return job
+
+    job = asyncio.run(main())
+    assert store.get(job.job_id).status == "failed"
+    assert store.active(URL) is None
+
+def test_finished_jobs_beyond_history_are_pruned(tmp_path, monkeypatch):
+    store = IngestionJobStore(str(tmp_path / "jobs.sqlite3"))
+
+    async def main():
+        release = asyncio.Event()
+        release.set()
+        monkeypatch.setattr(IngestionQueue, "_run", _slow_run(release))
+        queue = IngestionQueue(history=2, store=store)
+        jobs = []
+        for i in range(4):
+            jobs.append(await queue.submit(f"https://example.com/{i}.pdf"))
+            await queue.wait_for(f"https://example.com/{i}.pdf")
+        await queue.submit("https://example.com/last.pdf")
+        await queue.stop()
+        return jobs
+
+    jobs = asyncio.run(main())
+    assert store.get(jobs[0].job_id) is None and store.get(jobs[1].job_id) is None
+    assert store.get(jobs[3].job_id) is not None
+
+def test_store_calls_do_not_block_the_event_loop(tmp_path, monkeypatch):
+    store = IngestionJobStore(str(tmp_path / "jobs.sqlite3"))
+    real_active = store.active
+
+    def busy_active(document_url):
+        # Stands in for waiting on another worker's write lock
+        time.sleep(0.3)
+        return real_active(document_url)
+
+    monkeypatch.setattr(store, "active", busy_active)
+
+    async def main():
+        monkeypatch.setattr(IngestionQueue, "_run", _slow_run(asyncio.Event()))
+        queue = IngestionQueue(store=store)
+        ticks = 0
+
+        async def tick():
+            nonlocal ticks
+            while True:
+                ticks += 1
+                await asyncio.sleep(0.01)
+
+        ticker = asyncio.create_task(tick())
+        job = await queue.submit(URL)
+        assert (await queue.get(job.job_id)).job_id == job.job_id
+        ticker.cancel()
+        await queue.stop()
+        return ticks
+
+    assert asyncio.run(main()) >= 10
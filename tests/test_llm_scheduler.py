@@ -0,0 +1,130 @@
+import time
+import asyncio
+from google.genai.errors import ClientError
+from fakes import FakeEmbeddings, FakeRateLimit, FakeRateLimitError
+from llm_scheduler import ModelLimiter, ScheduledEmbeddings, is_rate_limit_error
+
+def _limiter(max_concurrency: int = 8, **kwargs) -> ModelLimiter:
+    kwargs = {"max_retries": 3, "backoff_base_s": 0.05, "backoff_max_s": 0.2, **kwargs}
+    return ModelLimiter("test-model", max_concurrency, **kwargs)
+
+def test_rate_limit_errors_are_recognised_by_type_and_status():
+    assert is_rate_limit_error(FakeRateLimitError("quota"))
+    assert is_rate_limit_error(ClientError(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}}))
+    try:
+        try:
+            raise FakeRateLimitError("quota")
+        except FakeRateLimitError as e:
+            raise RuntimeError("wrapped by the client") from e
+    except RuntimeError as wrapped:
+        assert is_rate_limit_error(wrapped)
+    # A message that merely mentions 429 is not a quota error
+    assert not is_rate_limit_error(ValueError("row 429 is malformed"))
+    assert not is_rate_limit_error(ClientError(400, {"error": {"code": 400, "status": "INVALID_ARGUMENT"}}))
+
+def test_retries_with_backoff_after_rate_limit():
+    limiter = _limiter()
+    failures = iter([FakeRateLimitError("quota"), FakeRateLimitError("quota")])
+
+    def call():
+        error = next(failures, None)
+        if error is not None:
+            raise error
+        return "ok"
+
+    started = time.monotonic()
+    assert limiter.run(call) == "ok"
+    # Backoff doubles: ~0.05s then ~0.1s, each with +-20% jitter
+    assert time.monotonic() - started >= 0.12
+    assert limiter.rate_limited == 2
+
+def test_gives_up_after_max_retries():
+    limiter = _limiter(max_retries=1)
+
+    async def call():
+        raise FakeRateLimitError("quota")
+
+    try:
+        asyncio.run(limiter.arun(call))
+    except FakeRateLimitError:
+        pass
+    else:
+        raise AssertionError("expected the rate limit error to propagate")
+    assert limiter.rate_limited == 2
+
+def test_concurrency_halves_on_rate_limit_and_recovers():
+    limiter = _limiter(max_concurrency=8, max_retries=0, backoff_base_s=0.001)
+
+    def fail():
+        raise FakeRateLimitError("quota")
+
+    for expected in (4, 2, 1, 1):
+        try:
+            limiter.run(fail)
+        except FakeRateLimitError:
+            pass
+        assert limiter._limit == expected
+    for expected in range(2, 9):
+        limiter.run(lambda: None)
+        assert limiter._limit == expected
+    limiter.run(lambda: None)
+    assert limiter._limit == 8
+
+def test_concurrent_calls_settle_under_provider_quota():
+    quota = FakeRateLimit(max_concurrency=2)
+    embeddings = FakeEmbeddings(latency_s=0.02, rate_limit=quota)
+    limiter = _limiter(max_concurrency=8, max_retries=10, backoff_base_s=0.01, backoff_max_s=0.05)
+
+    async def main():
+        return await asyncio.gather(*(limiter.arun(lambda i=i: embeddings.aembed_query(f"text {i}")) for i in range(16)))
+
+    vectors = asyncio.run(main())
+    assert len(vectors) == 16
+    assert quota.rejected > 0
+    assert limiter.rate_limited == quota.rejected
+
+def test_concurrent_embedding_calls_are_coalesced():
+    fake = FakeEmbeddings(latency_s=0)
+    embeddings = ScheduledEmbeddings(fake, _limiter(), window_ms=50, max_texts=100)
+    batches = [[f"chunk {i}-{j}" for j in range(3)] for i in range(5)]
+
+    async def main():
+        return await asyncio.gather(*(embeddings.aembed_documents(batch) for batch in batches))
+
+    results = asyncio.run(main())
+    assert fake.calls == 1
+    assert results == [fake.embed_documents(batch) for batch in batches]
+
+def test_full_batch_cancels_its_window_timer():
+    fake = FakeEmbeddings(latency_s=0)
+    embeddings = ScheduledEmbeddings(fake, _limiter(), window_ms=200, max_texts=2)
+
+    async def main():
+        # The second call fills the batch, which flushes at once
+        await asyncio.gather(embeddings.aembed_documents(["a"]), embeddings.aembed_documents(["b"]))
+        assert not embeddings._timers
+        await asyncio.sleep(0.1)
+        # A later batch gets its own full window rather than the first batch's leftover timer
+        started = time.monotonic()
+        await embeddings.aembed_documents(["c"])
+        return time.monotonic() - started
+
+    assert asyncio.run(main()) >= 0.18
+    assert fake.calls == 2
+
+def test_flush_tasks_are_held_until_done():
+    import gc
+    fake = FakeEmbeddings(latency_s=0.05)
+    embeddings = ScheduledEmbeddings(fake, _limiter(), window_ms=10, max_texts=100)
+
+    async def main():
+        pending = asyncio.ensure_future(embeddings.aembed_documents(["a", "b"]))
+        await asyncio.sleep(0.03)
+        # The flush is running; nothing but the wrapper references its task
+        assert len(embeddings._flushes) == 1
+        gc.collect()
+        vectors = await asyncio.wait_for(pending, 5)
+        assert not embeddings._flushes
+        return vectors
+
+    assert len(asyncio.run(main())) == 2
@@ -0,0 +1,67 @@
+import asyncio
+from fakes import FakeChatModel
+from models import GeneratedQueries, GeneratedQueriesForEachQuestion
+from query_decomposer import QueryDecomposer
+
+class ScriptedChatModel(FakeChatModel):
+    """FakeChatModel whose decompositions can be altered per question, or per shard by its first question."""
+
+    def __init__(self, queries=None, drop_entry_for=()):
+        super().__init__(latency_s=0)
+        self.queries = queries or {}
+        self.drop_entry_for = set(drop_entry_for)
+
+    def _respond(self, schema, text):
+        generated = super()._respond(schema, text)
+        if schema is not GeneratedQueries:
+            return generated
+        questions = [entry.queries[0].rsplit(" definition", 1)[0] for entry in generated.lst]
+        if questions[0] in self.drop_entry_for:
+            # Too few entries to line up with the shard's questions
+            return GeneratedQueries(lst=generated.lst[1:])
+        return GeneratedQueries(lst=[
+            GeneratedQueriesForEachQuestion(queries=self.queries[q]) if q in self.queries else entry
+            for q, entry in zip(questions, generated.lst)
+        ])
+
+def _decompose(decomposer: QueryDecomposer, questions):
+    return asyncio.run(decomposer.adecompose(questions))
+
+def test_wrong_entry_count_falls_back_for_that_shard_only():
+    llm = ScriptedChatModel(drop_entry_for={"q3"})
+    result = _decompose(QueryDecomposer(llm, shard_size=2, per_question=3), ["q1", "q2", "q3", "q4"])
+    assert result[0] == ["q1 definition", "q1 conditions", "q1 limits", "q1"]
+    assert result[1] == ["q2 definition", "q2 conditions", "q2 limits", "q2"]
+    # The second shard could not be matched to its questions, so they are searched as asked
+    assert result[2] == ["q3"] and result[3] == ["q4"]
+    assert llm.calls == 2
+
+def test_blank_entry_falls_back_for_that_question_only():
+    llm = ScriptedChatModel(queries={"q2": ["", "   "]})
+    result = _decompose(QueryDecomposer(llm, shard_size=4, per_question=3), ["q1", "q2", "q3"])
+    assert result[1] == ["q2"]
+    assert result[0][-1] == "q1" and len(result[0]) == 4
+    assert result[2][-1] == "q3" and len(result[2]) == 4
+
+def test_query_lists_may_differ_in_length():
+    llm = ScriptedChatModel(queries={"q1": ["only one"], "q2": ["a", "a ", "b", "c", "d"]})
+    result = _decompose(QueryDecomposer(llm, per_question=3), ["q1", "q2"])
+    # Duplicates are dropped and each list is capped at per_question generated queries
+    assert result == [["only one", "q1"], ["a", "b", "c", "q2"]]
+
+def test_cache_hit_makes_no_llm_call():
+    llm = ScriptedChatModel()
+    decomposer = QueryDecomposer(llm, max_size=10)
+    first = _decompose(decomposer, ["What is the grace period?"])
+    assert llm.calls == 1
+    # Whitespace differences normalize to the same key
+    again = _decompose(decomposer, ["What is the  grace period? "])
+    assert llm.calls == 1
+    assert again[0][:-1] == first[0][:-1]
+
+def test_failed_decompositions_are_not_cached():
+    llm = ScriptedChatModel(queries={"q1": [" "]})
+    decomposer = QueryDecomposer(llm, max_size=10)
+    _decompose(decomposer, ["q1"])
+    _decompose(decomposer, ["q1"])
+    assert llm.calls == 2
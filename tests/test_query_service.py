@@ -0,0 +1,34 @@
+import asyncio
+from conftest import make_pdf
+from models import CitedAnswer, Question
+
+QUESTIONS = [Question(question="What is the grace period?")]
+
+def test_identical_documents_are_indexed_and_cited_once(doc_server, document_cache, stub_query_service):
+    pdf = make_pdf(label="HDFC")
+    doc_server.write("a.pdf", pdf)
+    doc_server.write("b.pdf", pdf)
+    first, second = doc_server.url("a.pdf"), doc_server.url("b.pdf")
+    service, indexed, calls = stub_query_service()
+    answers = asyncio.run(service.aprocess_queries([first, second], QUESTIONS))
+    assert len(indexed) == 1
+    assert answers == [CitedAnswer(answer="answer to What is the grace period?", sources=[first])]
+
+def test_sources_are_the_requested_urls(doc_server, document_cache, stub_query_service):
+    doc_server.write("a.pdf", make_pdf(label="HDFC"))
+    doc_server.write("b.pdf", make_pdf(label="BAJAJ"))
+    first, second = doc_server.url("a.pdf"), doc_server.url("b.pdf")
+    service, indexed, _ = stub_query_service()
+    (answer,) = asyncio.run(service.aprocess_queries([first, second], QUESTIONS))
+    assert len(set(indexed)) == 2
+    assert answer.sources == [first, second]
+
+def test_scope_does_not_depend_on_document_order(doc_server, document_cache, stub_query_service):
+    doc_server.write("a.pdf", make_pdf(label="HDFC"))
+    doc_server.write("b.pdf", make_pdf(label="BAJAJ"))
+    first, second = doc_server.url("a.pdf"), doc_server.url("b.pdf")
+    service, _, calls = stub_query_service()
+    asyncio.run(service.aprocess_queries([first, second], QUESTIONS))
+    (answer,) = asyncio.run(service.aprocess_queries([second, first], QUESTIONS))
+    assert len(calls) == 1
+    assert sorted(answer.sources) == sorted([first, second])
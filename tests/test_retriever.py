@@ -0,0 +1,83 @@
+import gc
+import os
+import time
+import asyncio
+import threading
+import retriever
+from ingestion_manifest import IngestionManifest
+
+def test_ingest_locks_are_shared_while_held_and_pruned_after():
+    lock = retriever._ingest_lock(retriever._ingest_thread_locks, "doc-a", threading.Lock)
+    assert retriever._ingest_lock(retriever._ingest_thread_locks, "doc-a", threading.Lock) is lock
+    with lock:
+        assert retriever._ingesting("doc-a")
+    del lock
+    gc.collect()
+    assert "doc-a" not in retriever._ingest_thread_locks
+    assert not retriever._ingesting("doc-a")
+
+def test_async_ingest_locks_are_pruned():
+    async def ingest():
+        async with retriever._ingest_lock(retriever._ingest_locks, "doc-b", asyncio.Lock):
+            assert retriever._ingesting("doc-b")
+
+    asyncio.run(ingest())
+    gc.collect()
+    assert "doc-b" not in retriever._ingest_locks
+
+def _index(backend, manifest, url: str, content_hash: str):
+    os.makedirs(os.path.join(backend.root, content_hash), exist_ok=True)
+    manifest.record(url, content_hash, backend.name, retriever.SPLITTER_SIGNATURE, "fake", 1)
+
+def test_replaced_index_is_dropped_by_compaction_after_grace(tmp_path, monkeypatch):
+    backend = retriever.NumpyBackend(root=str(tmp_path / "numpy"))
+    manifest = IngestionManifest(str(tmp_path / "manifest.sqlite3"))
+    monkeypatch.setattr(retriever, "_backend", backend)
+    monkeypatch.setattr(retriever, "_manifest", manifest)
+    url = "https://example.com/policy.pdf"
+    _index(backend, manifest, url, "v1")
+    _index(backend, manifest, url, "v2")
+    manifest.retire("v1", backend.name)
+
+    # Within the grace period a search that resolved v1 can still use it
+    retriever.compact_indexes()
+    assert backend.has_index("v1")
+
+    monkeypatch.setattr(retriever, "EVICTION_GRACE_S", -1)
+    retriever.compact_indexes()
+    assert not backend.has_index("v1") and backend.has_index("v2")
+    assert "v1" not in manifest.tracked(backend.name)
+
+def test_retired_index_served_again_is_kept(tmp_path):
+    manifest = IngestionManifest(str(tmp_path / "manifest.sqlite3"))
+    manifest.record("https://example.com/a.pdf", "v1", "numpy", "splitter", "fake", 1)
+    manifest.record("https://example.com/a.pdf", "v2", "numpy", "splitter", "fake", 1)
+    manifest.retire("v1", "numpy")
+    assert manifest.retired("numpy", before=time.time() + 1) == ["v1"]
+    manifest.record("https://example.com/b.pdf", "v1", "numpy", "splitter", "fake", 1)
+    assert manifest.retired("numpy", before=time.time() + 1) == []
+
+def test_distinct_url_is_not_treated_as_new_version(tmp_path, monkeypatch, doc_server, document_cache):
+    import document_manager
+    from conftest import make_pdf
+    from document_manager import DocumentManager
+    # Always ask the origin, so each URL resolves to the bytes it serves
+    monkeypatch.setattr(document_manager, "DOC_REVALIDATE_AFTER_S", 0)
+    backend = retriever.NumpyBackend(root=str(tmp_path / "numpy"))
+    manifest = IngestionManifest(str(tmp_path / "manifest.sqlite3"))
+    monkeypatch.setattr(retriever, "_backend", backend)
+    monkeypatch.setattr(retriever, "_manifest", manifest)
+    retired = []
+    monkeypatch.setattr(manifest, "retire", lambda content_hash, backend_name: retired.append(content_hash))
+
+    doc_server.write("docs", make_pdf(label="HDFC"))
+    first = DocumentManager(doc_server.url("docs?policy=HDFC-001"))
+    retriever.VectorStoreProvider(first)
+    doc_server.write("docs", make_pdf(label="BAJAJ"))
+    second = DocumentManager(doc_server.url("docs?policy=BAJAJ-777"))
+    retriever.VectorStoreProvider(second)
+
+    assert second.get_content_hash() != first.get_content_hash()
+    assert retired == []
+    assert backend.has_index(first.get_content_hash()) and backend.has_index(second.get_content_hash())
+    assert manifest.source_hash(first.document_url) == first.get_content_hash()
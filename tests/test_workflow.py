@@ -0,0 +1,56 @@
+import time
+import asyncio
+import numpy as np
+from langchain_core.documents import Document
+import workflow
+from fakes import FakeEmbeddings
+from models import Question
+from workflow import RAGWorkflow
+
+_CORPUS = [Document(page_content=f"Clause {i}: the grace period is {i} days.", metadata={"page": i}) for i in range(12)]
+_CORPUS_VECTORS = np.asarray(FakeEmbeddings().embed_documents([d.page_content for d in _CORPUS]))
+QUESTIONS = [Question(question="What is the grace period?"), Question(question="Which clause covers renewals?")]
+
+def _install_search(monkeypatch, original_delay_s: float = 0.0):
+    """Deterministic search over a small corpus; searches of the original questions take `original_delay_s`."""
+    calls = []
+
+    async def search(retrievers, vectors, k=None):
+        started = time.monotonic()
+        if len(vectors) == len(QUESTIONS):
+            await asyncio.sleep(original_delay_s)
+        scores = np.asarray(vectors) @ _CORPUS_VECTORS.T
+        hits = [
+            [(Document(page_content=_CORPUS[j].page_content, metadata=dict(_CORPUS[j].metadata)), float(row[j])) for j in np.argsort(-row)[:k or 4]]
+            for row in scores
+        ]
+        calls.append((len(vectors), started, time.monotonic()))
+        return hits
+
+    monkeypatch.setattr(workflow, "asearch_union_with_scores", search)
+    return calls
+
+def _workflow(speculative: bool, decompose_s: float = 0.0) -> RAGWorkflow:
+    wf = RAGWorkflow(speculative=speculative)
+
+    async def decompose(questions):
+        await asyncio.sleep(decompose_s)
+        return [[f"{q} definition", f"{q} conditions", q] for q in questions]
+
+    wf.query_decomposer.adecompose = decompose
+    return wf
+
+def test_speculative_answers_match_linear(monkeypatch):
+    _install_search(monkeypatch)
+    linear = asyncio.run(_workflow(speculative=False).ainvoke(QUESTIONS, []))
+    speculative = asyncio.run(_workflow(speculative=True).ainvoke(QUESTIONS, []))
+    assert [(a.answer, a.sources) for a in speculative] == [(a.answer, a.sources) for a in linear]
+
+def test_generated_queries_are_searched_while_original_search_runs(monkeypatch):
+    calls = _install_search(monkeypatch, original_delay_s=0.3)
+    answers = asyncio.run(_workflow(speculative=True, decompose_s=0.01).ainvoke(QUESTIONS, []))
+    assert len(answers) == len(QUESTIONS)
+    (original,) = [call for call in calls if call[0] == len(QUESTIONS)]
+    (generated,) = [call for call in calls if call[0] != len(QUESTIONS)]
+    # The generated queries did not wait for the slower original search to finish
+    assert generated[1] < original[2]
@@ -0,0 +1,33 @@
+import asyncio
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Optional
+from config import PARSE_WORKERS
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """Return the process-wide pool used for CPU-bound parsing, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn keeps the workers free of the parent's gRPC/sqlite state
+            _pool = ProcessPoolExecutor(
+                max_workers=PARSE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+async def run_in_process(func: Callable[..., Any], *args: Any) -> Any:
+    """Run a picklable, module-level function in the parsing pool without blocking the event loop."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_process_pool(), func, *args)
+
+def shutdown_process_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
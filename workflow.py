@@ -1,59 +1,91 @@
-from typing import TypedDict, List
+import asyncio
+from typing import Awaitable, Callable, Dict, Optional, TypedDict, List, Tuple, Union
 from langchain_core.documents import Document
-from langgraph.graph import StateGraph, END
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langgraph.graph import StateGraph, START, END
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.vectorstores import VectorStoreRetriever
-from langchain_core.runnables import RunnableParallel
+from langchain_core.retrievers import BaseRetriever
 from models import *
-from config import ANSWER_LLM_MODEL,QUERY_LLM_MODEL,GOOGLE_API_KEY
+from retriever import get_embeddings, asearch_union_with_scores
+from context_packer import ContextPacker, chunk_position
+from question_grouping import group_questions
+from query_embedder import QueryEmbedder
+from model_clients import create_chat_model
+from query_decomposer import QueryDecomposer
+from admission import RequestBudget
+from config import (
+    ANSWER_LLM_MODEL,
+    QUERY_LLM_MODEL,
+    GROUPED_GENERATION_ENABLED,
+    SPECULATIVE_RETRIEVAL_ENABLED,
+    EARLY_GENERATION_ENABLED,
+    DEGRADE_SKIP_DECOMPOSITION_BELOW_S,
+    DEGRADE_REDUCE_K_BELOW_S,
+    DEGRADE_SHORTEN_CONTEXT_BELOW_S,
+    DEGRADED_RETRIEVAL_K,
+    DEGRADED_CONTEXT_TOKEN_BUDGET,
+)
 from pprint import pprint
+import metrics
+
+# Receives progress events ({"event": "stage", ...} / {"event": "answer", "index": i, ...}) as they happen
+EventCallback = Callable[[dict], Awaitable[None]]
 
 class GraphState(TypedDict):
     original_questions: List[Question]
+    on_event: Optional[EventCallback]
+    budget: Optional[RequestBudget]
     decomposed_questions: GeneratedQueries
-    retriever: VectorStoreRetriever
+    # Search of the original questions, started alongside decomposition (speculative mode only)
+    original_search: Optional["asyncio.Task"]
+    # Answers started early, by question index, with the context they were generated from
+    speculative: Dict[int, Tuple[str, "asyncio.Task"]]
+    # One per requested document; every question is searched across all of them
+    retrievers: List[BaseRetriever]
     documents: List[List[Document]]
-    answers: List[FinalAnswer]
+    answers: List[CitedAnswer]
+
+# Bump whenever the generation prompt changes so cached answers from the old prompt are not reused
+ANSWER_PROMPT_VERSION = "1"
 
 class RAGWorkflow:
-    def __init__(self):
-        self.generation_llm = ChatGoogleGenerativeAI(model=ANSWER_LLM_MODEL, api_key=GOOGLE_API_KEY, temperature=0)
-        self.decomposition_llm = ChatGoogleGenerativeAI(model=QUERY_LLM_MODEL, api_key=GOOGLE_API_KEY, temperature=0)
+    def __init__(self, speculative: bool = SPECULATIVE_RETRIEVAL_ENABLED, early_generation: bool = EARLY_GENERATION_ENABLED):
+        self.speculative = speculative
+        self.early_generation = speculative and early_generation
+        # Both go through the process-wide scheduler, so concurrent requests share each model's limits
+        self.generation_llm = create_chat_model(ANSWER_LLM_MODEL)
+        self.decomposition_llm = create_chat_model(QUERY_LLM_MODEL)
+        self.query_embedder = QueryEmbedder(get_embeddings())
+        self.query_decomposer = QueryDecomposer(self.decomposition_llm)
+        self.context_packer = ContextPacker()
         self.graph = self._build_graph()
 
-    def _query_decomposition_node(self, state: GraphState):
-        prompt = ChatPromptTemplate.from_template(
-            """You are an expert research assistant.
-
-            Given a list of N user questions, generate for each question exactly 3 diverse, relevant search queries
-            useful for retrieving related information from documents.
-
-            Return a valid Pydantic object of type `GeneratedQueries`, which has a field `lst`, a list of length N.
-            Each element of `lst` must be a `GeneratedQueriesForEachQuestion`, containing a `queries` list of length 3.
-
-            QUESTIONS:
-            {questions}
-            """
-        )
-
-        questions_str = "\n".join(f"{i+1}. {q.question}" for i, q in enumerate(state["original_questions"]))
-
-        structured_llm = self.decomposition_llm.with_structured_output(GeneratedQueries)
-        chain = prompt | structured_llm
-        generated_lists: GeneratedQueries = chain.invoke({"questions": questions_str})  # type: ignore
-
-        if not generated_lists or len(generated_lists.lst) != len(state["original_questions"]):
-            lst = []
-            for q in state["original_questions"]:
-                lst.append(GeneratedQueriesForEachQuestion(queries=[q.question]))
-
-            default = GeneratedQueries(lst=lst)
-            return {"decomposed_questions": default}
+    async def _query_decomposition_node(self, state: GraphState):
+        questions = [q.question for q in state["original_questions"]]
+        budget = state.get("budget")
+        # The original questions are always among the queries, so their search need not wait for decomposition
+        original_search = asyncio.ensure_future(self._search_originals(state)) if self.speculative else None
+        try:
+            decomposed = await self._decompose(questions, budget)
+        except BaseException:
+            if original_search is not None:
+                original_search.cancel()
+            raise
+        return {"decomposed_questions": decomposed, "original_search": original_search}
 
-        for i,el in enumerate(generated_lists.lst):
-            el.queries.append(state["original_questions"][i].question)
-        return {"decomposed_questions": generated_lists}
+    async def _decompose(self, questions: List[str], budget: Optional[RequestBudget]) -> GeneratedQueries:
+        # Short on time, each question is searched as asked; decomposition may only run until the
+        # budget reaches that point, after which it is abandoned the same way
+        if budget and budget.below(DEGRADE_SKIP_DECOMPOSITION_BELOW_S):
+            budget.degrade("skipped_decomposition")
+            query_lists = [[q] for q in questions]
+        else:
+            timeout = budget.time_until(DEGRADE_SKIP_DECOMPOSITION_BELOW_S) if budget else None
+            try:
+                query_lists = await asyncio.wait_for(self.query_decomposer.adecompose(questions), timeout)
+            except asyncio.TimeoutError:
+                budget.degrade("decomposition_timed_out")
+                query_lists = [[q] for q in questions]
+        return GeneratedQueries(lst=[GeneratedQueriesForEachQuestion(queries=queries) for queries in query_lists])
 
     def pretty_print_documents_simple(self,documents: List[List[Document]], max_chars: int = 200):
         for qi, docs in enumerate(documents, start=1):
@@ -65,41 +97,118 @@ class RAGWorkflow:
                 text_snip = doc.page_content[:max_chars].replace("\n", " ")
                 print(f"  content_preview: {text_snip}{'...' if len(doc.page_content) > max_chars else ''}")
 
-    def _retrieval_node(self, state: GraphState):
+    async def _retrieval_node(self, state: GraphState):
         queries = []
         for query_object in state["decomposed_questions"].lst:
             queries.extend(query_object.queries)
         # batch run rather than sequential invoke
         # queries is a list of strings
         """
-        N initialy queries. Total 4 queries per original questions.
-        4N queries in queries[].
-        3 Chunks are returned.
-        docs_list->4N size. ech element containing a list of 3 Documents.
-        need to flatten every 4 nested lists together.
+        N initialy queries, each expanded into its own (possibly different) number of queries.
+        docs_list holds one list of chunks per query.
+        Consecutive lists belonging to the same question are flattened together.
         documents: N length nested list od documents.
         """
-        docs_lists = state["retriever"].batch(queries)
-        per_q = len(state["decomposed_questions"].lst[0].queries)
+        # The original question is appended to every list, so strings repeat; each distinct
+        # query is embedded once (one batched call, LRU-cached across requests) and searched once.
+        # In speculative mode the original questions are searched by a task started alongside
+        # decomposition; the generated queries are searched while it finishes, and each question's
+        # chunks are merged as soon as all of its queries have results.
+        k = self._retrieval_k(state.get("budget"))
+        query_lists = [query_object.queries for query_object in state["decomposed_questions"].lst]
+        searches = []
+        covered = set()
+        original_search = state.get("original_search")
+        if original_search is not None:
+            searches.append(original_search)
+            covered = {q.question for q in state["original_questions"]}
+        unique_queries = [query for query in dict.fromkeys(queries) if query not in covered]
+        if unique_queries:
+            searches.append(asyncio.ensure_future(self._search(state["retrievers"], unique_queries, k)))
+
+        results_by_query: Dict[str, List[Tuple[Document, float]]] = {}
         # flatten and dedupe by page content (or metadata)
-        documents:List[List[Document]] = []
-        for i in range(0,len(docs_lists), per_q):
-            single_question_docs = [doc for docs in docs_lists[i:i+per_q] for doc in docs]
-            unique = {doc.page_content: doc for doc in single_question_docs}
-            documents.append(list(unique.values()))
+        documents: List[Optional[List[Document]]] = [None] * len(query_lists)
+        try:
+            for arrived in asyncio.as_completed(searches):
+                for query, hits in (await arrived).items():
+                    results_by_query[query] = hits[:k] if k else hits
+                for i, question_queries in enumerate(query_lists):
+                    if documents[i] is None and all(query in results_by_query for query in question_queries):
+                        documents[i] = self._merge_hits([results_by_query[query] for query in question_queries])
+        except BaseException:
+            for search in searches:
+                search.cancel()
+            raise
 
         # self.pretty_print_documents_simple(documents)
+        if state.get("on_event"):
+            await state["on_event"]({"event": "stage", "stage": "retrieved"})
 
         return {"documents": documents}
 
-    def _generation_node(self, state: GraphState):
-        contexts = [
-            "\n\n---\n\n".join([doc.page_content for doc in docs])
-            for docs in state["documents"]
-        ]
-        questions = [q.question for q in state["original_questions"]]
-        N = len(questions)
+    def _retrieval_k(self, budget: Optional[RequestBudget]) -> Optional[int]:
+        if budget and budget.below(DEGRADE_REDUCE_K_BELOW_S):
+            budget.degrade("reduced_k")
+            return DEGRADED_RETRIEVAL_K
+        return None
+
+    def _merge_hits(self, hit_lists: List[List[Tuple[Document, float]]]) -> List[Document]:
+        # keep each chunk once, with the best score any of the question's queries gave it
+        unique: dict = {}
+        for hits in hit_lists:
+            for doc, score in hits:
+                if doc.page_content not in unique or score > unique[doc.page_content].metadata["relevance_score"]:
+                    doc.metadata["relevance_score"] = score
+                    unique[doc.page_content] = doc
+        return list(unique.values())
+
+    async def _search(self, retrievers: List[BaseRetriever], queries: List[str], k: Optional[int]) -> Dict[str, List[Tuple[Document, float]]]:
+        vectors = await self.query_embedder.aembed(queries)
+        return dict(zip(queries, await asearch_union_with_scores(retrievers, vectors, k)))
+
+    async def _search_originals(self, state: GraphState) -> Dict[str, List[Tuple[Document, float]]]:
+        """
+        Speculative search run alongside decomposition: search each original question, which is
+        always one of its queries, and optionally start answering from those chunks straight away.
+        """
+        with metrics.stage("retrieve_original"):
+            questions = list(dict.fromkeys(q.question for q in state["original_questions"]))
+            original_hits = await self._search(state["retrievers"], questions, self._retrieval_k(state.get("budget")))
+        if self.early_generation:
+            self._start_early_generation(state, original_hits)
+        return original_hits
+
+    def _start_early_generation(self, state: GraphState, original_hits: Dict[str, List[Tuple[Document, float]]]):
+        token_budget = self._context_token_budget(state.get("budget"))
+        chain = self._answer_chain()
+        for i, question in enumerate(q.question for q in state["original_questions"]):
+            context, _ = self.context_packer.pack_with_sources(
+                self._scored(self._merge_hits([original_hits[question]])), token_budget,
+            )
+            task = asyncio.ensure_future(chain.ainvoke({"context": context, "question": question}))
+            # An answer that is discarded must not log an unretrieved exception
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            state["speculative"][i] = (context, task)
+
+    def _scored(self, docs: List[Document]):
+        return [(doc, doc.metadata.get("relevance_score", 0.0)) for doc in docs]
+
+    def _group_context(self, group: List[int], documents: List[List[Document]], token_budget: int) -> str:
+        # The union of the members' chunks, with a budget scaled by how much it exceeds the largest member's set
+        scored = [pair for i in group for pair in self._scored(documents[i])]
+        union = {chunk_position(doc) or doc.page_content for doc, _ in scored}
+        largest = max(len(documents[i]) for i in group) or 1
+        return self.context_packer.pack(scored, int(token_budget * len(union) / largest))
 
+    def _context_token_budget(self, budget: Optional[RequestBudget]) -> int:
+        token_budget = self.context_packer.token_budget
+        if budget and budget.below(DEGRADE_SHORTEN_CONTEXT_BELOW_S):
+            budget.degrade("shortened_context")
+            token_budget = min(token_budget, DEGRADED_CONTEXT_TOKEN_BUDGET)
+        return token_budget
+
+    def _answer_chain(self):
         prompt = ChatPromptTemplate.from_template(
             """You are a highly knowledgeable assistant answering questions using the given context ONLY.
 
@@ -117,30 +226,149 @@ class RAGWorkflow:
             - `answer`: A direct, fact-based response.
             """
         )
-        structured_llm = self.generation_llm.with_structured_output(FinalAnswer)
-        chain = prompt | structured_llm
+        return prompt | self.generation_llm.with_structured_output(FinalAnswer)
+
+    async def _generation_node(self, state: GraphState):
+        budget = state.get("budget")
+        token_budget = self._context_token_budget(budget)
+        # Neighbouring chunks are merged and the best spans packed into a per-question token budget;
+        # the documents those spans come from are the sources cited with the answer
+        packed = [self.context_packer.pack_with_sources(self._scored(docs), token_budget) for docs in state["documents"]]
+        contexts = [context for context, _ in packed]
+        sources = [doc_sources for _, doc_sources in packed]
+        questions = [q.question for q in state["original_questions"]]
+        N = len(questions)
+
+        group_prompt = ChatPromptTemplate.from_template(
+            """You are a highly knowledgeable assistant answering questions using the given context ONLY.
+
+            Provide a concise, accurate answer to each question strictly based on the provided content.
+
+            CONTEXT:
+            {context}
+
+            QUESTIONS:
+            {questions}
+
+            INSTRUCTIONS:
+            - Use only the information in the context to formulate the answers.
+            - Avoid making assumptions or using external knowledge.
+            - Answer every question independently; do not merge or skip any.
+            - Your response should be a valid Pydantic object of type `GroupedAnswers` with one field:
+            - `answers`: a list of exactly {count} `FinalAnswer` objects, in the same order as the questions,
+              each with an `answer` field holding a direct, fact-based response.
+            """
+        )
+        chain = self._answer_chain()
+        group_chain = group_prompt | self.generation_llm.with_structured_output(GroupedAnswers)
         batch_inputs = [
             {"context": contexts[i], "question": questions[i]} for i in range(N)
         ]
 
-        # 2. Invoke the chain in batch mode. LangChain handles the parallel execution.
-        #    The result is already a list of FinalAnswer objects in the correct order.
-        final_answers: List[FinalAnswer] = chain.batch(batch_inputs) # type: ignore
+        # 2. Run the calls concurrently on the event loop, reporting each answer as soon as it is ready.
+        #    gather still returns the FinalAnswer objects in question order.
+        on_event = state.get("on_event")
+        final_answers: List[CitedAnswer] = [None] * N  # type: ignore
+
+        async def report(i: int, answer: FinalAnswer):
+            final_answers[i] = CitedAnswer(answer=answer.answer, sources=sources[i]) if answer else None  # type: ignore
+            if on_event:
+                await on_event({
+                    "event": "answer", "index": i,
+                    "answer": answer.answer if answer else None, "sources": sources[i] if answer else [],
+                })
+
+        async def generate(i: int):
+            await report(i, await chain.ainvoke(batch_inputs[i]))  # type: ignore
+
+        async def generate_group(group: List[int]):
+            try:
+                grouped: GroupedAnswers = await group_chain.ainvoke({  # type: ignore
+                    "context": self._group_context(group, state["documents"], token_budget),
+                    "questions": "\n".join(f"{n+1}. {questions[i]}" for n, i in enumerate(group)),
+                    "count": len(group),
+                })
+            except Exception as e:
+                print(f"Grouped generation failed for questions {group}: {e}")
+                grouped = None  # type: ignore
+            if not grouped or len(grouped.answers) != len(group):
+                # Answers cannot be matched to questions reliably; answer each one on its own
+                await asyncio.gather(*[generate(i) for i in group])
+                return
+            await asyncio.gather(*[
+                report(i, answer) if answer and answer.answer.strip() else generate(i)
+                for i, answer in zip(group, grouped.answers)
+            ])
+
+        # An answer started early stands when the merged context is exactly the one it was generated
+        # from, so it is the answer this call would give; otherwise it is dropped
+        early: Dict[int, asyncio.Task] = {}
+        speculative = state.get("speculative") or {}
+        if speculative:
+            for i, (context, task) in list(speculative.items()):
+                del speculative[i]
+                if context == contexts[i]:
+                    early[i] = task
+                else:
+                    task.cancel()
+            metrics.record_cache("early_generation", hits=len(early), misses=N - len(early))
+
+        async def use_early(i: int):
+            try:
+                answer = await early[i]
+            except Exception as e:
+                print(f"Early generation failed for question {i}: {e}")
+                answer = None
+            await (report(i, answer) if answer else generate(i))
+
+        groups = [[i] for i in range(N) if i not in early]
+        if GROUPED_GENERATION_ENABLED:
+            groups = group_questions([
+                {chunk_position(doc) or doc.page_content for doc in docs} for docs in state["documents"]
+            ])
+            groups = [members for members in ([i for i in group if i not in early] for group in groups) if members]
+        await asyncio.gather(
+            *[use_early(i) for i in early],
+            *[generate(group[0]) if len(group) == 1 else generate_group(group) for group in groups],
+        )
         return {"answers": final_answers}
 
     def _build_graph(self):
         workflow = StateGraph(GraphState)
-        workflow.add_node("decompose_query", self._query_decomposition_node)
-        workflow.add_node("retrieve", self._retrieval_node)
-        workflow.add_node("generate", self._generation_node)
-        workflow.set_entry_point("decompose_query")
+        workflow.add_node("decompose_query", metrics.timed("decompose", self._query_decomposition_node))
+        workflow.add_node("retrieve", metrics.timed("retrieve", self._retrieval_node))
+        workflow.add_node("generate", metrics.timed("generate", self._generation_node))
+        # In speculative mode decomposition also starts the search of the original questions
+        workflow.add_edge(START, "decompose_query")
         workflow.add_edge("decompose_query", "retrieve")
         workflow.add_edge("retrieve", "generate")
         workflow.add_edge("generate", END)
         return workflow.compile()
 
-    def invoke(self, questions: List[Question], retriever: VectorStoreRetriever)->List[FinalAnswer]:
-        initial_state = {"original_questions": questions, "retriever": retriever}
-        final_state = self.graph.invoke(initial_state) # type: ignore
-        answer_objects:List[FinalAnswer] = final_state.get("answers") # type: ignore
-        return answer_objects
\ No newline at end of file
+    async def ainvoke(
+        self,
+        questions: List[Question],
+        retrievers: Union[BaseRetriever, List[BaseRetriever]],
+        on_event: Optional[EventCallback] = None,
+        budget: Optional[RequestBudget] = None,
+    )->List[CitedAnswer]:
+        """Answer `questions` from one document's retriever or several; each answer cites the content hashes it drew on."""
+        if not isinstance(retrievers, list):
+            retrievers = [retrievers]
+        speculative: Dict[int, Tuple[str, asyncio.Task]] = {}
+        initial_state = {
+            "original_questions": questions, "retrievers": retrievers, "on_event": on_event,
+            "budget": budget, "speculative": speculative,
+        }
+        try:
+            final_state = await self.graph.ainvoke(initial_state) # type: ignore
+        finally:
+            # Answers started early for a request that failed before generation
+            for _, task in speculative.values():
+                task.cancel()
+        answer_objects:List[CitedAnswer] = final_state.get("answers") # type: ignore
+        return answer_objects
+
+    def invoke(self, questions: List[Question], retriever: Union[BaseRetriever, List[BaseRetriever]])->List[CitedAnswer]:
+        # The graph nodes are async, so the sync entry point drives them on a fresh event loop
+        return asyncio.run(self.ainvoke(questions, retriever))
\ No newline at end of file